@@ -1,22 +1,33 @@
-import rumps
 import cv2
 import dlib
 import numpy as np
 import time
 from collections import Counter
-from ehg_nfeat24_B2_Hg1_D4_E1 import HourglassNet
-import torch
-import beepy
 
-from gaze import find_landmarks, detect_face, crop_eye, process_eyes, process_gaze, tuple_from_dlib_shape
+from gaze import detect_face, analyze_gaze
+from frame_context import FrameContext, shape_to_array
+import model_registry
 from emotion import EmotionDetector
 from blink import BlinkDetector
 from notification import Notification
-from file_manager import FileManager
+from alerts import AlertDispatcher
+from event_store import get_event_store
+from pipeline import FramePipeline, Stage
+from frame_store import FrameStore
+from face_tracker import FaceTracker
+from landmark_filter import LandmarkSmoother
+from eye_cropper import EyeCropper
+from overlay import OverlayRenderer
+from scheduler import StageScheduler
+from camera_hub import open_capture_device
+import metrics
 
 # Emotion Monitor Class
 class EmotionMonitor:
-    def __init__(self, notify = Notification()):
+    def __init__(self, notify = Notification(), pipelined = True, queue_size = 1, frame_history = 8, trace_gaze = False,
+                 gaze_backend = 'torch', emotion_backend = 'keras', track_faces = True,
+                 smooth_landmarks = True, headless = False, overlay_fps = 10,
+                 stage_rates = None, cpu_budget = None, camera = None, alerts = None):
         self.start_time = time.time()
         self.blink_start_time = time.time()
         self.emotion_counts = Counter()
@@ -29,26 +40,34 @@ class EmotionMonitor:
         self.total_blinks = 0
 
         self.cap = None
-        self.file_path = "FILES/ergo-sight-progress.txt"
+        # Shared CameraHub (e.g. with the posture monitor); None opens the webcam directly
+        self.camera = camera
         self.dominant_emotion = "Normal"
         
+        # Models come from the process-wide registry: loaded and warmed up by the first monitor,
+        # shared with the next ones, held by this monitor until stop_monitoring()
+        self.predictor_path = model_registry.PREDICTOR_PATH
+        try:
+            self.load_models(emotion_backend, gaze_backend, trace_gaze, headless)
+        except Exception:
+            # A monitor that failed to build holds nothing
+            model_registry.REGISTRY.release(self)
+            raise
+
         self.blink = BlinkDetector()
-        self.emotion = EmotionDetector ()
-        self.file = FileManager()
+        self.events = get_event_store()
 
         self.notify = notify
+        # Alerts are queued; sounds and notifications never hold up the frame loop
+        self.alerts = alerts or AlertDispatcher(notify)
 
-        # Load models and initialize constants
-        self.predictor_path = 'shape_predictor_68_face_landmarks.dat'
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor(self.predictor_path)
-
-        # Load gaze model
-        self.gaze_model = HourglassNet()
-        self.gaze_model = torch.nn.DataParallel(self.gaze_model)
-        checkpoint = torch.load('ehg_nfeat24_B2_Hg1_D4_E1.pth.tar', map_location='cpu')
-        checkpoint['state_dict'] = {k:v for (k, v) in checkpoint['state_dict'].items() if k.split('_')[-1] != 'tracked'}  
-        self.gaze_model.load_state_dict(checkpoint['state_dict'])
+        # Optical-flow face tracking between detections
+        self.tracker = FaceTracker(self.detector) if track_faces else None
+        # Temporal landmark filter, also decides when the predictor can be skipped
+        self.smoother = LandmarkSmoother() if smooth_landmarks else None
+        # Eye crops are written into a rotating pool of batches; it must outlive the frames in flight,
+        # in the pipeline queues and, for its picture-in-picture eyes, in the overlay renderer
+        self.cropper = EyeCropper(pool=2 * queue_size + 4 + (0 if headless else OverlayRenderer.FRAMES_HELD))
 
         self.last_frame_index = 0
 
@@ -56,147 +75,272 @@ class EmotionMonitor:
         print('==> Loading model')
 
         self._last_frame_index = 0
-        self._indices = []
-        self._frames = {}
+        # Recent frames used for face-detection reuse and temporal smoothing
+        self._frames = FrameStore(capacity=frame_history)
+
+        # Run capture, detection and gaze as a threaded pipeline
+        self.pipelined = pipelined
+        self.queue_size = queue_size
+        self.pipeline = None
+
+        # Headless: analysis only, no windows. Otherwise the overlay is drawn on its own thread.
+        self.headless = headless
+        # Processed frames per second, measured at the decision stage (shown in the overlay)
+        self.frame_rate = metrics.REGISTRY.meter('frame_rate', 'Frames through the decision stage per second')
+        self.renderer = None if headless else OverlayRenderer(size=(self.window_width, self.window_height),
+                                                               max_fps=overlay_fps, fps=self.frame_rate.rate)
+
+        # Per-stage rates: detection/blink on every frame, gaze at 10 Hz, the emotion CNN at 2 Hz.
+        # stage_rates overrides some of them; cpu_budget is in CPU-seconds per second (1.0 = one core).
+        rates = dict({'detect': None, 'gaze': 10, 'emotion': 2}, **(stage_rates or {}))
+        # While stable, gaze slows down to a fifth of its rate and the emotion CNN to a quarter
+        min_rates = {name: rates[name] * share for name, share in (('gaze', 0.2), ('emotion', 0.25)) if rates.get(name)}
+        self.scheduler = StageScheduler(rates, min_rates=min_rates, cpu_budget=cpu_budget)
+        self._last_gaze = None
+        self._last_emotion = None
+
+    def load_models(self, emotion_backend, gaze_backend, trace_gaze, headless):
+        # Gaze model ('torch', 'lean' or 'onnx'; run gaze_export.py / inference_backend.py to export them),
+        # checked before the other models are taken
+        self.gaze_model = model_registry.gaze_engine(gaze_backend, trace=trace_gaze, owner=self)
+        if getattr(self.gaze_model, 'channels', None) is not None and not headless:
+            raise ValueError("The gaze model only outputs landmarks {}; the overlay needs all 18, "
+                             "use it headless".format(self.gaze_model.channels))
+
+        self.emotion = EmotionDetector (backend=emotion_backend,
+                                        model=model_registry.emotion_backend(emotion_backend, owner=self))
+        self.detector = model_registry.face_detector(owner=self)
+        self.predictor = model_registry.landmark_predictor(self.predictor_path, owner=self)
 
     def send_notification(self, title, subtitle, message):
-        rumps.notification(title = title, subtitle = subtitle, message = message, sound=True)
+        # Through the notifier, which forwards to the app when this monitor runs in a worker process
+        self.notify.send_notification(title, subtitle, message)
 
     def get_video_capture_device(self):
-        # Check if cv2.VideoCapture(1) is available
-        if cv2.VideoCapture(1).isOpened():
-            return cv2.VideoCapture(1)
+        # A CameraHub subscription reads like a cv2.VideoCapture
+        if self.camera is not None:
+            return self.camera.subscribe('eye-strain')
+        # Prefers cv2.VideoCapture(1); the probe result is cached
+        return open_capture_device()
+
+    # Capture stage: grab a frame from the camera
+    def read_frame(self):
+        if self.cap is None or not self.cap.isOpened():
+            return False
+
+        ret, img = self.cap.read()
+        if not ret:
+            return None
+
+        self.last_frame_index += 1
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return FrameContext(self.last_frame_index, img, gray, time.time())
+
+    # Detection stage: faces, facial landmarks and eye crops
+    def detect(self, frame):
+        start = time.perf_counter()
+
+        #Face Detector
+        frame = detect_face(frame, self._frames, self.tracker, owner=self)
+
+        if frame['faces'] == None:
+            self._frames.add(frame)
+            self.scheduler.record('detect', time.perf_counter() - start)
+            return frame
+
+        #Face Landmarks, written once into the frame's [faces, 68, 2] array
+        landmarks = frame.allocate_landmarks(len(frame.faces))
+        for f, face in enumerate(frame.faces):
+
+            # Reuse the last landmarks while the face and eyes are still
+            if self.smoother is not None:
+                reused = self.smoother.reuse(f, face, frame.gray, len(frame.faces))
+                if reused is not None:
+                    landmarks[f] = reused
+                    continue
+
+            l, t, w, h = face
+            rectangle = dlib.rectangle(left=int(l), top=int(t), right=int(l+w), bottom=int(t+h))
+            with metrics.timer('landmark_predictor_seconds', 'dlib 68-point shape predictor per face'):
+                shape = self.predictor(frame.gray, rectangle)
+            shape_to_array(shape, landmarks[f])
+            if self.smoother is not None:
+                self.smoother.observe(f, face, frame.gray, landmarks[f])
+
+        # Extract the face regions; the last face drives the decisions
+        frame.face_rois = [frame.gray[max(t, 0):t + h, max(l, 0):l + w] for l, t, w, h in frame.faces]
+        frame.face_roi = frame.face_rois[-1]
+        if self.smoother is not None:
+            frame.smoothed_landmarks = self.smoother.smooth(landmarks, frame.timestamp)
+
+        #Eye Detector
+        frame = self.cropper.crop_eye(frame)
+        self._frames.add(frame)
+        self.scheduler.record('detect', time.perf_counter() - start)
+        return frame
+
+    # Gaze stage: eye landmarks and gaze direction
+    def estimate_gaze(self, frame):
+        if frame['faces'] == None or len(frame['eyes']) == 0:
+            self._last_gaze = None
+            return frame
+
+        # Between scheduled runs the last gaze estimate stands
+        if not self.scheduler.due('gaze') and self._last_gaze is not None:
+            frame['gaze'], frame['pitch'] = self._last_gaze
+            return frame
+
+        start = time.perf_counter()
+        # Eye Landmarks, decoded from the heatmaps of all eyes in one batch
+        landmarks = self.gaze_model.find_landmarks(frame)
+
+        results, frame['pitch'] = analyze_gaze (frame, landmarks)
+        self.scheduler.record('gaze', time.perf_counter() - start)
+
+        # Lower the gaze rate while the head pitch holds still
+        if self._last_gaze is not None:
+            self.scheduler.mark_stable('gaze', abs(frame['pitch'] - self._last_gaze[1]) < 0.02)
+        self._last_gaze = (results, frame['pitch'])
+        return frame
+
+    # Hands the frame to the overlay renderer and shows the latest overlay
+    # Returns False when the user asked to quit
+    def display(self, frame, status=None, color=(0, 255, 0)):
+        if self.renderer is None:
+            return True
+        self.renderer.submit(frame, status, color)
+        return self.renderer.show()
+
+    # Decision stage: emotion, blinks, notifications and display
+    # Returns False when the user asked to quit
+    def decide(self, frame):
+        self.frame_rate.mark()
+        if frame['faces'] == None or 'pitch' not in frame:
+            return self.display(frame, 'No Face Detected', (0, 0, 255))
+
+        if self._last_emotion is None or self.scheduler.due('emotion'):
+            start = time.perf_counter()
+            # The emotion windows are spans of time: size them for the rate the stage runs at
+            self.emotion.set_rate(self.scheduler.rate('emotion') or self.frame_rate.rate())
+            blink, predicted_emotion = self.emotion.predict_emotion(frame, frame['face_roi'], frame['pitch'], draw=False)
+            self.scheduler.record('emotion', time.perf_counter() - start)
+
+            if predicted_emotion is None:
+                return self.display(frame)
+
+            # Increment the count for the predicted emotion
+            self.emotion_counts[predicted_emotion] += 1
+
+            # Lower the emotion rate while the state does not change
+            if self._last_emotion is not None:
+                self.scheduler.mark_stable('emotion', predicted_emotion == self._last_emotion[1])
+            self._last_emotion = (blink, predicted_emotion)
         else:
-            return cv2.VideoCapture(0)         
+            blink, predicted_emotion = self._last_emotion
+
+        ear = self.blink.blink_detector(frame['landmarks'][-1])
+
+        # Calculate the eye aspect ratio (EAR)
+        if ear < self.blink.EYE_AR_THRESH:
+            if blink:
+                self.total_blinks += 1
+                # print ("BLINK INSTANCE")
+            # else:
+            #      print ("NOT BLINK INSTANCE")
+
+
+        # Check if the specified duration has elapsed
+        elapsed_time = time.time() - self.start_time
+        if elapsed_time >= self.emotion_duration:
+            # Determine the dominant emotion
+            self.dominant_emotion = self.emotion_counts.most_common(1)[0][0]
+            print("Dominant emotion over {} seconds: {}".format(self.emotion_duration, self.dominant_emotion))
+            if self.pipeline is not None:
+                print(self.pipeline.format_stats())
+            if self.tracker is not None:
+                print("Face tracker: {}".format(self.tracker.stats()))
+            if self.smoother is not None:
+                print("Landmark predictor: {}".format(self.smoother.stats()))
+            print(self.scheduler.format_stats())
+
+            self.events.record("Detected-Emotion", self.dominant_emotion)
+
+            if self.dominant_emotion == 'Fatigue':
+                # A notification, or a sound when notifications are off
+                self.alerts.alert('fatigue', "Feeling Tired?", "Take a Braek", "You Seems Tired!",
+                                  text=self.notify.eye_notification)
+
+            # Reset emotion counts for the next duration
+            self.emotion_counts.clear()
+            self.start_time = time.time()
+
+        #  Check if one minute has elapsed
+        if blink: 
+            elapsed_blink_time = time.time() - self.blink_start_time
+            if elapsed_blink_time >= self.blink_duration:
+                if self.total_blinks < self.MIN_BLINK_THRESHOULD:
+                    self.events.record("Blink-Alert", "Too-Few-Blinks")
+                    self.alerts.alert('blink-reminder', "Blink Reminder", "Keep Blinking",
+                                      "Don't forget to blink regularly for healthy eyes!",
+                                      text=self.notify.eye_notification)
+
+                elif self.total_blinks > self.MAX_BLINK_THRESHOULD :
+                    self.events.record("Blink-Alert", "Too-Many-Blinks")
+                    self.alerts.alert('blink-alert', "Blink Alert!", "Take a Break!",
+                                      "You've been blinking more frequently than usual.",
+                                      text=self.notify.eye_notification)
+
+                # Reset variables for the next minute
+                self.total_blinks = 0
+                self.blink_start_time = time.time()
+
+        return self.display(frame, predicted_emotion)
 
     def start_monitoring(self):
 
         self.cap = self.get_video_capture_device()
-        
-        while self.cap.isOpened():
-
-            ret, img = self.cap.read()
-
-            if not ret:
-                continue
-
-            self.last_frame_index =+ 1
-            self.current_index = self.last_frame_index
-            
-            # Operations on the frame come here
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            frame = {'frame_index': self.current_index,
-                        'bgr': img,
-                        'gray': gray,}
-
-            self._frames[self.current_index] = frame
-            self._indices.append(self.current_index)
-
-            #Face Detector
-            frame = detect_face(frame, self._indices, self._frames)
-            if frame['faces'] == None:
-                cv2.putText(frame['bgr'], 'No Face Detected', org=(20, 40), fontFace=cv2.FONT_HERSHEY_DUPLEX, fontScale=1.00,
-                            color=(0, 0, 255), thickness=1, lineType=cv2.LINE_AA)
-                resized_frame = cv2.resize(frame['bgr'], (self.window_width, self.window_height))
-                #cv2.imshow('frame', frame['bgr'])
-                cv2.imshow('Ergo-Sight', resized_frame)
-
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+        if self.renderer is not None:
+            self.renderer.start()
+
+        if not self.pipelined:
+            # Run every stage one after another on this thread
+            while self.cap.isOpened():
+                frame = self.read_frame()
+                if frame is False:
                     break
-                continue
-
-            #Face Landmarks
-            landmarks = []
-            for face in frame['faces']:
-
-                l, t, w, h = face
-                rectangle = dlib.rectangle(left=int(l), top=int(t), right=int(l+w), bottom=int(t+h))
-                landmarks_dlib = self.predictor(frame['gray'], rectangle)
-
-                num_landmarks = landmarks_dlib.num_parts
-                landmarks.append(np.array([tuple_from_dlib_shape(i, landmarks_dlib) for i in range(num_landmarks)]))
-
-
-            # Extract the face region
-            face_roi = gray[t:t + h, l:l + w]   
-            frame['landmarks'] = landmarks
-
-            #Eye Detector
-            frame = crop_eye(frame)
-            heatmaps = process_eyes (frame, self.gaze_model)
-            
-            # Eye Landmarks
-            landmarks = find_landmarks(heatmaps)
-
-            img, pitch = process_gaze (frame, landmarks, self.start_time)
-            blink, predicted_emotion = self.emotion.predict_emotion(frame, face_roi, pitch)
-
-            if predicted_emotion is None:
-                continue
-
-            # Increment the count for the predicted emotion
-            self.emotion_counts[predicted_emotion] += 1
+                if frame is None:
+                    continue
+                if not self.decide(self.estimate_gaze(self.detect(frame))):
+                    break
+        else:
+            # Capture, detection and gaze run on worker threads; decisions and
+            # OpenCV windows stay on this thread
+            self.pipeline = FramePipeline(self.read_frame,
+                                          [Stage('detect', self.detect),
+                                           Stage('gaze', self.estimate_gaze)],
+                                          queue_size=self.queue_size)
+            self.pipeline.start()
+            while self.pipeline.is_running():
+                frame = self.pipeline.get()
+                if frame is None:
+                    continue
+                if not self.decide(frame):
+                    break
+            self.pipeline.stop()
 
-            ear = self.blink.blink_detector(landmarks_dlib)
-
-            # Calculate the eye aspect ratio (EAR)
-            if ear < self.blink.EYE_AR_THRESH:
-                if blink:
-                    self.total_blinks += 1
-                    # print ("BLINK INSTANCE")
-                # else:
-                #      print ("NOT BLINK INSTANCE")
-
-
-            # Check if the specified duration has elapsed
-            elapsed_time = time.time() - self.start_time
-            if elapsed_time >= self.emotion_duration:
-                # Determine the dominant emotion
-                self.dominant_emotion = self.emotion_counts.most_common(1)[0][0]
-                print("Dominant emotion over {} seconds: {}".format(self.emotion_duration, self.dominant_emotion))
-
-                self.file.save_progress("Detected-Emotion",self.dominant_emotion, self.file_path)
-
-                if self.dominant_emotion == 'Fatigue':
-                    if self.notify.eye_notification:
-                        self.send_notification( "Feeling Tired?", "Take a Braek", "You Seems Tired!")
-                    else:
-                        beepy.beep(sound='error')
-
-                # Reset emotion counts for the next duration
-                self.emotion_counts.clear()
-                self.start_time = time.time()
-
-            #  Check if one minute has elapsed
-            if blink: 
-                elapsed_blink_time = time.time() - self.blink_start_time
-                if elapsed_blink_time >= self.blink_duration:
-                    if self.total_blinks < self.MIN_BLINK_THRESHOULD:
-                        if self.notify.eye_notification:
-                        # Send notification
-                            self.send_notification("Blink Reminder", "Keep Blinking" ,"Don't forget to blink regularly for healthy eyes!")
-                        else:
-                            beepy.beep(sound='error')
-
-                    elif self.total_blinks > self.MAX_BLINK_THRESHOULD :
-                        if self.notify.eye_notification:
-                        # Send notification
-                            self.send_notification("Blink Alert!", "Take a Break!" ,"You've been blinking more frequently than usual.")
-                        else:
-                            beepy.beep(sound='error')
-
-                    # Reset variables for the next minute
-                    self.total_blinks = 0
-                    self.blink_start_time = time.time()
-
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
         # When everything done, release the capture
+        if self.renderer is not None:
+            self.renderer.stop()
         self.cap.release()
         cv2.destroyAllWindows()    
+        model_registry.REGISTRY.release(self)
 
     def stop_monitoring (self):
         # Release the webcam capture and close OpenCV windows
+        if self.pipeline is not None:
+            self.pipeline.stop()
         if self.cap is not None:
             self.cap.release()
-        cv2.destroyAllWindows()
\ No newline at end of file
+        cv2.destroyAllWindows()
+        # The models stay loaded for the next monitor, until evicted
+        model_registry.REGISTRY.release(self)
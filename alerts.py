@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Seconds, from the start of an alert's delivery, during which more of its kind are dropped
+DEFAULT_COOLDOWNS = {'posture': 30.0,
+                     'blink-reminder': 60.0,
+                     'blink-alert': 60.0,
+                     'fatigue': 120.0}
+
+_delivery = metrics.REGISTRY.histogram('alert_delivery_seconds', 'From raising an alert to its sound or notification finishing')
+_delivered = metrics.REGISTRY.counter('alerts_delivered', 'Alerts shown or played')
+_coalesced = metrics.REGISTRY.counter('alerts_coalesced', 'Alerts merged into one of the same kind still waiting')
+_suppressed = metrics.REGISTRY.counter('alerts_suppressed', 'Alerts dropped within the cool-down of their kind')
+
+
+def play_sound(sound='error'):
+    # beepy plays synchronously; it is only ever called on the dispatcher thread
+    import beepy
+    beepy.beep(sound=sound)
+
+
+class Alert:
+    __slots__ = ('kind', 'title', 'subtitle', 'message', 'text', 'sound', 'created', 'count')
+
+    def __init__(self, kind, title, subtitle, message, text, sound):
+        self.kind = kind
+        self.title = title
+        self.subtitle = subtitle
+        self.message = message
+        self.text = text
+        self.sound = sound
+        self.created = time.perf_counter()
+        self.count = 1
+
+
+class AlertDispatcher:
+    """
+    Delivers alerts (notifications and sounds) on a background thread, so the monitors' loops only
+    enqueue them. Alerts of one kind (e.g. 'posture', 'blink-reminder', 'fatigue') waiting for
+    delivery are coalesced into one. The cool-down of a kind starts when delivery of one of its
+    alerts starts (its sound begins playing or its notification is sent); alerts of that kind
+    raised within it, including while that alert plays, are dropped.
+    """
+
+    def __init__(self, notify=None, cooldowns=None, default_cooldown=30.0, max_pending=16, play=play_sound):
+        """
+        :param notify: Notification used for text alerts.
+        :param cooldowns: Dict of kind -> cool-down seconds, on top of DEFAULT_COOLDOWNS.
+        :param default_cooldown: Cool-down of kinds without one.
+        :param max_pending: Kinds that can wait for delivery at once; more are dropped.
+        :param play: Callable playing a sound by name.
+        """
+        self.notify = notify
+        self.cooldowns = dict(DEFAULT_COOLDOWNS, **(cooldowns or {}))
+        self.default_cooldown = default_cooldown
+        self.max_pending = max_pending
+        self.play = play
+
+        self._pending = OrderedDict()  # kind -> Alert, oldest first
+        self._last_delivered = {}
+        self._delivering = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def alert(self, kind, title, subtitle='', message='', text=True, sound='error'):
+        """
+        Queues an alert; never blocks.
+        :param text: Show a notification (through `notify`), or else play `sound`.
+        :returns: True if queued, False if merged into a waiting alert or dropped.
+        """
+        now = time.perf_counter()
+        with self._cond:
+            if self._stop:
+                return False
+            pending = self._pending.get(kind)
+            if pending is not None:
+                # Same kind still waiting: deliver once, with the latest text
+                pending.title, pending.subtitle, pending.message = title, subtitle, message
+                pending.text, pending.sound = text, sound
+                pending.count += 1
+                _coalesced.inc()
+                return False
+            last = self._last_delivered.get(kind)
+            if last is not None and now - last < self.cooldowns.get(kind, self.default_cooldown):
+                _suppressed.inc()
+                return False
+            if len(self._pending) >= self.max_pending:
+                _suppressed.inc()
+                return False
+            self._pending[kind] = Alert(kind, title, subtitle, message, text, sound)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='alerts', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stop)
+                if self._stop and not self._pending:
+                    return
+                _, alert = self._pending.popitem(last=False)
+                # The cool-down starts now, so alerts of this kind raised while it plays fall in it
+                self._last_delivered[alert.kind] = time.perf_counter()
+                self._delivering += 1
+            try:
+                self._deliver(alert)
+            except Exception as e:
+                print(f"Error delivering alert {alert.kind}: {e}")
+            finally:
+                done = time.perf_counter()
+                _delivery.observe(done - alert.created)
+                _delivered.inc()
+                with self._cond:
+                    self._delivering -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, alert):
+        if alert.text and self.notify is not None:
+            self.notify.send_notification(alert.title, alert.subtitle, alert.message)
+        else:
+            self.play(alert.sound)
+
+    def reset(self, kind=None):
+        """
+        Forgets when delivery of `kind` (or every kind) last started, ending its cool-down.
+        """
+        with self._cond:
+            if kind is None:
+                self._last_delivered.clear()
+            else:
+                self._last_delivered.pop(kind, None)
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued alert has been delivered.
+        :returns: False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._delivering, timeout)
+
+    def stop(self, timeout=2.0):
+        # Delivers what is queued, then ends the thread
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+if __name__ == "__main__":
+    import statistics
+
+    # Time the monitor loop spends per alert, delivered inline as before against queued, with a
+    # stand-in sound that takes as long as beepy's 'error' (about 0.5 s).
+    sound_seconds = 0.5
+    fake_play = lambda sound: time.sleep(sound_seconds)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        fake_play('error')
+    inline = (time.perf_counter() - start) / 3
+
+    # Bursts of posture alerts, one per check: the first while a fatigue sound plays (they wait and
+    # coalesce), the second right after the posture sound ends (0.5 s into its 1 s cool-down), the
+    # third 0.6 s later: past the cool-down counted from the start of the sound, though not from its end
+    dispatcher = AlertDispatcher(play=fake_play, cooldowns={'posture': 1.0})
+    enqueue = []
+
+    def burst():
+        queued = []
+        for _ in range(5):
+            start = time.perf_counter()
+            queued.append(dispatcher.alert('posture', "Posture Alert!", "FIX your posture", "", text=False))
+            enqueue.append(time.perf_counter() - start)
+            time.sleep(0.02)
+        return queued
+
+    dispatcher.alert('fatigue', "Feeling Tired?", "Take a Break", "", text=False)
+    burst()
+    dispatcher.flush()
+    assert not any(burst()), "posture alerts within the cool-down were queued"
+    time.sleep(0.6)
+    assert burst()[0], "the cool-down did not start with the delivery"
+    dispatcher.stop()
+
+    snapshot = metrics.REGISTRY.snapshot()
+    print('inline delivery   {:8.1f} ms blocked per alert'.format(1000 * inline))
+    print('dispatcher        {:8.3f} ms blocked per alert (max {:.3f} ms)'.format(
+        1000 * statistics.mean(enqueue), 1000 * max(enqueue)))
+    print('16 alerts raised  {} delivered, {} coalesced, {} suppressed; delivery p50 {:.0f} ms'.format(
+        snapshot['alerts_delivered']['value'], snapshot['alerts_coalesced']['value'],
+        snapshot['alerts_suppressed']['value'], 1000 * snapshot['alert_delivery_seconds']['p50']))
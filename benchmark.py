@@ -0,0 +1,296 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from frame_source import open_source
+from notification import Notification
+from event_store import EventStore
+import metrics
+
+# End-to-end benchmark of the monitors on a replayed video or synthetic frames, without a
+# webcam or windows. Each monitor runs in a fresh process so peak RSS and CPU time are its own.
+#   python benchmark.py --video clip.mp4 --json results.json
+#   python benchmark.py --synthetic --seconds 30 --speed max
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class SilentNotification(Notification):
+    # Counts notifications instead of showing them
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    def send_notification(self, title, subtitle, message):
+        self.sent += 1
+
+
+class StageTimer:
+    """
+    Wraps stage callables and records their latencies.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.samples[name].append(time.perf_counter() - start)
+        return timed
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def summary(self):
+        return {name: latency_summary(samples) for name, samples in self.samples.items()}
+
+
+def latency_summary(samples):
+    ms = 1000.0 * np.asarray(samples, dtype=np.float64)
+    if ms.size == 0:
+        return {'count': 0}
+    summary = {'count': int(ms.size), 'mean_ms': float(ms.mean()), 'max_ms': float(ms.max())}
+    for p in PERCENTILES:
+        summary['p{}_ms'.format(p)] = float(np.percentile(ms, p))
+    return summary
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _totals(source, frames, wall, cpu):
+    # Shared end-of-run figures; CPU is per minute of replayed source time
+    minutes = max(source.seconds, 1e-9) / 60.0
+    return {'frames': frames,
+            'dropped': source.dropped,
+            'source_seconds': source.seconds,
+            'wall_seconds': wall,
+            'fps': frames / wall if wall > 0 else 0.0,
+            'cpu_seconds': cpu,
+            'cpu_seconds_per_minute': cpu / minutes,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_emotion(source, options):
+    from EmotionMonitor import EmotionMonitor
+
+    monitor = EmotionMonitor(notify=SilentNotification(), camera=source, headless=True, **options)
+    # Progress events go to a throwaway store, not the user's history
+    monitor.events = EventStore(':memory:')
+    timer = StageTimer()
+    decided = [0]
+
+    # Stage latencies, and capture-to-decision latency per frame
+    decide = monitor.decide
+
+    def timed_decide(frame):
+        result = decide(frame)
+        timer.add('end_to_end', time.time() - frame['timestamp'])
+        decided[0] += 1
+        return result
+
+    monitor.read_frame = timer.wrap('capture', monitor.read_frame)
+    monitor.detect = timer.wrap('detect', monitor.detect)
+    monitor.estimate_gaze = timer.wrap('gaze', monitor.estimate_gaze)
+    monitor.decide = timer.wrap('decide', timed_decide)
+
+    cpu, start = cpu_seconds(), time.perf_counter()
+    monitor.start_monitoring()
+    wall, cpu = time.perf_counter() - start, cpu_seconds() - cpu
+
+    result = _totals(source, decided[0], wall, cpu)
+    result['stages'] = timer.summary()
+    result['metrics'] = metrics.REGISTRY.snapshot()
+    result['scheduler'] = monitor.scheduler.stats()
+    if monitor.pipeline is not None:
+        result['pipeline'] = monitor.pipeline.stats()
+    return result
+
+
+def bench_posture(source, options, interval=0.0):
+    from posture import PostureWatcher
+
+    watcher = PostureWatcher(notify=SilentNotification(), camera=source, debug=False, **options)
+    watcher.events = EventStore(':memory:')
+    timer = StageTimer()
+    watcher.read_frame = timer.wrap('capture', watcher.read_frame)
+    watcher.detector.find_pose = timer.wrap('pose', watcher.detector.find_pose)
+
+    cpu, start = cpu_seconds(), time.perf_counter()
+    # Like a user retrying until a base posture is found
+    while source.isOpened() and watcher.base_posture is None:
+        watcher.set_base_posture()
+    samples = found = 0
+    # The deviation step of PostureWatcher.run, without the console and progress-file output
+    while source.isOpened():
+        sample_start = time.perf_counter()
+        deviation = watcher._get_deviation_from_base_posture()
+        if deviation is None:
+            break  # end of the source
+        timer.add('sample', time.perf_counter() - sample_start)
+        samples += 1
+        found += deviation < 100
+        if interval:
+            time.sleep(interval)
+    wall, cpu = time.perf_counter() - start, cpu_seconds() - cpu
+
+    result = _totals(source, samples, wall, cpu)
+    result['stages'] = timer.summary()
+    result['metrics'] = metrics.REGISTRY.snapshot()
+    result['base_posture'] = watcher.base_posture is not None
+    result['pose_found'] = found / samples if samples else 0.0
+    return result
+
+
+def bench_first_decision(sources, options, cycles=3, keep_models=True, max_decisions=300):
+    """
+    Time to first decision after clicking "Monitor", over `cycles` start/stop cycles of the
+    eye-strain monitor in one process: the first cycle loads and warms the models, later ones
+    reuse them from model_registry (unless `keep_models` is False, which reloads them every time
+    as before the registry).
+    :param sources: Callable returning a fresh frame source per cycle.
+    :param max_decisions: Decisions to wait for one with an emotion (a face) before stopping.
+    """
+    from EmotionMonitor import EmotionMonitor
+    import model_registry
+
+    runs = []
+    for _ in range(cycles):
+        if not keep_models:
+            model_registry.REGISTRY.clear()
+        source = sources()
+        marks = {}
+        decisions = [0]
+
+        start = time.perf_counter()
+        monitor = EmotionMonitor(notify=SilentNotification(), camera=source, headless=True, **options)
+        marks['constructed'] = time.perf_counter()
+        monitor.events = EventStore(':memory:')
+        decide = monitor.decide
+
+        def first_decisions(frame):
+            decide(frame)
+            marks.setdefault('first_decision', time.perf_counter())
+            decisions[0] += 1
+            if 'emotion_probabilities' in frame:
+                marks['first_emotion'] = time.perf_counter()
+                return False
+            return decisions[0] < max_decisions
+
+        monitor.decide = first_decisions
+        monitor.start_monitoring()
+        monitor.stop_monitoring()
+        runs.append({name: 1000 * (mark - start) for name, mark in marks.items()})
+
+    # Median over the cycles after the first
+    warm = {}
+    for name in ('constructed', 'first_decision', 'first_emotion'):
+        values = [run[name] for run in runs[1:] if name in run]
+        if values:
+            warm[name] = float(np.median(values))
+    return {'cycles': runs,
+            'cold': runs[0] if runs else {},
+            'warm': warm,
+            'keep_models': keep_models,
+            'models': model_registry.REGISTRY.stats(),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def _run(monitor, args, results):
+    if monitor == 'startup':
+        def sources():
+            return open_source(args.video, args.synthetic, args.speed == 'realtime', args.seconds, loop=args.loop)
+        results.put((monitor, bench_first_decision(sources, {'pipelined': not args.sequential},
+                                                   args.cycles, not args.reload_models)))
+        return
+    source = open_source(args.video, args.synthetic, args.speed == 'realtime', args.seconds, loop=args.loop)
+    if monitor == 'emotion':
+        options = {'pipelined': not args.sequential}
+        results.put((monitor, bench_emotion(source, options)))
+    else:
+        results.put((monitor, bench_posture(source, {}, args.posture_interval)))
+
+
+def machine_info():
+    return {'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the monitors on recorded or synthetic frames")
+    parser.add_argument('--video', help="video file to replay")
+    parser.add_argument('--synthetic', action='store_true', help="use generated frames (no faces or people)")
+    parser.add_argument('--speed', choices=('realtime', 'max'), default='realtime',
+                        help="replay at the source frame rate (dropping late frames) or as fast as possible")
+    parser.add_argument('--seconds', type=float, help="replay at most this much source time")
+    parser.add_argument('--loop', action='store_true', help="loop the video (use with --seconds)")
+    parser.add_argument('--monitors', nargs='+', choices=('emotion', 'posture', 'startup'), default=['emotion', 'posture'],
+                        help="'startup' times the first decision over several eye-strain monitor start/stop cycles")
+    parser.add_argument('--cycles', type=int, default=3, help="start/stop cycles of the startup benchmark")
+    parser.add_argument('--reload-models', action='store_true',
+                        help="startup benchmark: reload the models every cycle, as before the model registry")
+    parser.add_argument('--sequential', action='store_true', help="run the eye-strain stages on one thread")
+    parser.add_argument('--posture-interval', type=float, default=0.0, help="pause between posture samples")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    if not args.video and not args.synthetic:
+        parser.error("either --video or --synthetic is required")
+
+    report = {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+              'machine': machine_info(),
+              'source': {'video': args.video, 'synthetic': args.synthetic, 'speed': args.speed,
+                         'seconds': args.seconds, 'loop': args.loop},
+              'results': {}}
+
+    context = multiprocessing.get_context('spawn')
+    for monitor in args.monitors:
+        results = context.Queue()
+        process = context.Process(target=_run, args=(monitor, args, results))
+        process.start()
+        while True:
+            try:
+                name, result = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    sys.exit("The {} benchmark failed (exit code {})".format(monitor, process.exitcode))
+        process.join()
+        report['results'][name] = result
+        if name == 'startup':
+            for i, run in enumerate(result['cycles']):
+                print('startup  cycle {}  monitor built {:8.1f} ms   first decision {:8.1f} ms   first emotion {}'.format(
+                    i + 1, run['constructed'], run.get('first_decision', float('nan')),
+                    '{:.1f} ms'.format(run['first_emotion']) if 'first_emotion' in run else '-'))
+            continue
+        print('{:8} {:6.1f} fps  {:6.1f} CPU s/min  {:7.1f} MB peak RSS  {}'.format(
+            name, result['fps'], result['cpu_seconds_per_minute'], result['peak_rss_mb'],
+            '  '.join('{} p50 {:.1f} / p95 {:.1f} ms'.format(stage, s['p50_ms'], s['p95_ms'])
+                      for stage, s in result['stages'].items() if s['count'])))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
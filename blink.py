@@ -1,5 +1,6 @@
 from scipy.spatial import distance as dist
 from imutils import face_utils
+import numpy as np
 
 class BlinkDetector:
     def __init__(self):
@@ -19,7 +20,11 @@ class BlinkDetector:
     
     # Blink detector function
     def blink_detector (self, landmarks_dlib,):
-        shapes = face_utils.shape_to_np(landmarks_dlib)
+        # Accepts a dlib shape or a [68, 2] landmark array
+        if isinstance(landmarks_dlib, np.ndarray):
+            shapes = landmarks_dlib
+        else:
+            shapes = face_utils.shape_to_np(landmarks_dlib)
 
         left_eye = shapes[36:42]
         right_eye = shapes[42:48]
@@ -0,0 +1,295 @@
+import threading
+import time
+
+# Device index chosen by the probe, per candidate list; the probe runs once per process
+_probed_devices = {}
+
+
+def open_capture_device(candidates=(1, 0)):
+    """
+    Opens the first available camera (an external webcam at index 1 before the built-in one).
+    Each candidate is opened once and kept if it works, and the chosen index is cached, so later
+    calls open the device straight away.
+    :returns: An opened cv2.VideoCapture, or the last one tried if none opened.
+    """
+    # cv2 (and numpy) are imported with the first capture, not with the menu bar app
+    import cv2
+
+    candidates = tuple(candidates)
+    if candidates in _probed_devices:
+        return cv2.VideoCapture(_probed_devices[candidates])
+
+    cap = None
+    for index in candidates:
+        cap = cv2.VideoCapture(index)
+        if cap.isOpened():
+            _probed_devices[candidates] = index
+            return cap
+        cap.release()
+    return cap
+
+
+class Subscription:
+    """
+    One consumer's view of a CameraHub, with the cv2.VideoCapture read interface.
+
+    The hub only stores a reference to its newest frame here (no copy); frames are read-only
+    numpy arrays shared by all subscribers. Resizing to the subscriber's size happens in read(),
+    on the consumer's thread, and only for frames that are actually read.
+    """
+
+    def __init__(self, hub, name, rate=None, size=None):
+        self.hub = hub
+        self.name = name
+        self.rate = rate
+        self.size = size
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._frame_index = 0
+        self._timestamp = None
+        self._read_index = 0
+        self._last_delivery = 0.0
+        self._closed = False
+        self.frame_index = 0
+        self.timestamp = None
+        self.delivered = 0
+
+    def _deliver(self, frame, frame_index, timestamp):
+        # Called by the hub thread for every decoded frame
+        if self.rate and timestamp - self._last_delivery < 1.0 / self.rate:
+            return
+        with self._cond:
+            self._frame, self._frame_index, self._timestamp = frame, frame_index, timestamp
+            self._last_delivery = timestamp
+            self.delivered += 1
+            self._cond.notify_all()
+
+    def _close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def isOpened(self):
+        return not self._closed
+
+    def read(self, timeout=2.0, fresh=False):
+        """
+        Returns the newest frame this subscriber has not read yet, waiting for one if needed.
+        :param fresh: Wait for a frame captured after this call, even if an unread one is waiting.
+        :returns: (True, frame) or (False, None) on timeout or when the hub stopped.
+        """
+        if fresh:
+            with self.hub._lock:
+                captured = self.hub.frame_index
+        with self._cond:
+            newer_than = captured if fresh else self._read_index
+            if not self._cond.wait_for(lambda: self._closed or self._frame_index > newer_than, timeout):
+                return False, None
+            if self._closed:
+                return False, None
+            frame, self._read_index = self._frame, self._frame_index
+            self.frame_index, self.timestamp = self._frame_index, self._timestamp
+
+        if self.size is not None and frame.shape[1::-1] != tuple(self.size):
+            import cv2
+            frame = cv2.resize(frame, tuple(self.size), interpolation=cv2.INTER_AREA)
+        return True, frame
+
+    def release(self):
+        self.hub.unsubscribe(self)
+
+
+class CameraHub:
+    """
+    Owns the webcam and fans its frames out to several consumers (posture and eye-strain monitors).
+
+    A single capture thread decodes each frame once, marks it read-only and hands a reference to
+    every subscriber. Each subscriber picks its own rate (frames it is not woken for are simply
+    replaced) and resolution. The device is opened when the first subscriber arrives and
+    released when the last one leaves. Dropped frames are retried; after `max_read_failures`
+    in a row the camera is considered gone, the subscribers are closed and the next subscriber
+    reopens the device.
+    """
+
+    def __init__(self, candidates=(1, 0), width=720, height=480, open_device=None,
+                 max_read_failures=20, retry_delay=0.1):
+        """
+        :param candidates: Device indexes to probe, in order of preference.
+        :param width, height: Capture resolution requested from the camera.
+        :param open_device: Callable returning an opened capture (default: probe `candidates`);
+                            e.g. lambda: cv2.VideoCapture('clip.mp4').
+        :param max_read_failures: Failed reads in a row after which the capture is given up.
+        :param retry_delay: Seconds to wait after a failed read before the next one.
+        """
+        self.candidates = candidates
+        self.width = width
+        self.height = height
+        self.open_device = open_device or (lambda: open_capture_device(self.candidates))
+        self.max_read_failures = max_read_failures
+        self.retry_delay = retry_delay
+
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._cap = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.frame_index = 0
+        self.opened_in = None
+
+    def subscribe(self, name, rate=None, size=None):
+        """
+        :param rate: Highest rate (Hz) at which this subscriber receives frames, None for every frame.
+        :param size: (width, height) the subscriber's frames are resized to, None for the capture size.
+        :returns: A Subscription, read like a cv2.VideoCapture.
+        """
+        subscription = Subscription(self, name, rate, size)
+        with self._lock:
+            self._subscribers.append(subscription)
+            if self._thread is None:
+                self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription._close()
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+            last = not self._subscribers and self._thread is not None
+        if last:
+            self.stop()
+
+    def _start(self):
+        import cv2
+
+        start = time.perf_counter()
+        self._cap = self.open_device()
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.opened_in = time.perf_counter() - start
+        # One stop event per capture thread, so a thread still winding down after stop() does
+        # not see a later start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._cap, self._stop),
+                                        name='camera-hub', daemon=True)
+        self._thread.start()
+
+    def _run(self, cap, stop):
+        failures = 0
+        while not stop.is_set() and cap.isOpened():
+            ok, frame = cap.read()
+            if not ok:
+                # A dropped frame: back off and retry, unless the camera keeps failing
+                failures += 1
+                if failures >= self.max_read_failures:
+                    break
+                stop.wait(self.retry_delay)
+                continue
+            failures = 0
+            # Shared by every subscriber: nobody may draw on it
+            frame.setflags(write=False)
+            now = time.time()
+            with self._lock:
+                # Numbered with the frame it publishes, so nobody sees one without the other
+                self.frame_index += 1
+                frame_index = self.frame_index
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription._deliver(frame, frame_index, now)
+
+        if stop.is_set():
+            return
+        # Camera gone: forget it, so the next subscriber reopens the device, and wake up readers
+        with self._lock:
+            if self._thread is not threading.current_thread():
+                return
+            self._thread = self._cap = None
+            subscribers, self._subscribers = self._subscribers, []
+        cap.release()
+        for subscription in subscribers:
+            subscription._close()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            thread, self._thread = self._thread, None
+            cap, self._cap = self._cap, None
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription._close()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(2.0)
+        if cap is not None:
+            cap.release()
+
+    def stats(self):
+        with self._lock:
+            return {'frames': self.frame_index,
+                    'subscribers': {s.name: s.delivered for s in self._subscribers}}
+
+
+if __name__ == "__main__":
+    import argparse
+    import resource
+
+    import cv2
+
+    # Startup time and CPU use of two consumers (eye strain every frame, posture at 0.2 Hz) with
+    # their own captures, as before, against one shared hub
+    parser = argparse.ArgumentParser(description="Compare separate captures with a shared CameraHub")
+    parser.add_argument('--source', default=None, help="video file to use instead of the webcam")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    def legacy_device():
+        # The previous probe: device 1 opened twice, once to test it and once to use it
+        if args.source:
+            return cv2.VideoCapture(args.source)
+        if cv2.VideoCapture(1).isOpened():
+            return cv2.VideoCapture(1)
+        return cv2.VideoCapture(0)
+
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def separate():
+        start = time.perf_counter()
+        emotion_cap, posture_cap = legacy_device(), legacy_device()
+        emotion_cap.read(), posture_cap.read()
+        startup = time.perf_counter() - start
+
+        cpu, end, next_posture, frames = cpu_seconds(), time.perf_counter() + args.seconds, 0.0, 0
+        while time.perf_counter() < end:
+            ok, _ = emotion_cap.read()
+            if not ok:
+                break
+            frames += 1
+            if time.perf_counter() >= next_posture:
+                posture_cap.read()
+                next_posture = time.perf_counter() + 5.0
+        used = cpu_seconds() - cpu
+        emotion_cap.release(), posture_cap.release()
+        return startup, used, frames
+
+    def shared():
+        start = time.perf_counter()
+        hub = CameraHub(open_device=(lambda: cv2.VideoCapture(args.source)) if args.source else None)
+        emotion, posture = hub.subscribe('emotion'), hub.subscribe('posture', rate=0.2)
+        emotion.read(), posture.read()
+        startup = time.perf_counter() - start
+
+        cpu, end, frames = cpu_seconds(), time.perf_counter() + args.seconds, 0
+        while time.perf_counter() < end:
+            ok, _ = emotion.read()
+            if not ok:
+                break
+            frames += 1
+        used = cpu_seconds() - cpu
+        emotion.release(), posture.release()
+        return startup, used, frames
+
+    for name, fn in (('separate captures', separate), ('shared CameraHub', shared)):
+        startup, used, frames = fn()
+        print('{:18} startup {:6.0f} ms   CPU {:5.2f} s/min   {:6.1f} frames/s'.format(
+            name, 1000 * startup, 60 * used / args.seconds, frames / args.seconds))
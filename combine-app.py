@@ -1,15 +1,29 @@
 import rumps
 
-from posture import PostureWatcher
+# Only what the menu needs is imported here; the monitors and charts load their frameworks
+# (mediapipe, torch, TensorFlow, dlib, plotly) on first use or from the background preloader.
 from progress import Progress
-from EmotionMonitor import EmotionMonitor
 from notification import Notification
-from file_manager import FileManager
+from alerts import AlertDispatcher
+from event_store import get_event_store
+from camera_hub import CameraHub
+from monitor_process import MonitorProcess, PostureProcess, EmotionProcess
+from preload import Preloader, load
 
 import os
+import sys
+import argparse
+
+import metrics
 
 class Application(rumps.App):
-    def __init__(self):
+    def __init__(self, multiprocess=False, preload=True):
+        """
+        :param multiprocess: Run the posture and eye-strain monitors in worker processes, fed through
+                             a shared-memory frame ring, instead of threads of the app process.
+        :param preload: Import the monitors' and charts' frameworks in the background once the menu
+                        is up, rather than on first use.
+        """
         super().__init__("ErgoSight", icon="IMAGES/logo.png")
         self.pw = None
         self.emotion_monitor = None
@@ -17,24 +31,34 @@ class Application(rumps.App):
         self.camera_started = False
 
         self.notify = Notification()
-        self.file = FileManager ()
+        # One queue for the alerts of both monitors, delivered off their threads
+        self.alerts = AlertDispatcher(self.notify)
+        # One webcam capture shared by the posture and eye-strain monitors
+        self.camera = CameraHub()
+        self.multiprocess = multiprocess
+        self.frames = load('shared_frames').RingFeeder(self.camera) if multiprocess else None
+        # Worker processes import the monitors themselves, so then only the charts are preloaded
+        parts = ('reports',) if multiprocess else ('posture', 'eye-strain', 'reports')
+        self.preloader = Preloader(parts) if preload else None
 
-        self.file_path_posture = "FILES/posture_data.txt"
-        self.file_path = "FILES/ergo-sight-progress.txt"
         self.conset_path = "FILES/consent.txt"
 
         self.posture_notify = True
         self.eye_notify = True
 
         self.progress = Progress()
-        self.file.delete_old_data(self.file_path)
-        self.file.delete_old_data(self.file_path_posture)
+        # Progress events; old days are dropped by the store in the background
+        self.events = get_event_store()
+        # One-time import of the progress files written before the event store
+        self.events.import_text_file("FILES/ergo-sight-progress.txt")
+        self.events.import_text_file("FILES/posture_data.txt")
 
         # Create menu items
         self.posture_monitor = rumps.MenuItem('Posture Monitor')
         self.set_base_posture_menu = rumps.MenuItem('Set base posture', callback=self.set_base_posture)
         self.clear_base_posture_menu = rumps.MenuItem('Clear base posture', callback=self.clear_base_posture)
         self.progress_posture_menu = rumps.MenuItem('Progress', callback=self.progress_generator_posture)
+        self.history_posture_menu = rumps.MenuItem('History', callback=self.history_generator_posture)
         self.settings_menu = rumps.MenuItem('Settings')
 
         self.pos_text = rumps.MenuItem('Text Notification', callback=self.pos_notify_text)
@@ -46,6 +70,7 @@ class Application(rumps.App):
         self.posture_monitor.add(self.set_base_posture_menu)
         self.posture_monitor.add(self.clear_base_posture_menu)
         self.posture_monitor.add(self.progress_posture_menu)
+        self.posture_monitor.add(self.history_posture_menu)
         self.posture_monitor.add(self.settings_menu)
 
 
@@ -53,6 +78,8 @@ class Application(rumps.App):
         self.eye_strain_monitor = rumps.MenuItem('Monitor', callback=self.start_notifications)
         self.stop_monitor = rumps.MenuItem('Stop', callback=self.stop_monitoring)
         self.eye_strain_progress = rumps.MenuItem('Progress', callback=self.progress_generator)
+        self.eye_strain_history = rumps.MenuItem('History', callback=self.history_generator)
+        self.blink_alert_history = rumps.MenuItem('Blink alerts', callback=self.blink_alert_generator)
         self.eye_settings_menu = rumps.MenuItem('Settings')
 
         self.eye_text = rumps.MenuItem('Text Notification', callback=self.eye_notify_text)
@@ -64,6 +91,8 @@ class Application(rumps.App):
         self.eye_strain.add(self.eye_strain_monitor)
         self.eye_strain.add(self.stop_monitor)
         self.eye_strain.add(self.eye_strain_progress)
+        self.eye_strain.add(self.eye_strain_history)
+        self.eye_strain.add(self.blink_alert_history)
         self.eye_strain.add(self.eye_settings_menu)
 
         # Add items to the main menu
@@ -77,13 +106,36 @@ class Application(rumps.App):
                 return consent == 'yes'
         else:
             return False
+
+    # Monitors run in the app process, or in worker processes reading the shared frame ring
+    def create_posture_watcher(self):
+        if self.multiprocess:
+            self.frames.start()
+            return PostureProcess(self.frames.spec, self.notify)
+        return load('posture').PostureWatcher(notify=self.notify, camera=self.camera, alerts=self.alerts)
+
+    def create_emotion_monitor(self):
+        if self.multiprocess:
+            self.frames.start()
+            return EmotionProcess(self.frames.spec, self.notify)
+        return load('EmotionMonitor').EmotionMonitor(notify=self.notify, camera=self.camera, alerts=self.alerts)
+
+    def release_frames(self):
+        # Stops feeding the frame ring (and frees the camera) once no worker process is left
+        if not self.multiprocess:
+            return
+        workers = [m for m in (self.pw, self.emotion_monitor) if isinstance(m, MonitorProcess) and m.alive()]
+        if not workers:
+            self.frames.stop()
         
     # setting base posture    
     def set_base_posture(self, _):
         if self.get_consent():
-            self.pw = PostureWatcher(notify=self.notify)  # Initialize PostureWatcher
-            self.camera_started = True  # Update camera status
+            if not self.camera_started:
+                self.pw = self.create_posture_watcher()  # Initialize PostureWatcher
+                self.camera_started = True  # Update camera status
             self.pw.set_base_posture() 
+            self.pw.start()
 
         else : 
             # Getting user consent before accessing the webcam
@@ -98,31 +150,53 @@ class Application(rumps.App):
                 with open(self.conset_path, "w") as file:
                     file.write("yes")
                 if not self.camera_started:  
-                    self.pw = PostureWatcher(notify=self.notify)  
+                    self.pw = self.create_posture_watcher()  
                     self.camera_started = True  
                 self.pw.set_base_posture()      
+                self.pw.start()
 
     def clear_base_posture(self, _):
+        if self.pw is None:
+            return
+        self.pw.stop()
         self.pw.base_posture = None
         self.camera_started = False  # Update camera status
         self.pw = None
+        self.release_frames()
         self.title = "ErgoSight : ⚠️ Please set your base posture"
 
-    @rumps.timer(5)
-    def check_posture(self, _):
-        if self.pw:
-            self.pw.run()
-
     def progress_generator_posture(self, _):
         if self.progress:  # Check if the emotion monitor is initialized
-            self.progress.show_pie_chart(self.file_path_posture, "Posture", "Posture-Progress")
+            self.progress.show_pie_chart("Posture", "Posture-Progress")
+
+    def history_generator_posture(self, _):
+        if self.progress:
+            self.progress.show_history("Posture", "Posture-History")
+
+    @rumps.timer(1)
+    def preload_frameworks(self, sender):
+        # Runs once, after the menu is up
+        sender.stop()
+        if self.preloader:
+            self.preloader.start()
+
+    @rumps.timer(60)
+    def evict_idle_models(self, _):
+        # Models the eye-strain monitor left loaded are dropped after a while unused; the
+        # registry is only there once a monitor has been started
+        registry = sys.modules.get('model_registry')
+        if registry is not None:
+            registry.REGISTRY.evict_idle()
 
     @rumps.timer(1)
     def update_title(self, _):
         if self.pw and not self.pw.base_posture:
             self.title = "⚠️ Please set your base posture."
         elif self.pw:
-            cd = self.pw.deviation.current_deviation
+            # Sampled on the watcher's own thread; the UI only reads the latest value
+            cd = self.pw.latest_deviation
+            if cd is None:
+                return
             self.title = "ErgoSight : "
             if cd < 25:
                 self.title += "✅ Great posture!"
@@ -147,7 +221,7 @@ class Application(rumps.App):
     def start_notifications(self, _):
 
         if self.get_consent():
-            self.emotion_monitor = EmotionMonitor(notify=self.notify)
+            self.emotion_monitor = self.create_emotion_monitor()
             self.emotion_monitor.start_monitoring() 
         else : 
             consent = rumps.alert(
@@ -160,16 +234,36 @@ class Application(rumps.App):
             if consent:  # If user consents
                 with open(self.conset_path, "w") as file:
                     file.write("yes")
-                self.emotion_monitor = EmotionMonitor(notify=self.notify)
+                self.emotion_monitor = self.create_emotion_monitor()
                 self.emotion_monitor.start_monitoring()
 
     def stop_monitoring(self, _):
         self.emotion_monitor.stop_monitoring()
+        self.release_frames()
 
     def progress_generator(self, _):
         if self.progress:  # Check if the emotion monitor is initialized
-            self.progress.show_pie_chart(self.file_path, "Detected-Emotion", "Emotion-Progress")    
+            self.progress.show_pie_chart("Detected-Emotion", "Emotion-Progress")    
+
+    def history_generator(self, _):
+        if self.progress:
+            self.progress.show_history("Detected-Emotion", "Emotion-History")
+
+    def blink_alert_generator(self, _):
+        if self.progress:
+            self.progress.show_history("Blink-Alert", "Blink-Alerts")
 
 if __name__ == "__main__":
-    app = Application()
+    parser = argparse.ArgumentParser(description="ErgoSight menu bar app")
+    parser.add_argument('--multiprocess', action='store_true',
+                        help="run each monitor in its own worker process")
+    parser.add_argument('--no-preload', action='store_true',
+                        help="load the monitors' frameworks on first use only, not in the background")
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve stage metrics on http://127.0.0.1:<port>/metrics (Prometheus) and /metrics.json")
+    args = parser.parse_args()
+    if args.metrics_port:
+        metrics.REGISTRY.serve(args.metrics_port)
+
+    app = Application(multiprocess=args.multiprocess, preload=not args.no_preload)
     app.run()
@@ -1,6 +1,12 @@
+import threading
+import time
+from collections import namedtuple
+
 import cv2
 import mediapipe as mp
 
+import metrics
+
 
 class PoseLandmarks:
     # Indexes for Mediapipe Pose Landmarks
@@ -8,28 +14,292 @@ class PoseLandmarks:
     LEFT_SHOULDER = 11
     RIGHT_SHOULDER = 12
 
+    # Face and shoulder landmarks: everything up to the shoulders, used for the upper body ROI
+    UPPER_BODY = range(0, 13)
+
+
+# Landmark in full-frame normalized coordinates (same fields as the MediaPipe landmark)
+Landmark = namedtuple('Landmark', ['x', 'y', 'z', 'visibility'])
+
+# MediaPipe Tasks model bundles by model complexity
+TASK_MODEL_PATHS = {0: 'MODELS/pose_landmarker_lite.task',
+                    1: 'MODELS/pose_landmarker_full.task',
+                    2: 'MODELS/pose_landmarker_heavy.task'}
+
 
 class PoseDetector:
-    
-    def __init__(self):
+    """
+    MediaPipe pose engine.
+
+    Only the nose and shoulders are used downstream, so the input can be made much cheaper than
+    the full camera frame:
+      - model_complexity: 0 (lite), 1 (full, MediaPipe's default) or 2 (heavy),
+      - downscale: the frame is resized by this factor before inference,
+      - use_roi: after a pose is found, the next frame is cropped to the upper body (face and
+        shoulders plus `roi_margin`); if no pose is found in the crop the full frame is used,
+      - the resized and RGB-converted images are written into buffers reused between calls.
+    Landmarks are always returned in full-frame normalized coordinates, whatever the crop.
+
+    With running_mode='live_stream' the MediaPipe Tasks PoseLandmarker runs on its own thread:
+    find_pose submits the frame and waits (up to `result_timeout`) for the result of that same
+    frame, so an occasional sampler such as PostureWatcher never gets an older pose. A frame
+    MediaPipe skips, or one that times out, returns no landmarks.
+    """
+
+    def __init__(self, model_complexity=1, downscale=1.0, use_roi=False, roi_margin=0.6,
+                 static_image_mode=False, running_mode='image', task_model_path=None, result_timeout=1.0):
+        """
+        :param model_complexity: 0, 1 or 2 (lite, full, heavy).
+        :param downscale: Scale factor (<= 1) applied to the frame or ROI before inference.
+        :param use_roi: Crop to the last known upper body.
+        :param roi_margin: ROI padding, as a fraction of the upper body box size.
+        :param static_image_mode: Run person detection on every frame instead of tracking
+                                  (solutions API only).
+        :param running_mode: 'image' (synchronous, solutions API) or 'live_stream' (Tasks API).
+        :param task_model_path: .task bundle for live_stream (default: TASK_MODEL_PATHS[model_complexity]).
+        :param result_timeout: Seconds find_pose waits for a live_stream result.
+        """
         self.results = None
+        self.model_complexity = model_complexity
+        self.downscale = downscale
+        self.use_roi = use_roi
+        self.roi_margin = roi_margin
+        self.running_mode = running_mode
+
         self.mpDraw = mp.solutions.drawing_utils
         self.mpPose = mp.solutions.pose
-        self.pose = self.mpPose.Pose()
 
-    def find_pose(self, img, draw=True):
+        if running_mode == 'live_stream':
+            self.result_timeout = result_timeout
+            # timestamp -> submitted frame; shared with MediaPipe's callback thread
+            self._lock = threading.Lock()
+            self._pending = {}
+            self._last_timestamp_ms = -1
+            self.landmarker = self._create_landmarker(task_model_path or TASK_MODEL_PATHS[model_complexity])
+            self.pose = None
+        elif running_mode == 'image':
+            self.pose = self.mpPose.Pose(static_image_mode=static_image_mode, model_complexity=model_complexity)
+        else:
+            raise ValueError(f"Unknown running mode: {running_mode}")
+
+        self.roi = None  # (x, y, w, h) in pixels, None = full frame
+        self._small = None
+        self._rgb = None
+        self.roi_misses = 0
+
+    def _create_landmarker(self, model_path):
+        from mediapipe.tasks import python as mp_tasks
+        from mediapipe.tasks.python import vision
+
+        options = vision.PoseLandmarkerOptions(
+            base_options=mp_tasks.BaseOptions(model_asset_path=model_path),
+            running_mode=vision.RunningMode.LIVE_STREAM,
+            num_poses=1,
+            result_callback=self._on_result)
+        return vision.PoseLandmarker.create_from_options(options)
+
+    def _prepare(self, img, roi):
+        # Crop, resize and convert to RGB into the reused buffers
+        if roi is not None:
+            x, y, w, h = roi
+            img = img[y:y + h, x:x + w]
+        if self.downscale != 1.0:
+            size = (max(int(img.shape[1] * self.downscale), 1), max(int(img.shape[0] * self.downscale), 1))
+            if self._small is None or self._small.shape[1::-1] != size:
+                self._small = None
+            self._small = cv2.resize(img, size, dst=self._small, interpolation=cv2.INTER_AREA)
+            img = self._small
+        if self._rgb is None or self._rgb.shape != img.shape:
+            self._rgb = None
+        self._rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self._rgb)  # mediapipe requires RGB
+        return self._rgb
+
+    @staticmethod
+    def _to_frame(landmarks, roi, frame_shape):
+        # Maps landmarks from ROI-normalized to full-frame-normalized coordinates
+        if roi is None:
+            return [Landmark(l.x, l.y, l.z, l.visibility) for l in landmarks]
+        x, y, w, h = roi
+        height, width = frame_shape[:2]
+        sx, sy = w / width, h / height
+        return [Landmark(x / width + l.x * sx, y / height + l.y * sy, l.z * sx, l.visibility) for l in landmarks]
+
+    def _update_roi(self, landmarks, frame_shape):
+        if not self.use_roi:
+            return
+        if landmarks is None:
+            self.roi = None
+            return
+        height, width = frame_shape[:2]
+        xs = [landmarks[i].x * width for i in PoseLandmarks.UPPER_BODY]
+        ys = [landmarks[i].y * height for i in PoseLandmarks.UPPER_BODY]
+        x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+        pad_x = self.roi_margin * (x1 - x0)
+        # More room below the shoulders, where a slouching user moves to
+        pad_top, pad_bottom = self.roi_margin * (y1 - y0), 2 * self.roi_margin * (y1 - y0)
+        left, top = max(int(x0 - pad_x), 0), max(int(y0 - pad_top), 0)
+        right, bottom = min(int(x1 + pad_x), width), min(int(y1 + pad_bottom), height)
+        self.roi = (left, top, right - left, bottom - top) if right - left > 32 and bottom - top > 32 else None
+
+    def _process(self, img, roi):
+        rgb = self._prepare(img, roi)
+        self.results = self.pose.process(rgb)
+        if self.results.pose_landmarks:
+            return rgb, self._to_frame(self.results.pose_landmarks.landmark, roi, img.shape)
+        return rgb, None
+
+    @metrics.timed('find_pose_seconds', 'MediaPipe pose per sample')
+    def find_pose(self, img, draw=False):
         """
-        :returns: If landmarks are found, (img, landmarks). Otherwise, if no landmarks are found, 
-                  (img, landmarks) is returned.
+        :returns: If landmarks are found, (img, landmarks). Otherwise, if no landmarks are found,
+                  (img, None). img is the RGB image that was processed (the crop, if any); it is
+                  a reused buffer, overwritten by the next call.
         """
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # mediapipe requires RGB
-        self.results = self.pose.process(img)
-        
-        if self.results.pose_landmarks:
-            if draw:
-                self.mpDraw.draw_landmarks(img, self.results.pose_landmarks, self.mpPose.POSE_CONNECTIONS)
+        if self.running_mode == 'live_stream':
+            return self._find_pose_async(img)
+
+        rgb, landmarks = self._process(img, self.roi)
+        if landmarks is None and self.roi is not None:
+            # Lost the user in the crop: retry on the full frame
+            self.roi_misses += 1
+            rgb, landmarks = self._process(img, None)
+        self._update_roi(landmarks, img.shape)
+
+        if landmarks is not None and draw:
+            self.mpDraw.draw_landmarks(rgb, self.results.pose_landmarks, self.mpPose.POSE_CONNECTIONS)
+        return rgb, landmarks
+
+    def _find_pose_async(self, img):
+        with self._lock:
+            roi = self.roi
+            # Timestamps must increase strictly
+            timestamp_ms = max(int(time.monotonic() * 1000), self._last_timestamp_ms + 1)
+            self._last_timestamp_ms = timestamp_ms
+            pending = {'roi': roi, 'shape': img.shape, 'done': threading.Event(), 'landmarks': None}
+            self._pending[timestamp_ms] = pending
+        rgb = self._prepare(img, roi)
+        self.landmarker.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb.copy()), timestamp_ms)
+        if not pending['done'].wait(self.result_timeout):
+            with self._lock:
+                self._pending.pop(timestamp_ms, None)
+        return rgb, pending['landmarks']
+
+    def _on_result(self, result, image, timestamp_ms):
+        # Called on MediaPipe's thread
+        with self._lock:
+            pending = self._pending.pop(timestamp_ms, None)
+            # Frames submitted earlier that MediaPipe skipped will get no result
+            skipped = [self._pending.pop(t) for t in [t for t in self._pending if t < timestamp_ms]]
+        for frame in skipped:
+            frame['done'].set()
+        if pending is None:
+            return
+        roi, shape = pending['roi'], pending['shape']
+        landmarks = self._to_frame(result.pose_landmarks[0], roi, shape) if result.pose_landmarks else None
+        with self._lock:
+            if landmarks is None and roi is not None:
+                self.roi_misses += 1
+            self._update_roi(landmarks, shape)
+        pending['landmarks'] = landmarks
+        pending['done'].set()
+
+    def close(self):
+        if self.pose is not None:
+            self.pose.close()
+        else:
+            self.landmarker.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import numpy as np
+
+    from deviation import posture_deviation
+
+    # Latency and posture accuracy of pose engine settings on recorded clips. The reference is
+    # the heavy model on the full frame; the first frame with a pose is the base posture.
+    SETTINGS = {'default':      dict(),
+                'lite':         dict(model_complexity=0),
+                'lite-half':    dict(model_complexity=0, downscale=0.5),
+                'full-half':    dict(downscale=0.5),
+                'lite-roi':     dict(model_complexity=0, use_roi=True),
+                'lite-roi-half': dict(model_complexity=0, use_roi=True, downscale=0.5),
+                'full-roi':     dict(use_roi=True)}
+    REFERENCE = dict(model_complexity=2)
+
+    parser = argparse.ArgumentParser(description="Compare pose engine settings on recorded clips")
+    parser.add_argument('clips', nargs='+', help="recorded webcam clips")
+    parser.add_argument('--every', type=int, default=5, help="use every n-th frame of the clips")
+    parser.add_argument('--settings', nargs='+', default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    frames = []
+    for clip in args.clips:
+        cap = cv2.VideoCapture(clip)
+        index = 0
+        while True:
+            ok, img = cap.read()
+            if not ok:
+                break
+            if index % args.every == 0:
+                frames.append((clip, cv2.resize(img, (720, 480))))
+            index += 1
+        cap.release()
+
+    KEYS = (PoseLandmarks.NOSE, PoseLandmarks.LEFT_SHOULDER, PoseLandmarks.RIGHT_SHOULDER)
+
+    def run(options):
+        detector = PoseDetector(**options)
+        latencies, outputs = [], []
+        for _, img in frames:
+            start = time.perf_counter()
+            _, lm = detector.find_pose(img)
+            latencies.append(time.perf_counter() - start)
+            outputs.append(None if lm is None else [lm[k] for k in KEYS])
+        detector.close()
+        return np.array(latencies) * 1000, outputs
+
+    def deviations(outputs):
+        # Deviation from the first pose of each clip, as PostureWatcher computes it
+        base, result = {}, []
+        for (clip, _), lm in zip(frames, outputs):
+            if lm is None:
+                result.append(None)
+                continue
+            base.setdefault(clip, lm)
+            result.append(posture_deviation(*base[clip], *lm))
+        return result
+
+    _, reference = run(REFERENCE)
+    reference_deviations = deviations(reference)
 
-            return img, self.results.pose_landmarks.landmark
+    results = []
+    for name in args.settings:
+        latencies, outputs = run(SETTINGS[name])
+        found = [i for i, lm in enumerate(outputs) if lm is not None and reference[i] is not None]
+        point_error = [np.mean([abs(a.x - b.x) + abs(a.y - b.y) for a, b in zip(outputs[i], reference[i])])
+                       for i in found]
+        setting_deviations = deviations(outputs)
+        deviation_error = [abs(setting_deviations[i] - reference_deviations[i]) for i in found
+                           if setting_deviations[i] is not None and reference_deviations[i] is not None]
+        results.append({'setting': name,
+                        'mean_ms': float(latencies.mean()),
+                        'p95_ms': float(np.percentile(latencies, 95)),
+                        'detected': sum(lm is not None for lm in outputs) / max(len(outputs), 1),
+                        'landmark_error': float(np.mean(point_error)) if point_error else None,
+                        'deviation_error': float(np.mean(deviation_error)) if deviation_error else None})
 
-        return img, None
-    
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('{} frames, reference: heavy model on the full frame'.format(len(frames)))
+        print('{:14} {:>8} {:>8} {:>9} {:>10} {:>10}'.format('setting', 'mean ms', 'p95 ms', 'detected',
+                                                            'lm error', 'dev error'))
+        for r in results:
+            print('{:14} {:8.1f} {:8.1f} {:8.0%} {:>10} {:>10}'.format(
+                r['setting'], r['mean_ms'], r['p95_ms'], r['detected'],
+                '-' if r['landmark_error'] is None else '{:.4f}'.format(r['landmark_error']),
+                '-' if r['deviation_error'] is None else '{:.1f}%'.format(r['deviation_error'])))
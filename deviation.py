@@ -65,3 +65,16 @@ class Deviation:
         else:
             self._current_buffer = 0
             return False
+
+
+def posture_deviation(base_nose, base_left_shoulder, base_right_shoulder, nose, left_shoulder, right_shoulder):
+    """
+    Deviation (in %) of the nose and shoulder landmarks from the base posture landmarks.
+    :return: Sum of the per-landmark L1 distances relative to the sum of the base x coordinates.
+    """
+    def distance(a, b):
+        return abs(a.x - b.x) + abs(a.y - b.y) + abs(a.z - b.z)
+
+    moved = distance(base_nose, nose) + distance(base_left_shoulder, left_shoulder) + \
+        distance(base_right_shoulder, right_shoulder)
+    return int(moved / (base_nose.x + base_left_shoulder.x + base_right_shoulder.x) * 100)
@@ -1,45 +1,86 @@
 import cv2
 from collections import Counter
 import numpy as np
-from keras.models import load_model
+from inference_backend import create_emotion_backend
+import metrics
 
 class EmotionDetector:
 
-    def __init__(self):
+    def __init__(self, backend='keras', model_path=None, max_faces=4, model=None,
+                 window_seconds=2.0, smoothing_seconds=0.2, rate=15.0):
+        """
+        :param window_seconds: Span of the majority vote over predictions.
+        :param smoothing_seconds: Span of the moving average over the voted states.
+        :param rate: Predictions per second, used to turn the spans into sample counts (see set_rate).
+        """
 
         # Define class names
         self.class_names = ["None", "Fatigue", "Glare", "Normal", "Squint"]
 
-        # Define the time window size in frames
-        self.window_size = 30
-        # Threshold for majority decision  
-        self.threshold = self.window_size // 2  
-        # Smoothing window size for moving average
-        self.smoothing_window = 3  
+        # Windows are spans of time; their sizes in predictions follow the prediction rate
+        self.window_seconds = window_seconds
+        self.smoothing_seconds = smoothing_seconds
+        self.rate = None
+        self.set_rate(rate)
 
         self.state_window = []
         self.smoothed_predictions = []
         
-        # Models paths
-        self.emotion_model = load_model('MODEL/model.h5')  
-        # self.emotion_model = load_model("MODEL/best_model.h5")
-
-    def predict_emotion(self, frame, face_roi, pitch):
-        try:
+        # Models paths ('keras' -> MODEL/model.h5, 'onnx' -> MODELS/emotion.onnx, 'tflite' -> MODELS/emotion.tflite);
+        # `model` is an already loaded backend, e.g. shared through model_registry
+        self.emotion_model = model or create_emotion_backend(backend, model_path)
+        # self.emotion_model = create_emotion_backend('keras', "MODEL/best_model.h5")
+
+        # Preallocated model input, one 48x48 slot per face
+        self._faces = np.zeros((max_faces, 48, 48, 1), np.float32)
+        self._resized = np.zeros((48, 48), np.uint8)
+
+    def set_rate(self, rate):
+        """
+        Sizes the windows for `rate` predictions per second (30 and 3 samples at 15 Hz).
+        """
+        if not rate or rate == self.rate:
+            return
+        self.rate = rate
+        # Define the time window size in predictions
+        self.window_size = max(1, int(round(self.window_seconds * rate)))
+        # Threshold for majority decision
+        self.threshold = self.window_size // 2
+        # Smoothing window size for moving average
+        self.smoothing_window = max(1, int(round(self.smoothing_seconds * rate)))
+
+    def classify(self, face_rois):
+        """
+        Runs the emotion model once over every face.
+        :param face_rois: List of grayscale face images.
+        :returns: Class probabilities [len(face_rois), len(class_names)].
+        """
+        n = len(face_rois)
+        if n > self._faces.shape[0]:
+            self._faces = np.zeros((n, 48, 48, 1), np.float32)
+        for i, face_roi in enumerate(face_rois):
             # Preprocess the face image for model prediction
-            face_resized = cv2.resize(face_roi, (48, 48))
-            face_normalized = face_resized / 255.0
-            face_input = np.expand_dims(face_normalized, axis=-1)  # Add channel dimension
+            cv2.resize(face_roi, (48, 48), dst=self._resized)
+            np.multiply(self._resized, 1 / 255.0, out=self._faces[i, :, :, 0], casting='unsafe')
+        return self.emotion_model.run(self._faces[:n])
 
-            # Predict emotion using the model
-            emotion_probabilities = self.emotion_model.predict(np.expand_dims(face_input, axis=0))
-            predicted_class_index = np.argmax(emotion_probabilities)
+    @metrics.timed('predict_emotion_seconds', 'Emotion classification of the faces of a frame')
+    def predict_emotion(self, frame, face_roi, pitch, draw=True):
+        blink = False
+        try:
+            # Predict emotion using the model, batched over all faces of the frame;
+            # the decision follows `face_roi`
+            face_rois = frame.get('face_rois') or [face_roi]
+            primary = next((i for i, roi in enumerate(face_rois) if roi is face_roi), len(face_rois) - 1)
+            emotion_probabilities = self.classify(face_rois)
+            frame['emotion_probabilities'] = emotion_probabilities
+            predicted_class_index = np.argmax(emotion_probabilities[primary])
             predicted_class = self.class_names[predicted_class_index]
 
             # Update state window
             self.state_window.append(predicted_class)
             if len(self.state_window) > self.window_size:
-                self.state_window.pop(0)
+                del self.state_window[:-self.window_size]
 
             # Count occurrences of states in the window
             state_counts = Counter(self.state_window)
@@ -58,19 +99,20 @@ class EmotionDetector:
 
             # Apply moving average smoothing
             if len(self.smoothed_predictions) > self.smoothing_window:
-                self.smoothed_predictions.pop(0)
+                del self.smoothed_predictions[:-self.smoothing_window]
                 overall_state = Counter(self.smoothed_predictions).most_common(1)[0][0]    
 
             # Filter out instances where the user is looking downwards (towards the keyboard)
             if pitch < -np.pi/9:  # Adjust this threshold as needed
                 overall_state = "Normal"     
         
-            # Add emotion prediction text overlay to the frame
-            emotion_text = "Predicted Emotion: " + overall_state
-            cv2.putText(frame['bgr'], overall_state, (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            if draw:
+                # Add emotion prediction text overlay to the frame
+                emotion_text = "Predicted Emotion: " + overall_state
+                cv2.putText(frame['bgr'], overall_state, (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-            resized_frame = cv2.resize(frame['bgr'], (300, 200))
-            cv2.imshow('Ergo-Sight', resized_frame)
+                resized_frame = cv2.resize(frame['bgr'], (300, 200))
+                cv2.imshow('Ergo-Sight', resized_frame)
 
         # test add
             return blink, overall_state
@@ -79,3 +121,34 @@ class EmotionDetector:
             print("Error ",e)
 
             return blink, None
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from inference_backend import EMOTION_MODEL_PATHS, KerasBackend
+
+    parser = argparse.ArgumentParser(description="Per-call latency of the emotion model")
+    parser.add_argument('--faces', type=int, default=1, help="faces per call")
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    def latency(backend, batch):
+        backend.run(batch)
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            backend.run(batch)
+        return 1000.0 * (time.perf_counter() - start) / args.iterations
+
+    batch = np.random.default_rng(0).random((args.faces, 48, 48, 1), dtype=np.float32)
+    backends = [('keras predict', lambda: KerasBackend(EMOTION_MODEL_PATHS['keras'], compiled=False)),
+                ('keras compiled', lambda: KerasBackend(EMOTION_MODEL_PATHS['keras'])),
+                ('tflite', lambda: create_emotion_backend('tflite')),
+                ('onnx', lambda: create_emotion_backend('onnx'))]
+    for name, build in backends:
+        try:
+            backend = build()
+        except (IOError, OSError, ImportError, ValueError) as e:
+            print('{:16} skipped ({})'.format(name, e))
+            continue
+        print('{:16} {:8.3f} ms/call'.format(name, latency(backend, batch)))
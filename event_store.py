@@ -0,0 +1,431 @@
+import atexit
+import os
+from collections import Counter
+import re
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_PATH = 'FILES/progress.db'
+
+_UPSERT = 'ON CONFLICT (category, bucket, value) DO UPDATE SET count = count + excluded.count'
+_events_recorded = metrics.REGISTRY.counter('events_recorded', 'Progress events recorded')
+_PARTITION = re.compile(r'^events_(\d{8})$')
+
+# Rollup resolutions and their bucket widths in seconds; day buckets follow the local calendar
+ROLLUPS = (('minute', 60), ('hour', 3600), ('day', None))
+# Days of rollups kept per resolution (None: forever), well past the raw events
+ROLLUP_RETENTION = {'minute': 7, 'hour': 90, 'day': None}
+
+
+def _day(timestamp):
+    return time.strftime('%Y%m%d', time.localtime(timestamp))
+
+
+def _day_start(day):
+    return time.mktime(time.strptime(day, '%Y%m%d'))
+
+
+class EventStore:
+    """
+    Progress events (posture ratings, dominant emotions) in SQLite.
+
+    record() only appends to an in-memory buffer; a background thread writes the buffer in one
+    transaction every `flush_interval` seconds, or sooner when it holds `max_buffer` events.
+    Events are partitioned by local day into tables events_YYYYMMDD, each indexed on time, so
+    retention drops whole days and a query only touches the days it covers. Retention runs on the
+    flush thread when the store opens and again whenever the local day changes, so a store kept
+    open for days still drops them.
+
+    Each flush also adds its events to per-minute, per-hour and per-day count tables
+    (rollup_minute, rollup_hour, rollup_day), so counts() over whole minutes, hours or days reads
+    one row per bucket and value instead of every event, and the rollups outlive the raw events.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, flush_interval=5.0, max_buffer=256, retention_days=7,
+                 rollup_retention=None):
+        """
+        :param path: SQLite database file.
+        :param flush_interval: Seconds between background flushes.
+        :param max_buffer: Buffered events that trigger an early flush.
+        :param retention_days: Days of raw events kept, today included.
+        :param rollup_retention: Dict of resolution -> days of rollups kept (None: forever),
+            defaults to ROLLUP_RETENTION.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.retention_days = retention_days
+        self.rollup_retention = dict(ROLLUP_RETENTION, **(rollup_retention or {}))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Shared by the recording threads and the flush thread, serialised by _db_lock
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db_lock = threading.Lock()
+        self._partitions = set(self.partitions())
+        self._create_rollups()
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        # Held from taking the buffer to committing it, so a query's flush waits for one in flight
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def partitions(self):
+        """
+        :returns: The stored days as 'YYYYMMDD' strings, oldest first.
+        """
+        with self._db_lock:
+            rows = self._db.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        return sorted(m.group(1) for m in (_PARTITION.match(name) for (name,) in rows) if m)
+
+    def _ensure_partition(self, day):
+        if day not in self._partitions:
+            self._db.execute('CREATE TABLE IF NOT EXISTS events_{} '
+                             '(timestamp REAL NOT NULL, category TEXT NOT NULL, value TEXT NOT NULL)'.format(day))
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_{0}_time ON events_{0} (category, timestamp)'.format(day))
+            self._partitions.add(day)
+
+    def _create_rollups(self):
+        with self._db_lock:
+            exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='rollup_day'").fetchone()
+            with self._db:
+                for name, _ in ROLLUPS:
+                    # Keyed by category first, so a chart reads one contiguous range
+                    self._db.execute('CREATE TABLE IF NOT EXISTS rollup_{} (category TEXT NOT NULL, bucket INTEGER NOT NULL, '
+                                     'value TEXT NOT NULL, count INTEGER NOT NULL, '
+                                     'PRIMARY KEY (category, bucket, value)) WITHOUT ROWID'.format(name))
+                if not exists:
+                    # One-time: databases written before the rollups get them from their raw events
+                    for day in sorted(self._partitions):
+                        self._backfill(day)
+
+    def _backfill(self, day):
+        for name, width in ROLLUPS:
+            bucket = int(_day_start(day)) if width is None else 'CAST(timestamp / {0} AS INTEGER) * {0}'.format(width)
+            # WHERE 1 keeps the upsert clause from being parsed as a join constraint
+            self._db.execute('INSERT INTO rollup_{} SELECT category, {}, value, COUNT(*) FROM events_{} WHERE 1 '
+                             'GROUP BY 1, 2, 3 {}'.format(name, bucket, day, _UPSERT))
+
+    def record(self, category, value, timestamp=None):
+        """
+        Buffers one event, e.g. record('Posture', 'Good-Posture').
+        """
+        event = (time.time() if timestamp is None else timestamp, category, value)
+        with self._buffer_lock:
+            self._buffer.append(event)
+            full = len(self._buffer) >= self.max_buffer
+        _events_recorded.inc()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Writes the buffered events, one transaction for all of them.
+        """
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._buffer_lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return
+        by_day, day_starts = {}, {}
+        rollups = {name: Counter() for name, _ in ROLLUPS}
+        for event in events:
+            timestamp, category, value = event
+            day = _day(timestamp)
+            by_day.setdefault(day, []).append(event)
+            if day not in day_starts:
+                day_starts[day] = int(_day_start(day))
+            for name, width in ROLLUPS:
+                bucket = day_starts[day] if width is None else int(timestamp // width) * width
+                rollups[name][category, bucket, value] += 1
+        with metrics.timer('event_flush_seconds', 'Progress event flushes'), self._db_lock:
+            with self._db:
+                for day, day_events in by_day.items():
+                    self._ensure_partition(day)
+                    self._db.executemany('INSERT INTO events_{} VALUES (?, ?, ?)'.format(day), day_events)
+                for name, counts in rollups.items():
+                    self._db.executemany('INSERT INTO rollup_{} VALUES (?, ?, ?, ?) {}'.format(name, _UPSERT),
+                                         [key + (count,) for key, count in counts.items()])
+
+    def _run(self):
+        # Old days are dropped here rather than in the constructor, so startup does not wait for it
+        retained_day = None
+        while not self._stop.is_set():
+            today = _day(time.time())
+            if today != retained_day:
+                retained_day = today
+                try:
+                    self.apply_retention()
+                except sqlite3.Error as e:
+                    print(f"Error dropping old progress events: {e}")
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error writing progress events: {e}")
+
+    def _days(self, start, end):
+        # Partitions overlapping [start, end]
+        first = _day(start) if start is not None else None
+        last = _day(end) if end is not None else None
+        return [day for day in sorted(self._partitions)
+                if (first is None or day >= first) and (last is None or day <= last)]
+
+    def _query(self, select, category, start, end, group_by=''):
+        self.flush()
+        conditions, params = [], []
+        if category is not None:
+            conditions.append('category = ?')
+            params.append(category)
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('timestamp < ?')
+            params.append(end)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self._db_lock:
+            days = self._days(start, end)
+            if not days:
+                return []
+            union = ' UNION ALL '.join('SELECT timestamp, category, value FROM events_{}'.format(day) for day in days)
+            sql = 'SELECT {} FROM ({}){}{}'.format(select, union, where, group_by)
+            return self._db.execute(sql, params).fetchall()
+
+    def events(self, category=None, start=None, end=None):
+        """
+        :returns: List of (timestamp, category, value) in [start, end), oldest first.
+        """
+        return self._query('timestamp, category, value', category, start, end, ' ORDER BY timestamp')
+
+    def counts(self, category, start=None, end=None):
+        """
+        :returns: Dict of value -> number of events of `category` in [start, end).
+            Read from the coarsest rollup whose buckets start and end fall on, or from the raw
+            events when they are not on a minute boundary.
+        """
+        resolution = _resolution(start, end)
+        if resolution is None:
+            return dict(self._query('value, COUNT(*)', category, start, end, ' GROUP BY value'))
+        return dict(self._rollup_query('value, SUM(count)', resolution, category, start, end, ' GROUP BY value'))
+
+    def rollup(self, category, resolution='day', start=None, end=None):
+        """
+        :param resolution: 'minute', 'hour' or 'day'.
+        :returns: List of (bucket start, value, count) of `category` for the buckets starting in
+            [start, end), oldest first; buckets without events are left out.
+        """
+        return self._rollup_query('bucket, value, count', resolution, category, start, end, ' ORDER BY bucket, value')
+
+    def _rollup_query(self, select, resolution, category, start, end, tail):
+        if resolution not in ROLLUP_RETENTION:
+            raise ValueError("Unknown rollup resolution {!r}".format(resolution))
+        self.flush()
+        sql, params = 'SELECT {} FROM rollup_{} WHERE category = ?'.format(select, resolution), [category]
+        if start is not None:
+            sql += ' AND bucket >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND bucket < ?'
+            params.append(end)
+        with self._db_lock:
+            return self._db.execute(sql + tail, params).fetchall()
+
+    def apply_retention(self, now=None):
+        """
+        Drops the day partitions older than `retention_days`, and the rollup buckets older than
+        `rollup_retention`.
+        :returns: The dropped days.
+        """
+        keep_from = _day(days_start(self.retention_days, now))
+        dropped = []
+        with self._db_lock:
+            with self._db:
+                for day in sorted(self._partitions):
+                    if day < keep_from:
+                        self._db.execute('DROP TABLE IF EXISTS events_{}'.format(day))
+                        self._partitions.discard(day)
+                        dropped.append(day)
+                for name, days in self.rollup_retention.items():
+                    if days is not None:
+                        self._db.execute('DELETE FROM rollup_{} WHERE bucket < ?'.format(name), (days_start(days, now),))
+        return dropped
+
+    def import_text_file(self, path, rename=True):
+        """
+        Imports a progress file written by the old text format
+        ("YYYY-MM-DD HH:MM:SS - title : result" per line), then renames it to <path>.imported.
+        :returns: Number of imported events.
+        """
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    stamp, rest = line.rstrip('\n').split(' - ', 1)
+                    category, value = rest.split(' : ', 1)
+                    timestamp = time.mktime(time.strptime(stamp, '%Y-%m-%d %H:%M:%S'))
+                except ValueError:
+                    continue
+                self.record(category.strip(), value.strip(), timestamp)
+                count += 1
+        self.flush()
+        if rename:
+            os.replace(path, path + '.imported')
+        return count
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(2.0)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_event_store(path=DEFAULT_PATH, **kwargs):
+    """
+    :returns: The process-wide EventStore for `path`, so all monitors share one buffer and connection.
+    """
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = EventStore(path, **kwargs)
+        return store
+
+
+def today_start(now=None):
+    return _day_start(_day(time.time() if now is None else now))
+
+
+def days_start(days=1, now=None):
+    """
+    :returns: Start of the local day `days - 1` days before today, so [days_start(7), now) is the last week.
+    """
+    # Stepping back from noon, a daylight-saving change cannot land on the wrong day
+    return _day_start(_day(today_start(now) + 43200 - (days - 1) * 86400))
+
+
+def _resolution(start, end):
+    # Coarsest rollup whose buckets both bounds fall on; None when only the raw events can answer
+    for name, width in reversed(ROLLUPS):
+        if all(bound is None or (bound == today_start(bound) if width is None else bound % width == 0)
+               for bound in (start, end)):
+            return name
+    return None
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    # Write throughput and startup cost: the old text files against the event store. The history
+    # holds `days` days of one record per posture tick (5 s), of which only today is kept.
+    directory = tempfile.mkdtemp()
+    days, per_day, writes = 7, 17280, 5000
+    now = time.time()
+
+    def legacy_save(path, title, result):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        with open(path, 'a') as file:
+            file.write("{} - {} : {}\n".format(timestamp, title, result))
+
+    def legacy_delete_old_data(path):
+        current_date = time.strftime("%Y-%m-%d", time.localtime())
+        with open(path, 'r') as file:
+            lines = file.readlines()
+        with open(path, 'w') as file:
+            file.writelines([line for line in lines if line.startswith(current_date)])
+
+    text_path = os.path.join(directory, 'posture_data.txt')
+    store = EventStore(os.path.join(directory, 'progress.db'), retention_days=1)
+    with open(text_path, 'w') as file:
+        for d in range(days - 1, -1, -1):
+            for i in range(per_day):
+                timestamp = now - d * 86400 - i * 5
+                file.write("{} - Posture : Good-Posture\n".format(
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))))
+                store.record('Posture', 'Good-Posture', timestamp)
+    store.flush()
+    store.close()
+
+    start = time.perf_counter()
+    for _ in range(writes):
+        legacy_save(text_path, 'Posture', 'Good-Posture')
+    legacy_write = writes / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    legacy_delete_old_data(text_path)
+    legacy_startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = EventStore(os.path.join(directory, 'progress.db'), retention_days=1)
+    store_startup = time.perf_counter() - start
+    # Runs on the flush thread at startup; timed here on its own
+    start = time.perf_counter()
+    store.apply_retention(now)
+    retention = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(writes):
+        store.record('Posture', 'Good-Posture')
+    store.flush()
+    store_write = writes / (time.perf_counter() - start)
+
+    store.close()
+
+    # Chart queries over `weeks` weeks of history with every raw event kept: a scan of the raw
+    # events against the rollups, for today and for the whole range.
+    weeks = 4
+    store = EventStore(os.path.join(directory, 'history.db'), retention_days=7 * weeks)
+    values = ('Good-Posture', 'Neutral-Posture', 'Poor-Posture')
+    for d in range(7 * weeks):
+        for i in range(per_day):
+            store.record('Posture', values[i % 3], now - d * 86400 - i * 5)
+    store.flush()
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, 1000 * (time.perf_counter() - start)
+
+    raw_counts = lambda start: dict(store._query('value, COUNT(*)', 'Posture', start, None, ' GROUP BY value'))
+    raw_today, raw_today_ms = timed(raw_counts, today_start(now))
+    rolled_today, rolled_today_ms = timed(store.counts, 'Posture', today_start(now))
+    raw_weeks, raw_weeks_ms = timed(raw_counts, days_start(7 * weeks, now))
+    rolled_weeks, rolled_weeks_ms = timed(store.counts, 'Posture', days_start(7 * weeks, now))
+    daily, daily_ms = timed(store.rollup, 'Posture', 'day', days_start(7 * weeks, now))
+    assert raw_today == rolled_today and raw_weeks == rolled_weeks
+    store.close()
+    shutil.rmtree(directory)
+
+    print('{} days x {} events of history, {} writes'.format(days, per_day, writes))
+    print('text file    {:10.0f} writes/s   startup {:7.1f} ms'.format(legacy_write, 1000 * legacy_startup))
+    print('event store  {:10.0f} writes/s   startup {:7.1f} ms   retention (background) {:.1f} ms'.format(
+        store_write, 1000 * store_startup, 1000 * retention))
+    print('counts over  {:>10}   {:>10}   ({} events/day)'.format('today', '{} weeks'.format(weeks), per_day))
+    print('raw events   {:8.1f} ms  {:8.1f} ms'.format(raw_today_ms, raw_weeks_ms))
+    print('rollups      {:8.2f} ms  {:8.2f} ms   per-day series {:.2f} ms ({} rows)'.format(
+        rolled_today_ms, rolled_weeks_ms, daily_ms, len(daily)))
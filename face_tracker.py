@@ -0,0 +1,200 @@
+import cv2
+import dlib
+import numpy as np
+
+
+class FaceTracker:
+    """
+    Tracks face boxes between detections with pyramidal Lucas-Kanade optical flow on the
+    previous frame's landmarks (or corners inside the box when there are none).
+
+    Every tracked face gets a confidence: the fraction of points that survive a forward-backward
+    flow check. The HOG detector only runs
+      - on the whole (half resolution) frame when nothing is tracked,
+      - inside an ROI around a tracked face when its confidence drops or its detection interval is up.
+    Every face has its own interval, adapted to its own motion: it grows while the face is still
+    and shrinks when it moves, so a face that keeps losing tracking does not make the others
+    re-detect more often.
+    """
+
+    def __init__(self, detector=None, min_confidence=0.6, roi_margin=0.5, fb_threshold=1.0,
+                 min_interval=5, max_interval=120, still_motion=0.5, fast_motion=4.0):
+        """
+        :param detector: dlib face detector, defaults to the frontal HOG detector.
+        :param min_confidence: Re-detect a face when fewer than this fraction of its points track.
+        :param roi_margin: ROI padding around the tracked box, as a fraction of its size.
+        :param fb_threshold: Maximum forward-backward error (px) for a point to count as tracked.
+        :param min_interval: Detection interval (frames) under fast motion.
+        :param max_interval: Detection interval (frames) when the face is still.
+        :param still_motion: Median point motion (px/frame) under which the face is considered still.
+        :param fast_motion: Median point motion (px/frame) above which the interval drops to the minimum.
+        """
+        self.detector = detector or dlib.get_frontal_face_detector()
+        self.min_confidence = min_confidence
+        self.roi_margin = roi_margin
+        self.fb_threshold = fb_threshold
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.still_motion = still_motion
+        self.fast_motion = fast_motion
+
+        self.intervals = []
+        self.full_detections = 0
+        self.roi_detections = 0
+        self.tracked_frames = 0
+
+        self._lk_params = dict(winSize=(21, 21), maxLevel=3,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    def update(self, frame, frames):
+        """
+        Sets frame['faces'] (list of (l, t, w, h), or None), frame['face_confidence'],
+        frame['face_detect_index'] and frame['face_interval'] (per face), and
+        frame['last_face_detect_index'] (the latest detection of any face).
+        :param frames: FrameStore with the previous frames (their gray images, faces and landmarks).
+        """
+        previous = frames.previous(frame['frame_index'])
+        if previous is None or not previous.get('faces') or 'gray' not in previous:
+            return self._detect_full(frame)
+
+        faces, confidences, motions = self._track(previous, frame['gray'])
+        detect_indexes = previous.get('face_detect_index')
+        intervals = previous.get('face_interval')
+        if detect_indexes is None or len(detect_indexes) != len(faces):
+            detect_indexes = [previous.get('last_face_detect_index', frame['frame_index'])] * len(faces)
+            intervals = [self.min_interval] * len(faces)
+        detect_indexes = list(detect_indexes)
+        intervals = [self._adapt_interval(interval, motion) for interval, motion in zip(intervals, motions)]
+
+        for i, box in enumerate(faces):
+            since_detection = frame['frame_index'] - detect_indexes[i]
+            if confidences[i] >= self.min_confidence and since_detection < intervals[i]:
+                continue
+
+            detected = self._detect_roi(frame['gray'], box)
+            detect_indexes[i] = frame['frame_index']
+            if detected is not None:
+                faces[i], confidences[i] = detected, 1.0
+            elif confidences[i] < self.min_confidence:
+                faces[i] = None
+
+        kept = [face for face in zip(faces, confidences, detect_indexes, intervals) if face[0] is not None]
+        if not kept:
+            return self._detect_full(frame)
+
+        self.tracked_frames += 1
+        kept.sort(key=lambda item: item[0][0])
+        faces, confidences, detect_indexes, intervals = (list(values) for values in zip(*kept))
+        frame['faces'] = faces
+        frame['face_confidence'] = confidences
+        frame['face_detect_index'] = detect_indexes
+        frame['face_interval'] = self.intervals = intervals
+        frame['last_face_detect_index'] = max(detect_indexes)
+        return frame
+
+    def _detect_full(self, frame):
+        # Same as the untracked path of gaze.detect_face: half resolution, whole frame
+        self.full_detections += 1
+        rects = self.detector(cv2.resize(frame['gray'], (0, 0), fx=0.5, fy=0.5), 0)
+        if len(rects) == 0:
+            frame['faces'] = None
+            return frame
+
+        faces = [(2 * d.left(), 2 * d.top(), 2 * (d.right() - d.left()), 2 * (d.bottom() - d.top())) for d in rects]
+        faces.sort(key=lambda bbox: bbox[0])
+        frame['faces'] = faces
+        frame['face_confidence'] = [1.0] * len(faces)
+        frame['face_detect_index'] = [frame['frame_index']] * len(faces)
+        frame['face_interval'] = self.intervals = [self.min_interval] * len(faces)
+        frame['last_face_detect_index'] = frame['frame_index']
+        return frame
+
+    def _detect_roi(self, gray, box):
+        # Run the detector on a padded window around `box`, scaled so the face is ~120 px wide
+        self.roi_detections += 1
+        l, t, w, h = box
+        height, width = gray.shape[:2]
+        x0 = max(int(l - self.roi_margin * w), 0)
+        y0 = max(int(t - self.roi_margin * h), 0)
+        x1 = min(int(l + w + self.roi_margin * w), width)
+        y1 = min(int(t + h + self.roi_margin * h), height)
+        if x1 - x0 < 40 or y1 - y0 < 40:
+            return None
+
+        scale = min(1.0, 120.0 / max(w, 1))
+        roi = gray[y0:y1, x0:x1]
+        if scale < 1.0:
+            roi = cv2.resize(roi, (0, 0), fx=scale, fy=scale)
+        rects = self.detector(roi, 0)
+        if len(rects) == 0:
+            return None
+
+        # Closest detection to the tracked box
+        cx, cy = l + w / 2.0, t + h / 2.0
+        best = min(rects, key=lambda d: (x0 + d.center().x / scale - cx) ** 2 + (y0 + d.center().y / scale - cy) ** 2)
+        return (int(x0 + best.left() / scale), int(y0 + best.top() / scale),
+                int(best.width() / scale), int(best.height() / scale))
+
+    def _points(self, previous, i, box):
+        landmarks = previous.get('landmarks')
+        if landmarks is not None and i < len(landmarks) and len(landmarks[i]):
+            return np.asarray(landmarks[i], dtype=np.float32).reshape(-1, 1, 2)
+
+        l, t, w, h = box
+        mask = np.zeros(previous['gray'].shape[:2], np.uint8)
+        mask[max(t, 0):t + h, max(l, 0):l + w] = 255
+        return cv2.goodFeaturesToTrack(previous['gray'], maxCorners=50, qualityLevel=0.01, minDistance=5, mask=mask)
+
+    def _track(self, previous, gray):
+        # Per face: tracked box, confidence and motion (px/frame, None when tracking failed)
+        faces, confidences, motions = [], [], []
+        for i, box in enumerate(previous['faces']):
+            points = self._points(previous, i, box)
+            if points is None or len(points) < 4:
+                faces.append(box)
+                confidences.append(0.0)
+                motions.append(None)
+                continue
+
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(previous['gray'], gray, points, None, **self._lk_params)
+            backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, previous['gray'], forward, None, **self._lk_params)
+            fb_error = np.linalg.norm((points - backward).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.fb_threshold)
+            confidence = float(good.mean())
+            if good.sum() < 4:
+                faces.append(box)
+                confidences.append(0.0)
+                motions.append(None)
+                continue
+
+            old, new = points.reshape(-1, 2)[good], forward.reshape(-1, 2)[good]
+            shift = np.median(new - old, axis=0)
+            # Scale from the spread of the points around their centroid
+            old_spread = np.median(np.linalg.norm(old - old.mean(axis=0), axis=1))
+            new_spread = np.median(np.linalg.norm(new - new.mean(axis=0), axis=1))
+            scale = new_spread / old_spread if old_spread > 0 else 1.0
+
+            l, t, w, h = box
+            cx, cy = l + w / 2.0 + shift[0], t + h / 2.0 + shift[1]
+            w, h = w * scale, h * scale
+            faces.append((int(round(cx - w / 2)), int(round(cy - h / 2)), int(round(w)), int(round(h))))
+            confidences.append(confidence)
+            motions.append(float(np.linalg.norm(shift)))
+
+        return faces, confidences, motions
+
+    def _adapt_interval(self, interval, motion):
+        # Next detection interval of a face from its motion on this frame
+        if motion is None:
+            return interval
+        if motion >= self.fast_motion:
+            return self.min_interval
+        if motion <= self.still_motion:
+            return min(self.max_interval, int(interval * 1.5) + 1)
+        return max(self.min_interval, int(interval * 0.75))
+
+    def stats(self):
+        return {'intervals': self.intervals,
+                'tracked_frames': self.tracked_frames,
+                'full_detections': self.full_detections,
+                'roi_detections': self.roi_detections}
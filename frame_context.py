@@ -0,0 +1,116 @@
+import numpy as np
+
+NUM_LANDMARKS = 68
+
+
+class FrameContext:
+    """
+    Per-frame state passed between the monitoring stages.
+
+    Fields live in __slots__ instead of a dict, and the facial landmarks of all faces are one
+    contiguous float32 array [faces, 68, 2] that is filled once per frame and read in place by
+    gaze, blink and emotion. Item access (frame['gray'], 'pitch' in frame, frame.get(...)) is kept
+    so the stage functions work on both FrameContext and plain dict frames; a field that was
+    never set counts as missing.
+    """
+
+    __slots__ = ('frame_index', 'timestamp', 'captured_at', 'bgr', 'gray',
+                 'faces', 'face_confidence', 'last_face_detect_index', 'face_detect_index', 'face_interval',
+                 'landmarks', 'smoothed_landmarks', 'face_rois', 'face_roi',
+                 'eyes', 'eye_batch', 'gaze', 'pitch', 'emotion_probabilities')
+
+    def __init__(self, frame_index, bgr=None, gray=None, timestamp=None):
+        self.frame_index = frame_index
+        self.timestamp = timestamp
+        if bgr is not None:
+            self.bgr = bgr
+        if gray is not None:
+            self.gray = gray
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__ if hasattr(self, key)]
+
+    def copy(self, drop_keys=()):
+        """
+        :returns: Shallow copy without the fields in `drop_keys`.
+        """
+        copied = FrameContext.__new__(FrameContext)
+        for key in self.__slots__:
+            if key not in drop_keys and hasattr(self, key):
+                setattr(copied, key, getattr(self, key))
+        return copied
+
+    def allocate_landmarks(self, num_faces):
+        # One [faces, 68, 2] block; landmarks[f] is a view, not a copy
+        self.landmarks = np.empty((num_faces, NUM_LANDMARKS, 2), np.float32)
+        return self.landmarks
+
+
+def shape_to_array(shape, out=None):
+    """
+    Converts a dlib full_object_detection into a [68, 2] array in one pass, writing into `out` if given.
+    """
+    if out is None:
+        out = np.empty((shape.num_parts, 2), np.float32)
+    out.reshape(-1)[:] = np.fromiter((c for p in shape.parts() for c in (p.x, p.y)),
+                                     dtype=np.float32, count=2 * shape.num_parts)
+    return out
+
+
+if __name__ == "__main__":
+    import time
+    import dlib
+    from imutils import face_utils
+
+    # Per-frame bookkeeping cost: dict frames with the two dlib conversions (landmarks list and
+    # blink's shape_to_np) against FrameContext with one conversion into the shared array
+    rng = np.random.default_rng(0)
+    rect = dlib.rectangle(100, 100, 300, 300)
+    shapes = [dlib.full_object_detection(rect, [dlib.point(int(x), int(y)) for x, y in rng.uniform(100, 300, (68, 2))])
+              for _ in range(2)]
+    gray = np.zeros((480, 640), np.uint8)
+
+    def tuple_from_dlib_shape(index, landmarks_dlib):
+        p = landmarks_dlib.part(index)
+        return (p.x, p.y)
+
+    def dict_frame(i):
+        frame = {'frame_index': i, 'bgr': None, 'gray': gray}
+        frame['faces'] = [(100, 100, 200, 200)] * len(shapes)
+        landmarks = []
+        for shape in shapes:
+            landmarks.append(np.array([tuple_from_dlib_shape(k, shape) for k in range(shape.num_parts)]))
+        frame['landmarks'] = landmarks
+        frame['pitch'] = 0.0
+        blink_points = face_utils.shape_to_np(shapes[-1])
+        return 'pitch' in frame and frame['landmarks'][-1][36, 0] + blink_points[36, 0]
+
+    def context_frame(i):
+        frame = FrameContext(i, None, gray)
+        frame.faces = [(100, 100, 200, 200)] * len(shapes)
+        landmarks = frame.allocate_landmarks(len(shapes))
+        for f, shape in enumerate(shapes):
+            shape_to_array(shape, landmarks[f])
+        frame.pitch = 0.0
+        return 'pitch' in frame and frame.landmarks[-1][36, 0] + frame.landmarks[-1][36, 0]
+
+    for name, fn in (('dict frame', dict_frame), ('FrameContext', context_frame)):
+        start = time.perf_counter()
+        for i in range(20000):
+            fn(i)
+        print('{:14} {:7.2f} us/frame'.format(name, 1e6 * (time.perf_counter() - start) / 20000))
@@ -0,0 +1,184 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    """
+    Replays frames in place of the webcam, for running and measuring the monitors without one.
+
+    Sources read like a cv2.VideoCapture and like a CameraHub subscription (read, isOpened,
+    release), and subscribe() returns the source itself, so one can be passed as `camera` to
+    EmotionMonitor or PostureWatcher.
+
+    realtime=True paces frames at `fps` like a live camera: reading blocks until the next frame
+    is due, and frames that went by while the consumer was busy, or that a `fresh` read passes
+    over, are skipped (counted in `dropped`). realtime=False hands out every frame as fast as it is read.
+    """
+
+    def __init__(self, fps=30.0, realtime=True, size=None, max_frames=None):
+        """
+        :param fps: Frame rate of the replay.
+        :param realtime: Pace frames at `fps` (dropping late ones) instead of at maximum speed.
+        :param size: (width, height) frames are resized to, None to keep the source size.
+        :param max_frames: Stop after this many source frames, None to play to the end.
+        """
+        self.fps = fps
+        self.realtime = realtime
+        self.size = size
+        self.max_frames = max_frames
+
+        self.position = 0  # index of the next source frame
+        self.frames_read = 0
+        self.dropped = 0
+        self.frame_index = 0
+        self.timestamp = None
+        self._started = None
+        self._closed = False
+
+    def _next(self):
+        # Returns the frame at self.position, or None at the end of the source
+        raise NotImplementedError
+
+    def _skip(self, count):
+        # Advances past `count` frames without decoding them where possible
+        for _ in range(count):
+            if self._next() is None:
+                break
+            self.position += 1
+
+    def _drop(self, count):
+        # Skips up to `count` frames, never past max_frames, and counts the ones skipped
+        if self.max_frames is not None:
+            count = min(count, self.max_frames - self.position)
+        start = self.position
+        self._skip(count)
+        self.dropped += self.position - start
+
+    def _ended(self):
+        return self.max_frames is not None and self.position >= self.max_frames
+
+    def isOpened(self):
+        return not self._closed and not self._ended()
+
+    def read(self, timeout=None, fresh=False):
+        """
+        :param fresh: In real time, wait for a frame due after this call.
+        :returns: (True, frame) or (False, None) at the end of the source.
+        """
+        if not self.isOpened():
+            return False, None
+
+        if self.realtime:
+            if self._started is None:
+                self._started = time.perf_counter()
+            due = int((time.perf_counter() - self._started) * self.fps)
+            if self.position < due:
+                self._drop(due - self.position)
+            if fresh and self.position <= due:
+                self._drop(due + 1 - self.position)
+            wait = self._started + self.position / self.fps - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        frame = None if self._ended() else self._next()
+        if frame is None:
+            self._closed = True
+            return False, None
+        self.position += 1
+        self.frames_read += 1
+        self.frame_index = self.position
+        self.timestamp = time.time()
+        if self.size is not None and frame.shape[1::-1] != tuple(self.size):
+            frame = cv2.resize(frame, tuple(self.size), interpolation=cv2.INTER_AREA)
+        return True, frame
+
+    def set(self, prop, value):
+        # Capture properties do not apply to a replay
+        return False
+
+    def subscribe(self, name=None, rate=None, size=None):
+        if size is not None:
+            self.size = size
+        return self
+
+    def release(self):
+        self._closed = True
+
+    @property
+    def seconds(self):
+        # Source time covered so far, dropped frames included
+        return self.position / self.fps
+
+
+class VideoFileSource(FrameSource):
+    """
+    Replays a recorded video file, optionally looping it.
+    """
+
+    def __init__(self, path, fps=None, realtime=True, size=None, max_frames=None, loop=False):
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError("Cannot open video file: {}".format(path))
+        fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        super().__init__(fps, realtime, size, max_frames)
+
+    def _grab(self):
+        if self.cap.grab():
+            return True
+        if self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return self.cap.grab()
+        return False
+
+    def _next(self):
+        if not self._grab():
+            return None
+        ok, frame = self.cap.retrieve()
+        return frame if ok else None
+
+    def _skip(self, count):
+        for _ in range(count):
+            if not self._grab():
+                break
+            self.position += 1
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class SyntheticSource(FrameSource):
+    """
+    Generates frames: fixed noise scrolling sideways, so consecutive frames differ like camera
+    frames do. There are no faces or people in them; use it for capture and per-frame overhead.
+    """
+
+    def __init__(self, width=640, height=480, fps=30.0, realtime=True, size=None, max_frames=None, seed=0):
+        super().__init__(fps, realtime, size, max_frames)
+        rng = np.random.default_rng(seed)
+        self._base = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+
+    def _next(self):
+        return np.roll(self._base, self.position % self._base.shape[1], axis=1)
+
+    def _skip(self, count):
+        self.position += count
+
+
+def open_source(video=None, synthetic=False, realtime=True, seconds=None, size=None, loop=False):
+    """
+    :returns: A VideoFileSource for `video`, or a SyntheticSource if `synthetic`.
+    """
+    if video:
+        source = VideoFileSource(video, realtime=realtime, size=size, loop=loop)
+    elif synthetic:
+        source = SyntheticSource(realtime=realtime, size=size)
+    else:
+        raise ValueError("A video file or synthetic=True is required")
+    if seconds is not None:
+        source.max_frames = int(seconds * source.fps)
+    return source
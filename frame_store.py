@@ -0,0 +1,88 @@
+class FrameStore:
+    """
+    Fixed-capacity frame history (ring buffer) keyed by frame index.
+    Stores a shallow copy of each frame (dict or FrameContext) without the keys in `drop_keys`,
+    so the full BGR image is not kept alive by the history.
+    """
+
+    def __init__(self, capacity=8, drop_keys=('bgr',)):
+        """
+        :param capacity: Number of frames to keep.
+        :param drop_keys: Frame keys that are not kept in the history.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.drop_keys = set(drop_keys)
+        self._slots = [None] * capacity
+        self._sequence = {}  # frame index -> insertion sequence number
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def __contains__(self, frame_index):
+        return frame_index in self._sequence
+
+    def add(self, frame):
+        """
+        Adds a frame to the history, evicting the oldest one when full.
+        :returns: The stored (copied) frame.
+        """
+        if hasattr(frame, 'copy') and not isinstance(frame, dict):
+            stored = frame.copy(self.drop_keys)
+        else:
+            stored = {k: v for k, v in frame.items() if k not in self.drop_keys}
+        slot = self._count % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None:
+            del self._sequence[evicted['frame_index']]
+
+        self._slots[slot] = stored
+        self._sequence[stored['frame_index']] = self._count
+        self._count += 1
+        return stored
+
+    def _at(self, sequence):
+        if sequence < 0 or sequence < self._count - self.capacity or sequence >= self._count:
+            return None
+        return self._slots[sequence % self.capacity]
+
+    def get(self, frame_index):
+        """
+        :returns: The stored frame with the given index, or None if it is not (or no longer) in the history.
+        """
+        sequence = self._sequence.get(frame_index)
+        return None if sequence is None else self._at(sequence)
+
+    def latest(self, offset=0):
+        """
+        :param offset: 0 for the newest frame, 1 for the one before it, etc.
+        :returns: The stored frame, or None if the history is not that deep.
+        """
+        return self._at(self._count - 1 - offset)
+
+    def previous(self, frame_index):
+        """
+        :returns: The frame stored just before `frame_index`. If `frame_index` has not been added yet,
+                  this is the newest stored frame. None if there is no such frame.
+        """
+        sequence = self._sequence.get(frame_index)
+        if sequence is None:
+            latest = self.latest()
+            if latest is not None and latest['frame_index'] < frame_index:
+                return latest
+            return None
+        return self._at(sequence - 1)
+
+    def history(self, n=None):
+        """
+        :returns: Up to `n` most recent frames (all stored frames if None), oldest first.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        return [self._at(self._count - n + i) for i in range(n)]
+
+    def clear(self):
+        self._slots = [None] * self.capacity
+        self._sequence.clear()
+        self._count = 0
@@ -0,0 +1,271 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from ehg_nfeat24_B2_Hg1_D4_E1 import HourglassNet
+import metrics
+
+CHECKPOINT_PATH = 'ehg_nfeat24_B2_Hg1_D4_E1.pth.tar'
+
+
+def load_state_dict(checkpoint_path=CHECKPOINT_PATH):
+    """
+    Reads the training checkpoint and returns a state dict for a bare (non DataParallel) HourglassNet.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+    state_dict = {}
+    for k, v in checkpoint['state_dict'].items():
+        if k.split('_')[-1] == 'tracked':
+            continue
+        if k.startswith('module.'):
+            k = k[len('module.'):]
+        state_dict[k] = v
+    return state_dict
+
+
+def load_hourglass(checkpoint_path=CHECKPOINT_PATH):
+    """
+    :returns: HourglassNet with the checkpoint weights, in eval mode.
+    """
+    model = HourglassNet()
+    model.load_state_dict(load_state_dict(checkpoint_path))
+    model.eval()
+    return model
+
+
+def _peak_offset(before, peak, after):
+    # Sub-pixel offset of a peak from a parabola through three samples, in [-0.5, 0.5]
+    denom = 2 * peak - before - after
+    offset = torch.where(denom > 0, 0.5 * (after - before) / denom.clamp(min=1e-12), torch.zeros_like(denom))
+    return offset.clamp(-0.5, 0.5)
+
+
+def decode_heatmaps(heatmaps, method='argmax', beta=50.0):
+    """
+    Torch counterpart of gaze.find_landmarks, traceable so it can run inside the model graph.
+    :param heatmaps: Tensor [B, 18, H, W].
+    :param method: 'argmax' (peak with parabolic sub-pixel refinement) or 'soft' (soft-argmax).
+    :returns: Tensor [B, 18, 2] of (x, y) coordinates.
+    """
+    b, n, h, w = heatmaps.shape
+    flat = heatmaps.reshape(b, n, h * w)
+
+    if method == 'soft':
+        prob = torch.softmax(beta * flat, dim=-1).reshape(b, n, h, w)
+        x = prob.sum(dim=2) @ torch.arange(w, dtype=prob.dtype, device=prob.device)
+        y = prob.sum(dim=3) @ torch.arange(h, dtype=prob.dtype, device=prob.device)
+        return torch.stack([x, y], dim=-1)
+
+    index = flat.argmax(dim=-1)
+    y = torch.div(index, w, rounding_mode='floor')
+    x = index - y * w
+    padded = F.pad(heatmaps, (1, 1, 1, 1), mode='replicate').reshape(b, n, -1)
+
+    def at(dy, dx):
+        return padded.gather(-1, ((y + 1 + dy) * (w + 2) + x + 1 + dx).unsqueeze(-1)).squeeze(-1)
+
+    peak = at(0, 0)
+    dx = _peak_offset(at(0, -1), peak, at(0, 1))
+    dy = _peak_offset(at(-1, 0), peak, at(1, 0))
+    # No refinement on the border, where one neighbour is missing
+    dx = torch.where((x > 0) & (x < w - 1), dx, torch.zeros_like(dx))
+    dy = torch.where((y > 0) & (y < h - 1), dy, torch.zeros_like(dy))
+
+    return torch.stack([x.to(heatmaps.dtype) + dx, y.to(heatmaps.dtype) + dy], dim=-1)
+
+
+class LandmarkDecoder(nn.Module):
+    """
+    Wraps HourglassNet so the heatmaps are decoded inside the graph and only coordinates leave the model.
+    Keeps the list-of-stacks output convention: forward returns [landmarks [B, 18, 2]].
+    """
+
+    def __init__(self, model, method='argmax'):
+        super(LandmarkDecoder, self).__init__()
+        self.model = model
+        self.method = method
+
+    def forward(self, x):
+        return [decode_heatmaps(self.model(x)[-1], self.method)]
+
+
+class GazeEngine:
+    """
+    Inference wrapper around HourglassNet.
+    Runs in eval/inference mode, reuses a preallocated float32 input tensor and does a single
+    batched forward over every eye of every face (and optionally several frames).
+    """
+
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH, model=None, device=None, trace=False,
+                 max_batch=4, eye_shape=(48, 64), decode_in_graph=False, decode_method='argmax', channels=None):
+        """
+        :param checkpoint_path: Checkpoint to load when `model` is not given.
+        :param model: An already built model (e.g. a quantized or exported variant).
+        :param device: torch device, defaults to cuda when available.
+        :param trace: Freeze the model with TorchScript tracing.
+        :param max_batch: Initial capacity of the input tensor, grown on demand.
+        :param eye_shape: (height, width) of the eye crops.
+        :param decode_in_graph: Decode landmarks inside the model, so forward returns coordinates.
+        :param decode_method: 'argmax' or 'soft', see decode_heatmaps.
+        :param channels: Landmarks output by a model with a reduced score head (see gaze_export),
+                         e.g. (16, 17); infer_landmarks puts them back in their slots of the 18,
+                         the others are left at zero.
+        """
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.eye_shape = eye_shape
+
+        if model is None:
+            model = load_hourglass(checkpoint_path)
+        self.decode_in_graph = decode_in_graph
+        self.decode_method = decode_method
+        self.channels = tuple(channels) if channels is not None else None
+        if decode_in_graph:
+            model = LandmarkDecoder(model, decode_method)
+        model = model.to(self.device).eval()
+        # DataParallel only pays off when there are several GPUs to split the batch over
+        if self.device.type == 'cuda' and torch.cuda.device_count() > 1:
+            model = torch.nn.DataParallel(model)
+        self.model = model
+
+        self._allocate(max_batch)
+        if trace:
+            self.trace()
+
+    def _allocate(self, batch):
+        oh, ow = self.eye_shape
+        self._input = torch.zeros((batch, 1, oh, ow), dtype=torch.float32, device=self.device)
+        self._input_np = self._input.numpy() if self.device.type == 'cpu' else np.zeros((batch, 1, oh, ow), np.float32)
+
+    def trace(self):
+        # Freeze the graph with TorchScript; the batch dimension stays dynamic
+        with torch.inference_mode():
+            traced = torch.jit.trace(self.model, self._input[:2], check_trace=False)
+        self.model = torch.jit.freeze(traced)
+        return self
+
+    def forward(self, batch):
+        """
+        :param batch: float32 tensor [N, 1, H, W] on the engine device.
+        :returns: Heatmap tensor [N, 18, H, W] of the last stack,
+                  or landmarks [N, 18, 2] when decoding in the graph.
+        """
+        with torch.inference_mode():
+            return self.model(batch)[-1]
+
+    def _fill(self, images):
+        # An eye batch from EyeCropper is already laid out as [N, 1, H, W] float32: use it without copying
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            return torch.from_numpy(images).to(self.device)
+
+        n = len(images)
+        if n > self._input.shape[0]:
+            self._allocate(n)
+
+        for i, image in enumerate(images):
+            self._input_np[i, 0] = image
+        batch = self._input[:n]
+        if self.device.type != 'cpu':
+            batch.copy_(torch.from_numpy(self._input_np[:n]))
+        return batch
+
+    def infer(self, images):
+        """
+        :param images: Sequence of float32 eye images [H, W] (as produced by crop_eye),
+                       or a float32 eye batch [N, 1, H, W].
+        :returns: numpy heatmaps [N, 18, H, W] (landmarks [N, 18, 2] when decoding in the graph).
+        """
+        if len(images) == 0:
+            shape = (18, 2) if self.decode_in_graph else (18,) + tuple(self.eye_shape)
+            return np.zeros((0,) + shape, np.float32)
+        return self.forward(self._fill(images)).cpu().numpy()
+
+    def infer_landmarks(self, images):
+        """
+        :returns: numpy landmarks [N, 18, 2]; only coordinates are copied out of torch.
+        """
+        if len(images) == 0:
+            return np.zeros((0, 18, 2), np.float32)
+        output = self.forward(self._fill(images))
+        if not self.decode_in_graph:
+            with torch.inference_mode():
+                output = decode_heatmaps(output, self.decode_method)
+        if self.channels is not None:
+            landmarks = np.zeros((len(images), 18, 2), np.float32)
+            landmarks[:, self.channels] = output.cpu().numpy()
+            return landmarks
+        return output.cpu().numpy()
+
+    @staticmethod
+    def frame_eyes(frame):
+        if 'eye_batch' in frame:
+            return frame['eye_batch']
+        return [eye['image'] for eye in frame['eyes']]
+
+    @metrics.timed('process_eyes_seconds', 'Hourglass inference over the eyes of a frame')
+    def process_eyes(self, frame):
+        # Heatmaps of every eye of every face, as the monitor's gaze stage needs them
+        return self.infer(self.frame_eyes(frame))
+
+    @metrics.timed('find_landmarks_seconds', 'Eye landmarks (inference and decoding) of a frame')
+    def find_landmarks(self, frame):
+        # process_eyes followed by gaze.find_landmarks, decoded in torch
+        return self.infer_landmarks(self.frame_eyes(frame))
+
+    def process_frames(self, frames):
+        """
+        Runs one forward pass over the eyes of several frames.
+        :returns: List with the heatmaps of each frame.
+        """
+        counts = [len(frame['eyes']) for frame in frames]
+        heatmaps = self.infer([eye['image'] for frame in frames for eye in frame['eyes']])
+        return np.split(heatmaps, np.cumsum(counts)[:-1])
+
+
+if __name__ == "__main__":
+    import time
+
+    def process_eyes(frame, model):
+        # Baseline: the float64, two-eye process_eyes the engine replaced
+        np_input = np.zeros([2, 1, 48, 64])
+        np_input[0, 0] = frame['eyes'][0]['image']
+        np_input[1, 0] = frame['eyes'][1]['image']
+        return model(torch.from_numpy(np_input).float())[-1].detach().cpu().numpy()
+
+    def eyes_per_second(fn, frame, iterations=50):
+        fn(frame)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn(frame)
+        return iterations * len(frame['eyes']) / (time.perf_counter() - start)
+
+    # Current path: DataParallel, train mode, float64 input built every call
+    legacy = torch.nn.DataParallel(HourglassNet())
+    legacy.module.load_state_dict(load_state_dict())
+
+    engine = GazeEngine()
+    traced = GazeEngine(trace=True)
+
+    rng = np.random.default_rng(0)
+    for num_eyes in (2, 4, 8):
+        frame = {'eyes': [{'image': rng.random((48, 64), dtype=np.float32)} for _ in range(num_eyes)]}
+        print('eyes/frame: {}'.format(num_eyes))
+        if num_eyes == 2:
+            print('  current   {:8.1f} eyes/s'.format(eyes_per_second(lambda f: process_eyes(f, legacy), frame)))
+        print('  engine    {:8.1f} eyes/s'.format(eyes_per_second(engine.process_eyes, frame)))
+        print('  traced    {:8.1f} eyes/s'.format(eyes_per_second(traced.process_eyes, frame)))
+
+    # Landmark decoding: integer peak (cv2.minMaxLoc) against sub-pixel decoding on
+    # synthetic gaussian heatmaps with known centres
+    h, w = engine.eye_shape
+    centres = rng.uniform([2, 2], [w - 3, h - 3], size=(64, 18, 2)).astype(np.float32)
+    ys, xs = np.mgrid[:h, :w].astype(np.float32)
+    heatmaps = np.exp(-((xs - centres[..., 0, None, None]) ** 2 + (ys - centres[..., 1, None, None]) ** 2) / (2 * 1.5 ** 2))
+    heatmaps = torch.from_numpy(heatmaps.astype(np.float32))
+    integer = heatmaps.reshape(64, 18, -1).argmax(-1)
+    integer = torch.stack([integer % w, integer // w], -1).numpy()
+    print('decoding error (px, mean over {} landmarks):'.format(integer.shape[0] * 18))
+    print('  integer peak  {:.3f}'.format(np.linalg.norm(integer - centres, axis=-1).mean()))
+    for method in ('argmax', 'soft'):
+        decoded = decode_heatmaps(heatmaps, method).numpy()
+        print('  {:12}  {:.3f}'.format(method, np.linalg.norm(decoded - centres, axis=-1).mean()))
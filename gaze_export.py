@@ -0,0 +1,200 @@
+import copy
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from ehg_nfeat24_B2_Hg1_D4_E1 import Bottleneck
+from gaze_engine import CHECKPOINT_PATH, GazeEngine, decode_heatmaps, load_hourglass
+
+LEAN_MODEL_PATH = 'MODELS/hourglass_lean.pt'
+# Landmarks headless gaze needs: iris centre and eyeball centre
+GAZE_CHANNELS = (16, 17)
+
+
+def prune_dead_layers(model):
+    """
+    Drops the Bottleneck layers forward() never calls (bn3, conv3, relu); they only cost memory
+    and checkpoint size.
+    :returns: Number of parameters dropped.
+    """
+    dropped = 0
+    for block in model.modules():
+        if isinstance(block, Bottleneck):
+            for name in ('bn3', 'conv3', 'relu'):
+                layer = getattr(block, name, None)
+                if layer is not None:
+                    dropped += sum(p.numel() for p in layer.parameters())
+                    delattr(block, name)
+    return dropped
+
+
+def _fold(conv, bn):
+    # conv followed by bn (inference statistics) -> one conv: w * s, (b - mean) * s + beta, s = gamma / std
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    with torch.no_grad():
+        conv.weight.mul_(scale.reshape(-1, 1, 1, 1))
+        conv.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    return conv
+
+
+def fold_batchnorm(model):
+    """
+    Folds every BatchNorm that directly follows a convolution into it: the stem (conv1, bn1),
+    bn2 after conv1 in each Bottleneck, and the BatchNorm of the _make_fc heads. The other
+    BatchNorms come first in their pre-activation blocks, behind a residual sum, and stay.
+    :returns: Number of BatchNorm layers folded.
+    """
+    folded = 0
+    if isinstance(model.bn1, nn.BatchNorm2d):
+        _fold(model.conv1, model.bn1)
+        model.bn1 = nn.Identity()
+        folded += 1
+    for block in model.modules():
+        if isinstance(block, Bottleneck) and isinstance(block.bn2, nn.BatchNorm2d):
+            _fold(block.conv1, block.bn2)
+            block.bn2 = nn.Identity()
+            folded += 1
+    for i, fc in enumerate(model.fc):
+        layers = list(fc)
+        if len(layers) == 3 and isinstance(layers[0], nn.Conv2d) and isinstance(layers[1], nn.BatchNorm2d):
+            model.fc[i] = nn.Sequential(_fold(layers[0], layers[1]), layers[2])
+            folded += 1
+    return folded
+
+
+def reduce_score_head(model, channels=GAZE_CHANNELS):
+    """
+    Cuts the last stack's score head down to the heatmaps in `channels`; the model then outputs
+    [N, len(channels), H, W]. Earlier stacks feed all their heatmaps back and are left whole.
+    """
+    score = model.score[-1]
+    reduced = nn.Conv2d(score.in_channels, len(channels), kernel_size=1, bias=True)
+    index = torch.tensor(channels)
+    with torch.no_grad():
+        reduced.weight.copy_(score.weight[index])
+        reduced.bias.copy_(score.bias[index])
+    model.score[-1] = reduced
+    return model
+
+
+def build_lean(model=None, channels=None, checkpoint_path=CHECKPOINT_PATH):
+    """
+    :param model: HourglassNet to convert (copied), loaded from `checkpoint_path` when None.
+    :param channels: Heatmaps to keep, e.g. GAZE_CHANNELS; None keeps all 18.
+    :returns: The inference-only HourglassNet, in eval mode.
+    """
+    model = copy.deepcopy(model) if model is not None else load_hourglass(checkpoint_path)
+    model.eval()
+    prune_dead_layers(model)
+    fold_batchnorm(model)
+    if channels is not None:
+        reduce_score_head(model, channels)
+    return model
+
+
+def save_lean(model, path=LEAN_MODEL_PATH, channels=None, batch_size=2):
+    # TorchScript archive; the kept channels travel with it for GazeEngine
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, torch.zeros(batch_size, 1, 48, 64), check_trace=False)
+    extra = {'channels': ','.join(str(c) for c in channels) if channels is not None else ''}
+    torch.jit.save(traced, path, _extra_files=extra)
+
+
+def load_lean(path=LEAN_MODEL_PATH):
+    """
+    :returns: (frozen TorchScript model, kept channels or None).
+    """
+    extra = {'channels': ''}
+    model = torch.jit.load(path, map_location='cpu', _extra_files=extra)
+    channels = extra['channels']
+    if isinstance(channels, bytes):
+        channels = channels.decode()
+    channels = tuple(int(c) for c in channels.split(',')) if channels else None
+    return torch.jit.freeze(model.eval()), channels
+
+
+def check_parity(reference, lean, crops, channels=None, atol=1e-4):
+    """
+    Runs both models on the same eye crops.
+    :param channels: Heatmaps kept by `lean`, compared with the same channels of `reference`.
+    :returns: Dict with the largest heatmap difference, the largest landmark shift in pixels and
+              whether the heatmaps agree within `atol`.
+    """
+    batch = torch.from_numpy(np.ascontiguousarray(crops[:, None], dtype=np.float32))
+    with torch.inference_mode():
+        expected = reference(batch)[-1]
+        actual = lean(batch)[-1]
+    if channels is not None:
+        expected = expected[:, list(channels)]
+    difference = (expected - actual).abs().max().item()
+    shift = (decode_heatmaps(expected) - decode_heatmaps(actual)).norm(dim=-1).max().item()
+    return {'max_heatmap_diff': difference, 'max_landmark_shift_px': shift, 'ok': difference <= atol}
+
+
+def eyes_per_second(model, batch_size=2, iterations=50, repeats=5, channels=None, trace=False):
+    # Landmarks of a batch of eyes through GazeEngine, as the monitor runs it; best of `repeats`
+    engine = GazeEngine(model=model, device='cpu', channels=channels, trace=trace)
+    eyes = np.random.default_rng(0).random((batch_size, 1, 48, 64), dtype=np.float32)
+    for _ in range(5):
+        engine.infer_landmarks(eyes)
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            engine.infer_landmarks(eyes)
+        best = max(best, iterations * batch_size / (time.perf_counter() - start))
+    return best
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from gaze_quantization import load_eye_crops
+
+    parser = argparse.ArgumentParser(description="Export an inference-only HourglassNet and compare it with the checkpoint")
+    parser.add_argument('--out', default=LEAN_MODEL_PATH, help="TorchScript file to write")
+    parser.add_argument('--gaze-only', action='store_true',
+                        help="keep only the iris and eyeball centre heatmaps (16, 17); for headless monitoring")
+    parser.add_argument('--crops', help="recorded eye crops (.npy/.npz) for the parity check; random crops otherwise")
+    parser.add_argument('--atol', type=float, default=1e-4, help="largest heatmap difference accepted")
+    parser.add_argument('--no-save', action='store_true', help="only check and time, do not write --out")
+    args = parser.parse_args()
+
+    channels = GAZE_CHANNELS if args.gaze_only else None
+    reference = load_hourglass()
+    lean = build_lean(reference, channels)
+
+    count = lambda m: sum(p.numel() for p in m.parameters())
+    batchnorms = lambda m: sum(isinstance(layer, nn.BatchNorm2d) for layer in m.modules())
+    print('parameters  {:8d} -> {:8d}   BatchNorm layers {} -> {}'.format(
+        count(reference), count(lean), batchnorms(reference), batchnorms(lean)))
+
+    if args.crops:
+        crops = load_eye_crops(args.crops)[:256]
+    else:
+        crops = np.random.default_rng(1).random((64, 48, 64), dtype=np.float32)
+    parity = check_parity(reference, lean, crops, channels, args.atol)
+    print('parity      max heatmap diff {max_heatmap_diff:.2e}   max landmark shift {max_landmark_shift_px:.4f} px'
+          .format(**parity))
+
+    if not args.no_save:
+        save_lean(lean, args.out, channels)
+        scripted, _ = load_lean(args.out)
+        print('saved       {} (reloaded parity: max heatmap diff {:.2e})'.format(
+            args.out, check_parity(reference, scripted, crops, channels, args.atol)['max_heatmap_diff']))
+
+    torch.set_num_threads(1)
+    for batch_size in (2, 8):
+        print('eyes/frame {}'.format(batch_size))
+        print('  checkpoint         {:8.1f} eyes/s'.format(eyes_per_second(reference, batch_size)))
+        print('  checkpoint traced  {:8.1f} eyes/s'.format(eyes_per_second(reference, batch_size, trace=True)))
+        print('  lean               {:8.1f} eyes/s'.format(eyes_per_second(lean, batch_size, channels=channels)))
+        if not args.no_save:
+            print('  lean (saved)       {:8.1f} eyes/s'.format(eyes_per_second(scripted, batch_size, channels=channels)))
+
+    if not parity['ok']:
+        sys.exit('Parity check failed: heatmaps differ by {:.2e} (> {:.0e})'.format(parity['max_heatmap_diff'], args.atol))
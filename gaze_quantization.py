@@ -0,0 +1,271 @@
+import copy
+import io
+import time
+
+import numpy as np
+import torch
+
+from ehg_nfeat24_B2_Hg1_D4_E1 import HourglassNet
+from gaze_engine import CHECKPOINT_PATH, GazeEngine, decode_heatmaps, load_hourglass
+
+# Variants that can be built from the fp32 checkpoint
+#   fp32        -> the checkpoint as is
+#   weight_only -> int8 storage, fp32 compute: saved as per-channel int8 weights (no calibration
+#                  needed) and dequantized when loaded, so memory and latency are those of fp32
+#   static      -> int8 weights and activations, calibrated on recorded eye crops
+QUANTIZATION_MODES = ('fp32', 'weight_only', 'static')
+
+# Storage / compute precision of each variant, for the results table
+PRECISION = {'fp32': 'fp32/fp32', 'weight_only': 'int8/fp32', 'static': 'int8/int8'}
+
+EYEBALL_RADIUS = 22.5
+
+
+def select_quantized_engine():
+    # fbgemm/x86 kernels on Intel/AMD, qnnpack on ARM (e.g. Apple silicon)
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized engine available in this torch build")
+
+
+def load_eye_crops(path):
+    """
+    Loads recorded eye crops saved with np.save (or np.savez, key 'eyes').
+    :returns: float32 array [N, 48, 64] in the format produced by EyeCropper.crop_eye.
+    """
+    data = np.load(path)
+    if isinstance(data, np.lib.npyio.NpzFile):
+        data = data['eyes']
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 4:
+        data = data[:, 0]
+    return data
+
+
+def collect_eye_crops(video_path, max_crops=512, every=5, predictor_path='shape_predictor_68_face_landmarks.dat'):
+    """
+    Records eye crops from a video file with the same detection/cropping as EmotionMonitor.
+    :param every: Keep the eyes of one frame out of `every`.
+    :returns: float32 array [N, 48, 64].
+    """
+    import cv2
+    import dlib
+    from eye_cropper import EyeCropper
+    from frame_store import FrameStore
+    from gaze import detect_face
+
+    predictor = dlib.shape_predictor(predictor_path)
+    cropper = EyeCropper()
+    frames = FrameStore(capacity=2)
+    cap = cv2.VideoCapture(video_path)
+    crops = []
+    index = 0
+    while len(crops) < max_crops:
+        ret, img = cap.read()
+        if not ret:
+            break
+        index += 1
+        frame = {'frame_index': index, 'bgr': img, 'gray': cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)}
+        frame = detect_face(frame, frames)
+        frames.add(frame)
+        if frame['faces'] is None or index % every:
+            continue
+
+        landmarks = []
+        for l, t, w, h in frame['faces']:
+            shape = predictor(frame['gray'], dlib.rectangle(int(l), int(t), int(l + w), int(t + h)))
+            landmarks.append(np.array([(p.x, p.y) for p in shape.parts()]))
+        frame['landmarks'] = landmarks
+        # Copied: the cropper reuses its batches for later frames
+        crops.extend(cropper.crop_eye(frame)['eye_batch'][:, 0].copy())
+    cap.release()
+    return np.asarray(crops[:max_crops], dtype=np.float32)
+
+
+def _conv_weights(model):
+    return {name + '.weight': module.weight for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Conv2d)}
+
+
+def weight_only_state_dict(model):
+    """
+    :returns: State dict whose conv weights are per-channel int8 quantized tensors.
+    """
+    state_dict = model.state_dict()
+    for name, weight in _conv_weights(model).items():
+        weight = weight.detach()
+        scale = weight.abs().amax(dim=(1, 2, 3)).clamp(min=1e-8) / 127.0
+        state_dict[name] = torch.quantize_per_channel(weight, scale, torch.zeros_like(scale, dtype=torch.long),
+                                                      axis=0, dtype=torch.qint8)
+    return state_dict
+
+
+def quantize_weight_only(model):
+    """
+    int8 weights, fp32 compute. torch's dynamic quantization only covers Linear/RNN layers, and
+    HourglassNet is all convolutions, so this is the calibration-free variant for this network.
+    """
+    model = copy.deepcopy(model).eval()
+    state_dict = {k: v.dequantize() if v.is_quantized else v for k, v in weight_only_state_dict(model).items()}
+    model.load_state_dict(state_dict)
+    return model
+
+
+def quantize_static(model, calibration, batch_size=16):
+    """
+    Post-training static quantization (FX graph mode) with int8 weights and activations.
+    :param calibration: float32 eye crops [N, 48, 64] used to observe activation ranges.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = select_quantized_engine()
+    model = copy.deepcopy(model).eval()
+    example = torch.from_numpy(calibration[:batch_size, None])
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(example,))
+    with torch.inference_mode():
+        for start in range(0, len(calibration), batch_size):
+            prepared(torch.from_numpy(calibration[start:start + batch_size, None]))
+    return convert_fx(prepared)
+
+
+def build_variant(mode, calibration=None, checkpoint_path=CHECKPOINT_PATH):
+    model = load_hourglass(checkpoint_path)
+    if mode == 'fp32':
+        return model
+    if mode == 'weight_only':
+        return quantize_weight_only(model)
+    if mode == 'static':
+        if calibration is None or len(calibration) == 0:
+            raise ValueError("static quantization needs recorded eye crops for calibration")
+        return quantize_static(model, calibration)
+    raise ValueError("Unknown quantization mode: {}".format(mode))
+
+
+def footprint(model, mode='fp32'):
+    # Size in bytes of the file save_variant writes for this variant
+    buffer = io.BytesIO()
+    save_variant(model, buffer, mode)
+    return buffer.tell()
+
+
+def memory_footprint(model):
+    # Parameters and buffers held in memory once loaded, in bytes
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def gaze_angles(landmarks):
+    """
+    Pitch/yaw (radians) from iris (16) and eyeball centre (17) landmarks [N, 18, 2], as in gaze.process_gaze.
+    """
+    iris, eyeball = landmarks[:, 16], landmarks[:, 17]
+    pitch = -np.arcsin(np.clip((iris[:, 1] - eyeball[:, 1]) / EYEBALL_RADIUS, -1.0, 1.0))
+    yaw = np.arcsin(np.clip((iris[:, 0] - eyeball[:, 0]) / (EYEBALL_RADIUS * -np.cos(pitch)), -1.0, 1.0))
+    return pitch, yaw
+
+
+def evaluate(model, crops, reference, mode='fp32', batch_size=2, iterations=50):
+    """
+    Compares a variant against the fp32 reference landmarks.
+    :param reference: fp32 landmarks [N, 18, 2] for `crops`.
+    :param batch_size: Eyes per forward when timing (2 = one face).
+    :returns: Dict with per-eye latency, file and in-memory size and landmark/angle error.
+    """
+    engine = GazeEngine(model=model, device='cpu')
+    landmarks = np.concatenate([engine.infer_landmarks(crops[i:i + 64]) for i in range(0, len(crops), 64)])
+
+    batch = crops[:batch_size]
+    engine.infer(batch)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        engine.infer(batch)
+    latency = (time.perf_counter() - start) / (iterations * len(batch))
+
+    pitch, yaw = gaze_angles(landmarks)
+    ref_pitch, ref_yaw = gaze_angles(reference)
+    iris = np.linalg.norm(landmarks[:, 16] - reference[:, 16], axis=-1)
+    eyeball = np.linalg.norm(landmarks[:, 17] - reference[:, 17], axis=-1)
+    return {'mode': mode,
+            'precision': PRECISION[mode],
+            'latency_ms_per_eye': 1000.0 * latency,
+            'size_kb': footprint(model, mode) / 1024.0,
+            'memory_kb': memory_footprint(model) / 1024.0,
+            'iris_error_px': float(iris.mean()),
+            'eyeball_error_px': float(eyeball.mean()),
+            'pitch_drift_deg': float(np.degrees(np.abs(pitch - ref_pitch)).mean()),
+            'yaw_drift_deg': float(np.degrees(np.abs(yaw - ref_yaw)).mean())}
+
+
+def save_variant(model, path, mode='fp32', batch_size=2):
+    """
+    Writes a variant for load_variant: the int8 state dict for 'weight_only', a TorchScript
+    archive otherwise.
+    :param path: File name or writable binary file.
+    """
+    if mode == 'weight_only':
+        torch.save(weight_only_state_dict(model), path)
+        return
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, torch.zeros(batch_size, 1, 48, 64), check_trace=False)
+    torch.jit.save(traced, path)
+
+
+def load_variant(path, mode='fp32'):
+    """
+    :returns: The saved variant, ready for GazeEngine(model=...); 'weight_only' weights are
+              dequantized to fp32 here.
+    """
+    if mode == 'weight_only':
+        state_dict = torch.load(path, map_location='cpu')
+        model = HourglassNet()
+        model.load_state_dict({k: v.dequantize() if v.is_quantized else v for k, v in state_dict.items()})
+        return model.eval()
+    return torch.jit.load(path, map_location='cpu').eval()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Build int8 HourglassNet variants and compare them with fp32")
+    parser.add_argument('--crops', help="recorded eye crops (.npy/.npz, [N, 48, 64] float32)")
+    parser.add_argument('--video', help="record eye crops from this video instead")
+    parser.add_argument('--save-crops', help="save the crops recorded from --video here")
+    parser.add_argument('--modes', nargs='+', default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument('--save-dir', help="write each variant as <save-dir>/hourglass_<mode>.pt")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.video:
+        crops = collect_eye_crops(args.video)
+        if args.save_crops:
+            np.save(args.save_crops, crops)
+    elif args.crops:
+        crops = load_eye_crops(args.crops)
+    else:
+        parser.error("either --crops or --video is required")
+
+    # Calibrate on one half, measure on the other
+    calibration, evaluation = crops[::2], crops[1::2]
+    reference = GazeEngine(model=load_hourglass(), device='cpu').infer_landmarks(evaluation)
+
+    results = []
+    for mode in args.modes:
+        model = build_variant(mode, calibration)
+        results.append(evaluate(model, evaluation, reference, mode))
+        if args.save_dir:
+            save_variant(model, '{}/hourglass_{}.pt'.format(args.save_dir, mode), mode)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        # size: the saved file; memory: the loaded model; store/compute: weight and arithmetic precision
+        print('{:12} {:>13} {:>10} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+            'mode', 'store/compute', 'ms/eye', 'size kB', 'memory kB', 'iris px', 'ball px', 'pitch°', 'yaw°'))
+        for r in results:
+            print('{mode:12} {precision:>13} {latency_ms_per_eye:10.2f} {size_kb:9.0f} {memory_kb:10.0f} '
+                  '{iris_error_px:9.3f} {eyeball_error_px:9.3f} {pitch_drift_deg:9.2f} {yaw_drift_deg:9.2f}'.format(**r))
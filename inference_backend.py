@@ -0,0 +1,326 @@
+import numpy as np
+
+import metrics
+
+# Default model files per backend
+GAZE_MODEL_PATHS = {'torch': 'ehg_nfeat24_B2_Hg1_D4_E1.pth.tar',
+                    'lean': 'MODELS/hourglass_lean.pt',
+                    'onnx': 'MODELS/hourglass.onnx'}
+EMOTION_MODEL_PATHS = {'keras': 'MODEL/model.h5',
+                       'onnx': 'MODELS/emotion.onnx',
+                       'tflite': 'MODELS/emotion.tflite'}
+
+
+class InferenceBackend:
+    """
+    Runs a single-input, single-output model on numpy batches.
+    Frameworks are imported by the implementations, so a process only loads the runtime it uses.
+    """
+    name = None
+
+    def run(self, batch):
+        """
+        :param batch: float32 numpy array, batch first.
+        :returns: numpy output of the model.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TorchBackend(InferenceBackend):
+    # PyTorch module in eval/inference mode; for list outputs (HourglassNet stacks) the last one is returned
+    name = 'torch'
+
+    def __init__(self, model, device='cpu'):
+        import torch
+
+        self._torch = torch
+        self.device = torch.device(device)
+        self.model = model.to(self.device).eval()
+
+    def run(self, batch):
+        torch = self._torch
+        with torch.inference_mode():
+            output = self.model(torch.from_numpy(np.ascontiguousarray(batch, dtype=np.float32)).to(self.device))
+        if isinstance(output, (list, tuple)):
+            output = output[-1]
+        return output.cpu().numpy()
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Keras model called through a tf.function with a fixed input signature.
+    model.predict sets up a data adapter and callbacks on every call, which costs far more
+    than the emotion CNN itself; `compiled=False` keeps that path for comparison.
+    """
+    name = 'keras'
+
+    def __init__(self, model_path, compiled=True):
+        import tensorflow as tf
+        from keras.models import load_model
+
+        self.model = load_model(model_path)
+        self.compiled = compiled
+        if compiled:
+            spec = tf.TensorSpec((None,) + tuple(self.model.input_shape[1:]), tf.float32)
+            self._call = tf.function(lambda x: self.model(x, training=False), input_signature=[spec])
+
+    def run(self, batch):
+        if not self.compiled:
+            return self.model.predict(batch, verbose=0)
+        return self._call(np.ascontiguousarray(batch, dtype=np.float32)).numpy()
+
+
+class TfliteBackend(InferenceBackend):
+    # TensorFlow Lite interpreter (fp32 or int8 model), resized to the batch size on demand
+    name = 'tflite'
+
+    def __init__(self, model_path, threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch = self.input['shape'][0]
+
+    def run(self, batch):
+        interpreter = self.interpreter
+        if batch.shape[0] != self._batch:
+            interpreter.resize_tensor_input(self.input['index'], batch.shape)
+            interpreter.allocate_tensors()
+            self.input = interpreter.get_input_details()[0]
+            self.output = interpreter.get_output_details()[0]
+            self._batch = batch.shape[0]
+
+        scale, zero_point = self.input['quantization']
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+        interpreter.set_tensor(self.input['index'], batch.astype(self.input['dtype']))
+        interpreter.invoke()
+
+        output = interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class OnnxBackend(InferenceBackend):
+    # ONNX Runtime on CPU, with a single intra-op thread pool shared by every call
+    name = 'onnx'
+
+    def __init__(self, model_path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[-1].name
+
+    def run(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+
+class BackendGazeEngine:
+    """
+    GazeEngine counterpart for non-torch backends: fills a preallocated float32 numpy batch
+    with every eye of the frame and runs one forward through the backend.
+    """
+
+    def __init__(self, backend, max_batch=4, eye_shape=(48, 64)):
+        self.backend = backend
+        self.eye_shape = eye_shape
+        self._allocate(max_batch)
+
+    def _allocate(self, batch):
+        self._input = np.zeros((batch, 1) + tuple(self.eye_shape), np.float32)
+
+    def infer(self, images):
+        """
+        :returns: Backend output for the eye images: heatmaps [N, 18, H, W], or landmarks [N, 18, 2]
+                  for models exported with the decoder.
+        """
+        n = len(images)
+        if n == 0:
+            return np.zeros((0, 18) + tuple(self.eye_shape), np.float32)
+        # Eye batch from EyeCropper, already [N, 1, H, W] float32
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            return self.backend.run(images)
+        if n > self._input.shape[0]:
+            self._allocate(n)
+        for i, image in enumerate(images):
+            self._input[i, 0] = image
+        return self.backend.run(self._input[:n])
+
+    def infer_landmarks(self, images):
+        if len(images) == 0:
+            return np.zeros((0, 18, 2), np.float32)
+        output = self.infer(images)
+        if output.ndim == 4:
+            from gaze import find_landmarks
+            output = find_landmarks(output)
+        return output
+
+    @staticmethod
+    def frame_eyes(frame):
+        if 'eye_batch' in frame:
+            return frame['eye_batch']
+        return [eye['image'] for eye in frame['eyes']]
+
+    @metrics.timed('process_eyes_seconds', 'Hourglass inference over the eyes of a frame')
+    def process_eyes(self, frame):
+        return self.infer(self.frame_eyes(frame))
+
+    @metrics.timed('find_landmarks_seconds', 'Eye landmarks (inference and decoding) of a frame')
+    def find_landmarks(self, frame):
+        return self.infer_landmarks(self.frame_eyes(frame))
+
+    def process_frames(self, frames):
+        counts = [len(frame['eyes']) for frame in frames]
+        output = self.infer([eye['image'] for frame in frames for eye in frame['eyes']])
+        return np.split(output, np.cumsum(counts)[:-1])
+
+
+def create_backend(name, model_path, **kwargs):
+    """
+    :param name: 'keras', 'tflite' or 'onnx' for model files; torch modules are wrapped with TorchBackend directly.
+    """
+    if name == 'keras':
+        return KerasBackend(model_path, **kwargs)
+    if name == 'tflite':
+        return TfliteBackend(model_path, **kwargs)
+    if name == 'onnx':
+        return OnnxBackend(model_path, **kwargs)
+    raise ValueError("Unknown inference backend: {}".format(name))
+
+
+def create_gaze_engine(backend='torch', model_path=None, **kwargs):
+    """
+    :param backend: 'torch' (GazeEngine), 'lean' (GazeEngine on a model exported by gaze_export.py) or 'onnx'.
+    :param kwargs: Passed to GazeEngine for torch and lean, to the backend otherwise.
+    """
+    model_path = model_path or GAZE_MODEL_PATHS.get(backend)
+    if backend == 'torch':
+        from gaze_engine import GazeEngine
+        return GazeEngine(model_path, **kwargs)
+    if backend == 'lean':
+        from gaze_engine import GazeEngine
+        from gaze_export import load_lean
+        model, channels = load_lean(model_path)
+        return GazeEngine(model=model, channels=channels, **kwargs)
+    return BackendGazeEngine(create_backend(backend, model_path, **kwargs))
+
+
+def create_emotion_backend(backend='keras', model_path=None, **kwargs):
+    return create_backend(backend, model_path or EMOTION_MODEL_PATHS.get(backend), **kwargs)
+
+
+def export_gaze_onnx(path=GAZE_MODEL_PATHS['onnx'], checkpoint_path=GAZE_MODEL_PATHS['torch'],
+                     decode=False, opset=17):
+    """
+    Exports HourglassNet to ONNX with a dynamic batch dimension.
+    :param decode: Include the landmark decoder, so the model outputs [N, 18, 2] coordinates.
+    """
+    import inspect
+    import torch
+    from gaze_engine import LandmarkDecoder, load_hourglass
+
+    model = load_hourglass(checkpoint_path)
+    if decode:
+        model = LandmarkDecoder(model)
+    output_name = 'landmarks' if decode else 'heatmaps'
+    torch.onnx.export(model, torch.zeros(2, 1, 48, 64), path, opset_version=opset,
+                      input_names=['eyes'], output_names=[output_name],
+                      dynamic_axes={'eyes': {0: 'batch'}, output_name: {0: 'batch'}},
+                      # newer torch defaults to the dynamo exporter; keep the TorchScript one
+                      **({'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}))
+    return path
+
+
+def export_emotion_onnx(path=EMOTION_MODEL_PATHS['onnx'], model_path=EMOTION_MODEL_PATHS['keras'], opset=13):
+    # Converts the Keras emotion CNN with tf2onnx
+    import tensorflow as tf
+    import tf2onnx
+    from keras.models import load_model
+
+    model = load_model(model_path)
+    spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='face'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=path)
+    return path
+
+
+def export_emotion_tflite(path=EMOTION_MODEL_PATHS['tflite'], model_path=EMOTION_MODEL_PATHS['keras'],
+                          int8=False, calibration=None):
+    """
+    Converts the Keras emotion CNN to TensorFlow Lite.
+    :param int8: Quantize. With `calibration` faces ([N, 48, 48, 1] float32 in [0, 1]) weights and
+                 activations are int8; without, only the weights are (dynamic range quantization).
+    """
+    import tensorflow as tf
+    from keras.models import load_model
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(load_model(model_path))
+    if int8:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if calibration is not None:
+            def representative_dataset():
+                for face in calibration:
+                    yield [face[None].astype(np.float32)]
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+    with open(path, 'wb') as file:
+        file.write(converter.convert())
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the gaze and emotion models to ONNX (and TFLite)")
+    parser.add_argument('models', nargs='*', default=['gaze', 'emotion'], choices=['gaze', 'emotion'])
+    parser.add_argument('--tflite', action='store_true', help="also export the emotion model to TFLite")
+    parser.add_argument('--int8', action='store_true', help="quantize the TFLite emotion model")
+    parser.add_argument('--faces', help="face crops (.npy, [N, 48, 48, 1]) to calibrate the int8 TFLite model")
+    parser.add_argument('--decode', action='store_true', help="export the gaze model with the landmark decoder")
+    parser.add_argument('--check', action='store_true', help="compare ONNX Runtime outputs with the source model")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if 'gaze' in args.models:
+        path = export_gaze_onnx(decode=args.decode)
+        print('==> Exported gaze model to {}'.format(path))
+        if args.check:
+            from gaze_engine import GazeEngine
+            eyes = rng.random((4, 48, 64), dtype=np.float32)
+            reference = GazeEngine(device='cpu').infer_landmarks(eyes)
+            landmarks = BackendGazeEngine(OnnxBackend(path)).infer_landmarks(eyes)
+            print('    max landmark difference: {:.4f} px'.format(np.abs(landmarks - reference).max()))
+
+    if 'emotion' in args.models:
+        path = export_emotion_onnx()
+        print('==> Exported emotion model to {}'.format(path))
+        if args.check:
+            faces = rng.random((4, 48, 48, 1), dtype=np.float32)
+            reference = KerasBackend(EMOTION_MODEL_PATHS['keras']).run(faces)
+            output = OnnxBackend(path).run(faces)
+            print('    max probability difference: {:.6f}'.format(np.abs(output - reference).max()))
+
+        if args.tflite:
+            calibration = np.load(args.faces).astype(np.float32) if args.faces else None
+            path = export_emotion_tflite(int8=args.int8, calibration=calibration)
+            print('==> Exported emotion model to {}'.format(path))
@@ -0,0 +1,150 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+
+class OneEuroFilter:
+    """
+    One Euro filter (Casiez et al.) applied element-wise to an array, e.g. 68x2 landmarks.
+    Smooths strongly when the signal is slow and follows it closely when it moves fast.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = None
+        self.timestamp = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, value, timestamp):
+        value = np.asarray(value, dtype=np.float32)
+        if self.value is None or self.value.shape != value.shape:
+            self.value = value.copy()
+            self.velocity = np.zeros_like(value)
+            self.timestamp = timestamp
+            return self.value
+
+        dt = max(timestamp - self.timestamp, 1e-3)
+        a_d = self._alpha(self.d_cutoff, dt)
+        self.velocity += a_d * ((value - self.value) / dt - self.velocity)
+
+        cutoff = self.min_cutoff + self.beta * np.abs(self.velocity)
+        tau = 1.0 / (2 * math.pi * cutoff)
+        a = 1.0 / (1.0 + tau / dt)
+        self.value += a * (value - self.value)
+        self.timestamp = timestamp
+        return self.value
+
+
+class LandmarkSmoother:
+    """
+    Per-face temporal filtering of the 68 facial landmarks, and the decision of when the dlib
+    shape predictor can be skipped.
+
+    The predictor is skipped for a face (its last landmarks are shifted with the face box instead) when
+      - the face box moved less than `max_shift` px since the predictor last ran,
+      - the face and eye patches changed by less than `max_face_change` / `max_eye_change` grey levels
+        (so blinks still trigger the predictor), and
+      - fewer than `max_skip` frames in a row were skipped.
+    """
+
+    EYES = slice(36, 48)
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, max_shift=1.5, max_face_change=3.0,
+                 max_eye_change=4.0, max_skip=4):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.max_shift = max_shift
+        self.max_face_change = max_face_change
+        self.max_eye_change = max_eye_change
+        self.max_skip = max_skip
+
+        self._faces = []
+        self.predictor_calls = 0
+        self.predictor_skipped = 0
+        self._started = time.time()
+
+    def _reset(self, num_faces):
+        self._faces = [{'filter': OneEuroFilter(self.min_cutoff, self.beta)} for _ in range(num_faces)]
+
+    @staticmethod
+    def _patch(gray, box, size):
+        l, t, w, h = [int(round(v)) for v in box]
+        patch = gray[max(t, 0):t + h, max(l, 0):l + w]
+        if patch.size == 0:
+            return None
+        return cv2.resize(patch, size, interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _eye_box(landmarks):
+        eyes = landmarks[LandmarkSmoother.EYES]
+        (x0, y0), (x1, y1) = eyes.min(axis=0), eyes.max(axis=0)
+        pad = 0.25 * (x1 - x0)
+        return (x0 - pad, y0 - pad, x1 - x0 + 2 * pad, y1 - y0 + 2 * pad)
+
+    @staticmethod
+    def _change(a, b):
+        if a is None or b is None:
+            return float('inf')
+        return float(cv2.absdiff(a, b).mean())
+
+    def reuse(self, i, box, gray, num_faces):
+        """
+        :returns: Extrapolated landmarks for face `i` if the predictor can be skipped, otherwise None.
+        """
+        if len(self._faces) != num_faces:
+            self._reset(num_faces)
+        state = self._faces[i]
+        if 'landmarks' not in state or state['skipped'] >= self.max_skip:
+            return None
+
+        l, t, w, h = box
+        pl, pt, pw, ph = state['box']
+        shift = np.array([l + w / 2.0 - (pl + pw / 2.0), t + h / 2.0 - (pt + ph / 2.0)])
+        if np.abs(shift).max() > self.max_shift or abs(w - pw) > self.max_shift:
+            return None
+        if self._change(self._patch(gray, box, (32, 32)), state['face_patch']) > self.max_face_change:
+            return None
+        eye_box = self._eye_box(state['landmarks'] + shift)
+        if self._change(self._patch(gray, eye_box, (32, 16)), state['eye_patch']) > self.max_eye_change:
+            return None
+
+        state['skipped'] += 1
+        self.predictor_skipped += 1
+        return state['landmarks'] + shift
+
+    def observe(self, i, box, gray, landmarks):
+        # Records a fresh predictor result for face `i`
+        state = self._faces[i]
+        state['landmarks'] = np.array(landmarks, dtype=np.float32)
+        state['box'] = box
+        state['face_patch'] = self._patch(gray, box, (32, 32))
+        state['eye_patch'] = self._patch(gray, self._eye_box(state['landmarks']), (32, 16))
+        state['skipped'] = 0
+        self.predictor_calls += 1
+
+    def smooth(self, landmarks, timestamp):
+        """
+        :param landmarks: List of [68, 2] landmark arrays, one per face.
+        :returns: List of filtered landmark arrays (for frame['smoothed_landmarks']).
+        """
+        if len(self._faces) != len(landmarks):
+            self._reset(len(landmarks))
+        return [state['filter'](l, timestamp).copy() for state, l in zip(self._faces, landmarks)]
+
+    def stats(self):
+        minutes = max(time.time() - self._started, 1e-6) / 60.0
+        return {'predictor_calls': self.predictor_calls,
+                'predictor_skipped': self.predictor_skipped,
+                'saved_per_minute': self.predictor_skipped / minutes}
@@ -2,8 +2,6 @@ from os import system, name
 from threading import Lock
 from termcolor import colored
 import time
-import beepy
-from notification import Notification
 
 
 def clear_console():
@@ -19,9 +17,14 @@ class Logger:
     A simpler logger class.
     """
 
-    def __init__(self, logger_name: str):
+    def __init__(self, logger_name: str, alerts=None):
+        """
+        :param alerts: AlertDispatcher delivering the posture alerts of notify(with_sound=True);
+                       without one they are delivered directly, on the caller's thread.
+        """
         self.name = logger_name
         self.lock = Lock()
+        self.alerts = alerts
 
     # def send_notification(self, title, subtitle, message):
     #     rumps.notification(title = title, subtitle = subtitle, message = message, sound=True)    
@@ -32,10 +35,18 @@ class Logger:
         print(colored(f'[{time.strftime("%H:%M:%S", time.localtime())}] {message}', color))
         self.lock.release()
 
-        if with_sound:
-            if type: 
-                beepy.beep(sound='error')
-            else:
-                Notification.send_notification("Posture Alert!","FIX your posture","Remember to sit up straight to maintain a healthy posture")
+        if not with_sound:
+            return
+        title, subtitle, text = ("Posture Alert!", "FIX your posture",
+                                 "Remember to sit up straight to maintain a healthy posture")
+        if self.alerts is not None:
+            # A sound when `type` is set, a notification otherwise; queued, played off this thread
+            self.alerts.alert('posture', title, subtitle, text, text=not type)
+        elif type:
+            from alerts import play_sound
+            play_sound('error')
+        else:
+            from notification import Notification
+            Notification().send_notification(title, subtitle, text)
 
                 
\ No newline at end of file
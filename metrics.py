@@ -0,0 +1,295 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+# Latency bucket upper bounds in seconds: 0.1 ms .. 10 s, roughly 2.5x apart
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram (Prometheus style). observe() is a bisect and three additions under a
+    lock, cheap enough to leave on around every stage.
+    """
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q, counts=None, count=None):
+        # Linear interpolation inside the bucket holding the q-th observation
+        counts = self._counts if counts is None else counts
+        count = self._count if count is None else count
+        if count == 0:
+            return None
+        rank, seen = q * count, 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        return {'type': 'histogram',
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else None,
+                'p50': self.quantile(0.5, counts, count),
+                'p95': self.quantile(0.95, counts, count),
+                'p99': self.quantile(0.99, counts, count),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts))}
+
+
+class Counter:
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return {'type': 'counter', 'value': self._value}
+
+
+class Meter:
+    """
+    Event rate (per second) over the last `window` events, e.g. the processed frame rate.
+    """
+
+    def __init__(self, name, help='', window=30):
+        self.name = name
+        self.help = help
+        self._times = deque(maxlen=window)
+
+    def mark(self):
+        self._times.append(time.perf_counter())
+
+    def rate(self):
+        times = list(self._times)
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        # A stalled source shows as a falling rate rather than the last good value
+        span = max(times[-1], time.perf_counter() - 1.0) - times[0]
+        return (len(times) - 1) / span
+
+    def snapshot(self):
+        return {'type': 'gauge', 'value': self.rate()}
+
+
+class _Timer:
+    # Context manager recording the duration of its block into a histogram
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Process-wide set of named metrics with JSON and Prometheus text export.
+    Metrics are created on first use; with enabled=False timers and decorators record nothing.
+    """
+
+    def __init__(self, prefix='ergosight', enabled=True):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls(name, **kwargs))
+        if not isinstance(metric, cls):
+            raise TypeError("Metric {} is a {}, not a {}".format(name, type(metric).__name__, cls.__name__))
+        return metric
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help=help, buckets=buckets)
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help=help)
+
+    def meter(self, name, help='', window=30):
+        return self._get(Meter, name, help=help, window=window)
+
+    def timer(self, name, help=''):
+        """
+        with REGISTRY.timer('stage_seconds'): ...
+        """
+        return _Timer(self.histogram(name, help)) if self.enabled else _NULL_TIMER
+
+    def timed(self, name, help=''):
+        """
+        Decorator recording the latency of every call into histogram `name`.
+        """
+        def decorator(fn):
+            histogram = self.histogram(name, help)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+    def to_json(self, indent=None):
+        return json.dumps({'timestamp': time.time(), 'metrics': self.snapshot()}, indent=indent)
+
+    def to_prometheus(self):
+        """
+        :returns: The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        for name, metric in metrics:
+            full = '{}_{}'.format(self.prefix, name)
+            snapshot = metric.snapshot()
+            if snapshot['type'] == 'counter':
+                full += '_total'
+            if metric.help:
+                lines.append('# HELP {} {}'.format(full, metric.help))
+            if snapshot['type'] == 'histogram':
+                lines.append('# TYPE {} histogram'.format(full))
+                cumulative = 0
+                for bound, count in snapshot['buckets'].items():
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(full, bound, cumulative))
+                lines.append('{}_sum {}'.format(full, snapshot['sum']))
+                lines.append('{}_count {}'.format(full, snapshot['count']))
+            elif snapshot['type'] == 'counter':
+                lines.append('# TYPE {} counter'.format(full))
+                lines.append('{} {}'.format(full, snapshot['value']))
+            else:
+                lines.append('# TYPE {} gauge'.format(full))
+                lines.append('{} {}'.format(full, snapshot['value']))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """
+        Serves /metrics (Prometheus text) and /metrics.json on a daemon thread.
+        :returns: The HTTP server; call shutdown() to stop it.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = registry.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# The registry the monitors report into
+REGISTRY = MetricsRegistry()
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+
+
+if __name__ == "__main__":
+    # Overhead per instrumented call, to check the metrics can stay on
+    registry = MetricsRegistry()
+    n = 200000
+
+    def plain(x):
+        return x
+
+    decorated = registry.timed('decorated_seconds')(plain)
+
+    start = time.perf_counter()
+    for i in range(n):
+        plain(i)
+    base = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n):
+        decorated(i)
+    print('decorator      {:6.2f} us/call'.format(1e6 * (time.perf_counter() - start - base) / n))
+
+    start = time.perf_counter()
+    for i in range(n):
+        with registry.timer('block_seconds'):
+            plain(i)
+    print('timer block    {:6.2f} us/call'.format(1e6 * (time.perf_counter() - start - base) / n))
+
+    counter = registry.counter('events')
+    start = time.perf_counter()
+    for i in range(n):
+        counter.inc()
+    print('counter        {:6.2f} us/call'.format(1e6 * (time.perf_counter() - start) / n))
+    print(registry.to_prometheus().splitlines()[0:4])
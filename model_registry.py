@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+PREDICTOR_PATH = 'shape_predictor_68_face_landmarks.dat'
+
+
+class _Entry:
+    __slots__ = ('model', 'size', 'owners', 'last_used', 'load_seconds', 'warmup_seconds')
+
+    def __init__(self, model, size, load_seconds, warmup_seconds):
+        self.model = model
+        self.size = size
+        self.owners = set()
+        self.last_used = time.monotonic()
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+
+
+def model_size(model, path=None):
+    """
+    :returns: Approximate memory held by a model in bytes: the size of its file, or of the
+              parameters and buffers of a torch module; 0 when unknown.
+    """
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    module = getattr(model, 'model', model)
+    if hasattr(module, 'parameters') and hasattr(module, 'buffers'):
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    return 0
+
+
+def free_memory():
+    """
+    :returns: Free physical memory in bytes, or None where the platform does not report it.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models (dlib detector and predictor, gaze engine, emotion model).
+
+    get() loads a model once, runs its warm-up on a dummy input so the first real frame does not
+    pay for lazy allocations and kernel selection, and hands the same instance to every caller.
+    A caller passing `owner` holds the model until release(owner); models nobody holds stay
+    loaded for the next monitor, and are evicted least recently used first when the registry
+    grows past `max_bytes`, when free memory drops under `min_free_bytes`, or after `max_idle`
+    seconds unused (see evict_idle).
+    """
+
+    def __init__(self, max_bytes=None, min_free_bytes=None, max_idle=None):
+        """
+        :param max_bytes: Size (as estimated by model_size) above which idle models are evicted.
+        :param min_free_bytes: Free memory under which idle models are evicted.
+        :param max_idle: Seconds after which evict_idle() drops a model nobody holds.
+        """
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_idle = max_idle
+        self._entries = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._hits = metrics.REGISTRY.counter('model_cache_hits', 'Models served already loaded')
+        self._misses = metrics.REGISTRY.counter('model_cache_misses', 'Models loaded on demand')
+
+    def get(self, key, loader, warmup=None, path=None, owner=None):
+        """
+        :param key: Hashable model identity, e.g. ('gaze', 'torch', checkpoint path).
+        :param loader: Callable returning the model.
+        :param warmup: Callable run once on the new model, e.g. a forward pass on zeros.
+        :param path: Model file, used to estimate its size.
+        :param owner: Holder of the model (e.g. a monitor) until release(owner).
+        :returns: The shared model.
+        """
+        entry, loaded = self._entries.get(key), False
+        if entry is None:
+            # One loader per key; other threads asking for the same model wait for it
+            with self._lock:
+                loading = self._loading.setdefault(key, threading.Lock())
+            with loading:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry, loaded = self._load(key, loader, warmup, path), True
+        if not loaded:
+            self._hits.inc()
+        with self._lock:
+            entry.last_used = time.monotonic()
+            if owner is not None:
+                entry.owners.add(id(owner))
+        if loaded:
+            self.trim()
+        return entry.model
+
+    def _load(self, key, loader, warmup, path):
+        self._misses.inc()
+        start = time.perf_counter()
+        with metrics.timer('model_load_seconds', 'Model loads, warm-up excluded'):
+            model = loader()
+        loaded = time.perf_counter()
+        if warmup is not None:
+            with metrics.timer('model_warmup_seconds', 'Model warm-ups'):
+                warmup(model)
+        entry = _Entry(model, model_size(model, path), loaded - start, time.perf_counter() - loaded)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def release(self, owner):
+        """
+        Drops `owner`'s hold on every model; the models stay loaded until evicted.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.owners.discard(id(owner))
+        self.trim()
+
+    def evict(self, key, force=False):
+        """
+        Unloads a model, unless it is held (or `force`).
+        :returns: True if it was evicted.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry.owners and not force):
+                return False
+            del self._entries[key]
+        return True
+
+    def _idle(self):
+        # Keys of the models nobody holds, least recently used first
+        with self._lock:
+            idle = [(entry.last_used, key) for key, entry in self._entries.items() if not entry.owners]
+        return [key for _, key in sorted(idle, key=lambda item: item[0])]
+
+    def _under_pressure(self):
+        if self.max_bytes is not None and self.total_bytes() > self.max_bytes:
+            return True
+        if self.min_free_bytes is not None:
+            free = free_memory()
+            return free is not None and free < self.min_free_bytes
+        return False
+
+    def trim(self):
+        """
+        Evicts idle models, least recently used first, while over `max_bytes` or under `min_free_bytes`.
+        :returns: The evicted keys.
+        """
+        evicted = []
+        for key in self._idle():
+            if not self._under_pressure():
+                break
+            if self.evict(key):
+                evicted.append(key)
+        return evicted
+
+    def evict_idle(self, max_idle=None):
+        """
+        Evicts the models nobody has held for `max_idle` seconds (default: the registry's),
+        then trims. Meant to be called periodically, e.g. from the app's timer.
+        :returns: The evicted keys.
+        """
+        max_idle = self.max_idle if max_idle is None else max_idle
+        evicted = []
+        if max_idle is not None:
+            now = time.monotonic()
+            with self._lock:
+                stale = [key for key, entry in self._entries.items()
+                         if not entry.owners and now - entry.last_used > max_idle]
+            evicted = [key for key in stale if self.evict(key)]
+        return evicted + self.trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {repr(key): {'bytes': entry.size,
+                                'holders': len(entry.owners),
+                                'load_seconds': entry.load_seconds,
+                                'warmup_seconds': entry.warmup_seconds,
+                                'idle_seconds': time.monotonic() - entry.last_used}
+                    for key, entry in self._entries.items()}
+
+
+# The registry the monitors load their models through; idle models are dropped after 15 minutes
+REGISTRY = ModelRegistry(max_idle=15 * 60)
+
+
+# Loaders of the eye-strain monitor's models. Frameworks are imported inside them, so importing
+# this module stays cheap.
+
+def face_detector(owner=None):
+    def load():
+        import dlib
+        return dlib.get_frontal_face_detector()
+
+    def warmup(detector):
+        # Half of a 720x480 frame, the size detect_face runs the detector on
+        detector(np.zeros((240, 360), np.uint8), 0)
+
+    return REGISTRY.get(('face_detector',), load, warmup, owner=owner)
+
+
+def landmark_predictor(path=PREDICTOR_PATH, owner=None):
+    def load():
+        import dlib
+        return dlib.shape_predictor(path)
+
+    def warmup(predictor):
+        import dlib
+        predictor(np.zeros((120, 120), np.uint8), dlib.rectangle(10, 10, 110, 110))
+
+    return REGISTRY.get(('landmark_predictor', path), load, warmup, path=path, owner=owner)
+
+
+def gaze_engine(backend='torch', model_path=None, trace=False, eye_shape=(48, 64), owner=None):
+    from inference_backend import GAZE_MODEL_PATHS, create_gaze_engine
+
+    model_path = model_path or GAZE_MODEL_PATHS.get(backend)
+
+    def load():
+        if backend == 'torch':
+            return create_gaze_engine('torch', model_path, trace=trace, eye_shape=eye_shape)
+        return create_gaze_engine(backend, model_path)
+
+    def warmup(engine):
+        # Both eyes of one face, the usual batch
+        engine.infer(np.zeros((2, 1) + tuple(eye_shape), np.float32))
+
+    return REGISTRY.get(('gaze', backend, model_path, trace), load, warmup, path=model_path, owner=owner)
+
+
+def emotion_backend(backend='keras', model_path=None, owner=None):
+    from inference_backend import EMOTION_MODEL_PATHS, create_emotion_backend
+
+    model_path = model_path or EMOTION_MODEL_PATHS.get(backend)
+
+    def load():
+        return create_emotion_backend(backend, model_path)
+
+    def warmup(model):
+        model.run(np.zeros((1, 48, 48, 1), np.float32))
+
+    return REGISTRY.get(('emotion', backend, model_path), load, warmup, path=model_path, owner=owner)
@@ -0,0 +1,207 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from notification import Notification
+
+# Worker processes are spawned, not forked: a fork of the UI process would inherit the
+# Cocoa/rumps state and the torch/TensorFlow thread pools.
+_context = multiprocessing.get_context('spawn')
+
+
+class ChannelNotification(Notification):
+    """
+    Notifier used inside a worker process: notifications are sent to the app over the results
+    channel and delivered there, the notification settings are pushed from the app.
+    """
+
+    def __init__(self, results, posture_notification=True, eye_notification=True):
+        super().__init__()
+        self.results = results
+        self.posture_notification = posture_notification
+        self.eye_notification = eye_notification
+
+    def send_notification(self, title, subtitle, message):
+        self.results.put(('notification', (title, subtitle, message)))
+
+
+def _apply_settings(notify, settings):
+    notify.posture_notification, notify.eye_notification = settings
+
+
+def _posture_worker(ring_spec, results, control, settings, options):
+    from shared_frames import RingCamera
+    from posture import PostureWatcher
+
+    notify = ChannelNotification(results, *settings)
+    camera = RingCamera(ring_spec)
+    watcher = PostureWatcher(notify=notify, camera=camera, **options)
+    try:
+        while True:
+            try:
+                command, args = control.get(timeout=1.0)
+            except queue.Empty:
+                command = None
+            if command == 'set_base_posture':
+                watcher.set_base_posture()
+            elif command == 'start':
+                watcher.start()
+            elif command == 'settings':
+                _apply_settings(notify, args)
+            elif command == 'stop':
+                break
+            results.put(('state', {'deviation': watcher.latest_deviation,
+                                   'has_base_posture': watcher.base_posture is not None,
+                                   'time': time.time()}))
+    finally:
+        watcher.stop()
+        camera.close()
+
+
+def _emotion_worker(ring_spec, results, control, settings, options):
+    from shared_frames import RingCamera
+    from EmotionMonitor import EmotionMonitor
+
+    notify = ChannelNotification(results, *settings)
+    camera = RingCamera(ring_spec)
+    monitor = EmotionMonitor(notify=notify, camera=camera, **options)
+    stopped = threading.Event()
+
+    def listen():
+        while not stopped.is_set():
+            try:
+                command, args = control.get(timeout=1.0)
+            except queue.Empty:
+                command = None
+            if command == 'settings':
+                _apply_settings(notify, args)
+            elif command == 'stop':
+                stopped.set()
+                monitor.stop_monitoring()
+            results.put(('state', {'emotion': monitor.dominant_emotion,
+                                   'blinks': monitor.total_blinks,
+                                   'time': time.time()}))
+
+    threading.Thread(target=listen, name='control', daemon=True).start()
+    try:
+        # Returns when stopped or when the app closes the frame ring
+        monitor.start_monitoring()
+    finally:
+        stopped.set()
+        camera.close()
+
+
+class MonitorProcess:
+    """
+    Runs a monitor in its own worker process, so it has its own GIL and a crash or stall in it
+    cannot freeze the menu bar app.
+
+    Frames come from the app's SharedFrameRing. Commands go to the worker over a control queue;
+    the worker reports small state dicts and notifications over a results queue, which a thread
+    of the app drains into `latest` and delivers with the app's notifier.
+    """
+
+    def __init__(self, target, ring_spec, notify, options=None, name='monitor'):
+        self.notify = notify
+        self.name = name
+        self.latest = {}
+        self._results = _context.Queue()
+        self._control = _context.Queue()
+        self._settings = self._current_settings()
+        self._stop = threading.Event()
+        self.process = _context.Process(target=target, name=name, daemon=True,
+                                        args=(ring_spec, self._results, self._control,
+                                              self._settings, options or {}))
+        self.process.start()
+        self._drain_thread = threading.Thread(target=self._drain, name=name + '-results', daemon=True)
+        self._drain_thread.start()
+
+    def _current_settings(self):
+        return (self.notify.posture_notification, self.notify.eye_notification)
+
+    def send(self, command, args=None):
+        self._control.put((command, args))
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def _drain(self):
+        while not self._stop.is_set():
+            # Push notification settings changed from the menu
+            settings = self._current_settings()
+            if settings != self._settings:
+                self._settings = settings
+                self.send('settings', settings)
+
+            try:
+                kind, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if not self.alive():
+                    break
+                continue
+            except (EOFError, OSError):
+                break
+            if kind == 'notification':
+                self.notify.send_notification(*payload)
+            elif kind == 'state':
+                self.latest = payload
+
+    def stop(self, timeout=5.0):
+        if self.alive():
+            self.send('stop')
+            self.process.join(timeout)
+            if self.alive():
+                # Stalled worker: it cannot take the app down with it
+                self.process.terminate()
+                self.process.join(1.0)
+        self._stop.set()
+
+
+class PostureProcess(MonitorProcess):
+    """
+    PostureWatcher in a worker process, with the part of its interface the app uses.
+    """
+
+    def __init__(self, ring_spec, notify, options=None):
+        super().__init__(_posture_worker, ring_spec, notify, options, name='posture')
+
+    @property
+    def base_posture(self):
+        return True if self.latest.get('has_base_posture') else None
+
+    @base_posture.setter
+    def base_posture(self, value):
+        # Clearing happens by stopping the worker
+        pass
+
+    @property
+    def latest_deviation(self):
+        return self.latest.get('deviation')
+
+    def set_base_posture(self):
+        self.send('set_base_posture')
+
+    def start(self):
+        self.send('start')
+
+
+class EmotionProcess(MonitorProcess):
+    """
+    EmotionMonitor in a worker process; monitoring starts with the process.
+    """
+
+    def __init__(self, ring_spec, notify, options=None):
+        # No OpenCV windows in the worker by default
+        options = dict({'headless': True}, **(options or {}))
+        super().__init__(_emotion_worker, ring_spec, notify, options, name='eye-strain')
+
+    @property
+    def dominant_emotion(self):
+        return self.latest.get('emotion')
+
+    def start_monitoring(self):
+        pass
+
+    def stop_monitoring(self):
+        self.stop()
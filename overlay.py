@@ -0,0 +1,141 @@
+import threading
+import time
+
+import cv2
+
+from gaze import draw_gaze_overlay
+
+
+class OverlayRenderer:
+    """
+    Draws the monitoring overlay off the analysis path, on its own thread and at a capped rate.
+
+    The analysis loop only hands over its latest frame (submit never blocks, older frames are
+    replaced). The worker draws the gaze overlay and status text and downsizes the result.
+    Showing the image stays on the caller's thread (show), because OpenCV windows must be
+    driven from the main thread on macOS.
+    """
+
+    # Frames the renderer can hold at once, with their eye crops: one waiting and one being drawn
+    FRAMES_HELD = 2
+
+    def __init__(self, window_name='Ergo-Sight', size=(300, 200), max_fps=10, fps=None):
+        """
+        :param fps: Callable returning the measured analysis frame rate to show, or None for no fps text.
+        """
+        self.window_name = window_name
+        self.fps = fps
+        self.size = size
+        self.max_fps = max_fps
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self._image = None
+        self._new_frame = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._window_shown = False
+        self.rendered = 0
+        self.shown = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='overlay', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._new_frame.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        # OpenCV raises on a window that was never created
+        if self._window_shown:
+            self._window_shown = False
+            try:
+                cv2.destroyWindow(self.window_name)
+            except cv2.error as e:
+                print(f"Error closing the overlay window: {e}")
+
+    def submit(self, frame, status=None, color=(0, 255, 0)):
+        """
+        :param frame: Analysed frame (its 'bgr' image is drawn on by the renderer).
+        :param status: Text shown on the frame, e.g. the emotion state or 'No Face Detected'.
+        """
+        with self._lock:
+            self._pending = (frame, status, color)
+        self._new_frame.set()
+
+    def _run(self):
+        interval = 1.0 / self.max_fps if self.max_fps else 0.0
+        while not self._stop.is_set():
+            self._new_frame.wait()
+            self._new_frame.clear()
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is None:
+                continue
+
+            start = time.perf_counter()
+            image = self.render(*pending)
+            with self._lock:
+                self._image = image
+            self.rendered += 1
+
+            # Cap the render rate; frames submitted meanwhile are coalesced into the newest one
+            remaining = interval - (time.perf_counter() - start)
+            if remaining > 0:
+                self._stop.wait(remaining)
+
+    def render(self, frame, status, color):
+        bgr = frame['bgr']
+        if not bgr.flags.writeable:
+            # Camera frames shared through a CameraHub are read-only; draw on a copy
+            bgr = frame['bgr'] = bgr.copy()
+        if frame.get('gaze'):
+            draw_gaze_overlay(frame, frame['gaze'], fps=self.fps() if self.fps else None)
+        if status:
+            cv2.putText(bgr, status, (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+        return cv2.resize(bgr, self.size)
+
+    def show(self):
+        """
+        Shows the newest rendered image, if any. Call from the main thread.
+        :returns: False when the user pressed 'q'.
+        """
+        with self._lock:
+            image, self._image = self._image, None
+        if image is not None:
+            cv2.imshow(self.window_name, image)
+            self._window_shown = True
+            self.shown += 1
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+
+if __name__ == "__main__":
+    import numpy as np
+    from eye_cropper import EyeCropper
+    from gaze import analyze_gaze, process_gaze
+
+    # Gaze stage cost with and without the overlay drawing, on a synthetic two-face frame
+    rng = np.random.default_rng(0)
+    bgr = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    landmarks = []
+    for f in range(2):
+        points = rng.uniform(100, 300, (68, 2)) + [250 * f, 0]
+        points[[36, 39, 42, 45]] = [[150 + 250 * f, 200], [180 + 250 * f, 203], [210 + 250 * f, 202], [240 + 250 * f, 199]]
+        landmarks.append(points)
+    frame = EyeCropper().crop_eye({'bgr': bgr, 'gray': gray, 'landmarks': landmarks})
+    eye_landmarks = rng.uniform(0, 48, (len(frame['eyes']), 18, 2))
+
+    def per_second(fn, iterations=500):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            frame['bgr'] = bgr.copy()
+            fn()
+        return iterations / (time.perf_counter() - start)
+
+    drawn = per_second(lambda: process_gaze(frame, eye_landmarks, fps=30.0))
+    headless = per_second(lambda: analyze_gaze(frame, eye_landmarks))
+    print('gaze stage with overlay   {:8.1f} frames/s'.format(drawn))
+    print('gaze stage headless       {:8.1f} frames/s'.format(headless))
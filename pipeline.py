@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+from collections import deque
+
+
+class LatestQueue:
+    """
+    Bounded queue that never blocks the producer.
+    When it is full the oldest item is dropped, so consumers always work on the newest frame.
+    """
+
+    def __init__(self, maxsize=1):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._lock:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        # raises queue.Empty on timeout
+        return self._queue.get(timeout=timeout)
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+class Stage:
+    """
+    A pipeline stage running `fn` on its own worker thread.
+    `fn` takes a frame and returns it (possibly updated), or None to drop the frame.
+    """
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.input = None
+        self.output = None
+        self.thread = None
+        self.processed = 0
+        self.busy_time = 0.0
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                frame = self.input.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                frame = self.fn(frame)
+            except Exception as e:
+                print("Error in stage {}: {}".format(self.name, e))
+                frame = None
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+
+            if frame is not None:
+                self.output.put(frame)
+
+
+class FramePipeline:
+    """
+    Runs capture and processing stages concurrently, connected by bounded drop-oldest queues.
+
+        capture thread -> [queue] -> stage 1 -> [queue] -> ... -> stage n -> [queue] -> get()
+
+    The last queue is drained by the caller (normally the main thread, which owns the
+    OpenCV windows), so decisions are always made on the newest processed frame.
+    """
+
+    def __init__(self, read_frame, stages, queue_size=1, fps_window=30):
+        """
+        :param read_frame: Callable returning the next frame, or None when there is nothing to read.
+                           Returning False stops the pipeline (e.g. the camera was released).
+        :param stages: List of Stage objects, run in order.
+        :param queue_size: Capacity of every inter-stage queue.
+        :param fps_window: Number of completed frames used to compute the end-to-end fps.
+        """
+        self.read_frame = read_frame
+        self.stages = stages
+        self.queues = [LatestQueue(queue_size) for _ in range(len(stages) + 1)]
+        for i, stage in enumerate(stages):
+            stage.input = self.queues[i]
+            stage.output = self.queues[i + 1]
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._done_times = deque(maxlen=fps_window)
+        self.captured = 0
+        self.completed = 0
+        self.latency = 0.0
+
+    def _capture(self):
+        while not self._stop.is_set():
+            frame = self.read_frame()
+            if frame is False:
+                self._stop.set()
+                break
+            if frame is None:
+                continue
+            frame['captured_at'] = time.perf_counter()
+            self.captured += 1
+            self.queues[0].put(frame)
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._capture, name='capture', daemon=True)]
+        for stage in self.stages:
+            self._threads.append(threading.Thread(target=stage.run, args=(self._stop,),
+                                                  name=stage.name, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def is_running(self):
+        return not self._stop.is_set()
+
+    def get(self, timeout=0.1):
+        """
+        :returns: The newest fully processed frame, or None if none arrived within `timeout`.
+        """
+        try:
+            frame = self.queues[-1].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        now = time.perf_counter()
+        self._done_times.append(now)
+        self.completed += 1
+        self.latency = now - frame.get('captured_at', now)
+        return frame
+
+    def fps(self):
+        # End-to-end fps over the last `fps_window` completed frames
+        if len(self._done_times) < 2:
+            return 0.0
+        span = self._done_times[-1] - self._done_times[0]
+        return (len(self._done_times) - 1) / span if span > 0 else 0.0
+
+    def stats(self):
+        """
+        :returns: Dict with end-to-end fps and latency, plus per-stage queue depth, drops and mean service time.
+        """
+        stages = {'capture': {'depth': self.queues[0].depth(),
+                              'dropped': self.queues[0].dropped,
+                              'frames': self.captured}}
+        for stage in self.stages:
+            out = stage.output
+            stages[stage.name] = {'depth': out.depth(),
+                                  'dropped': out.dropped,
+                                  'frames': stage.processed,
+                                  'mean_ms': 1000.0 * stage.busy_time / stage.processed if stage.processed else 0.0}
+        return {'fps': self.fps(),
+                'latency_ms': 1000.0 * self.latency,
+                'completed': self.completed,
+                'stages': stages}
+
+    def format_stats(self):
+        stats = self.stats()
+        parts = ["{}: q={} drop={}".format(name, s['depth'], s['dropped']) for name, s in stats['stages'].items()]
+        return "Pipeline {:.1f} fps, latency {:.0f} ms | {}".format(stats['fps'], stats['latency_ms'], ", ".join(parts))
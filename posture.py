@@ -2,12 +2,15 @@ import cv2
 import logger as logger
 
 from detector import PoseDetector, PoseLandmarks
-from deviation import Deviation
+from deviation import Deviation, posture_deviation
 from logger import Logger
 from typing import Union
 import time
+import threading
 from notification import Notification
-from file_manager import FileManager
+from alerts import AlertDispatcher
+from event_store import get_event_store
+from camera_hub import open_capture_device
 
 class BasePosture:
     """
@@ -35,7 +38,12 @@ class PostureWatcher:
                  deviation_buffer=3,
                  base_posture=None,
                  debug=True,
-                 notify=Notification(),):
+                 notify=Notification(),
+                 max_flush=5,
+                 fresh_grab_time=0.01,
+                 pose_options=None,
+                 camera=None,
+                 alerts=None,):
         
         
         """
@@ -47,11 +55,17 @@ class PostureWatcher:
         :param deviation_buffer: The number of consecutive deviations to allow before triggering an alert
         :param base_posture: The base posture to compare to
         :param debug: Whether to print debug messages
+        :param max_flush: Most buffered frames to drop before a sample
+        :param fresh_grab_time: A grab that takes longer than this (seconds) waited for a new frame
+        :param pose_options: PoseDetector settings, e.g. {'model_complexity': 0, 'downscale': 0.5, 'use_roi': True}
+        :param camera: Shared CameraHub, or None to open the webcam directly
+        :param alerts: Shared AlertDispatcher, or None for one of its own
         """
-        self.detector = PoseDetector()
+        self.detector = PoseDetector(**(pose_options or {}))
         self.deviation = Deviation(threshold=deviation_threshold, max_buffer=deviation_buffer)
 
         self.cap = None
+        self.camera = camera
 
 
         self.base_posture = base_posture
@@ -61,17 +75,49 @@ class PostureWatcher:
 
         self.thread = None
         self.debug = debug
-        self.logger = Logger('PW')
-        self.file_path = "FILES/posture_data.txt"
         self.notify = notify
-        self.file = FileManager()
+        # Posture alerts are queued and delivered on the dispatcher's thread
+        self.alerts = alerts or AlertDispatcher(notify)
+        self.logger = Logger('PW', alerts=self.alerts)
+        self.events = get_event_store()
+
+        self.max_flush = max_flush
+        self.fresh_grab_time = fresh_grab_time
+        # The camera and the pose detector are shared by the sampler thread and the UI thread
+        self._lock = threading.Lock()
+        self.sampler = None
 
     def get_video_capture_device(self):
-        # Check if cv2.VideoCapture(1) is available
-        if cv2.VideoCapture(1).isOpened():
-            return cv2.VideoCapture(1)
-        else:
-            return cv2.VideoCapture(0)       
+        # A CameraHub subscription reads like a cv2.VideoCapture
+        if self.camera is not None:
+            return self.camera.subscribe('posture')
+        # Prefers cv2.VideoCapture(1); the probe result is cached
+        cap = open_capture_device()
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 720)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # Honoured by some backends only; read_frame flushes the buffer either way
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def read_frame(self):
+        """
+        Reads a frame captured now rather than one left in the camera buffer.
+        With a sample every few seconds, read() returns a frame from seconds ago, so buffered frames are
+        grabbed and dropped first: a grab that returns at once came from the buffer, one that waits is new.
+        :returns: The BGR frame, or None if the camera returned nothing.
+        """
+        if not isinstance(self.cap, cv2.VideoCapture):
+            # CameraHub subscription: wait for the next frame the hub decodes
+            ok, img = self.cap.read(fresh=True)
+            return img if ok else None
+        for _ in range(self.max_flush):
+            start = time.perf_counter()
+            if not self.cap.grab():
+                return None
+            if time.perf_counter() - start > self.fresh_grab_time:
+                break
+        ok, img = self.cap.retrieve()
+        return img if ok else None
 
     def run(self):
         """
@@ -80,25 +126,43 @@ class PostureWatcher:
         if not self.base_posture:
             return
 
-        _, img = self.cap.read()
-        img, _ = self.detector.find_pose(img)
         self.deviation.current_deviation = self._get_deviation_from_base_posture()
         self._handle_deviation()
 
+    @property
+    def latest_deviation(self):
+        # Last deviation measured by run(), for the UI
+        return self.deviation.current_deviation
+
+    def start(self, interval=None):
+        """
+        Starts sampling the posture on a background thread every `interval` seconds (default: deviation_interval).
+        """
+        if self.sampler is None:
+            self.sampler = PostureSampler(self, interval or self.deviation_interval)
+            self.sampler.start()
+
     def stop(self):
         """
         Stops Posture Watcher and destroys allocated resources.
         """
-        self.cap.release()
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+        if self.cap is not None:
+            with self._lock:
+                self.cap.release()
         cv2.destroyAllWindows()
 
     def set_base_posture(self):
-        self.cap = self.get_video_capture_device()
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 720)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        if self.cap is None:
+            self.cap = self.get_video_capture_device()
         self.last_fps_calc_timestamp = 0
-        _, img = self.cap.read()
-        _, lm = self.detector.find_pose(img)
+        with self._lock:
+            img = self.read_frame()
+            if img is None:
+                return
+            _, lm = self.detector.find_pose(img)
 
         if lm:
             nose = lm[PoseLandmarks.NOSE]
@@ -111,25 +175,21 @@ class PostureWatcher:
         if self.base_posture is None:
             return None
 
-        _, img = self.cap.read()
-        _, lm = self.detector.find_pose(img)
+        # One fresh frame and one pose per sample
+        with self._lock:
+            img = self.read_frame()
+            if img is None:
+                return None
+            _, lm = self.detector.find_pose(img)
         deviation = 100
 
         if not lm:  # No pose found
             return deviation
         
-        nose = abs(self.base_posture.nose.x - lm[0].x) + abs(self.base_posture.nose.y - lm[0].y) + abs(
-            self.base_posture.nose.z - lm[0].z)
-
-        l_shoulder = abs(self.base_posture.left_shoulder.x - lm[11].x) + abs(self.base_posture.left_shoulder.y - lm[11].y) + \
-            abs(self.base_posture.left_shoulder.z - lm[11].z)
-        r_shoulder = abs(self.base_posture.right_shoulder.x - lm[12].x) + abs(self.base_posture.right_shoulder.y - lm[12].y) + \
-            abs(self.base_posture.right_shoulder.z - lm[12].z)
-
-        deviation = int(
-
-            ((nose + l_shoulder + r_shoulder) / (self.base_posture.nose.x + self.base_posture.left_shoulder.x +
-                self.base_posture.right_shoulder.x) * 100))
+        deviation = posture_deviation(self.base_posture.nose, self.base_posture.left_shoulder,
+                                      self.base_posture.right_shoulder,
+                                      lm[PoseLandmarks.NOSE], lm[PoseLandmarks.LEFT_SHOULDER],
+                                      lm[PoseLandmarks.RIGHT_SHOULDER])
 
         adjusted_deviation = 100 if deviation >= 100 else int(deviation - self.deviation_adjustment)
         return adjusted_deviation
@@ -146,13 +206,13 @@ class PostureWatcher:
         else:
             if cd < 25:
                 self.logger.notify(f"✅ Great posture! {cd}% (Buf: {buffer})", color='green')
-                self.file.save_progress ("Posture","Good-Posture", self.file_path)
+                self.events.record("Posture", "Good-Posture")
             elif cd < 35:
                 self.logger.notify(f"⚠️ Improve your posture! {cd}% (Buf: {buffer})", color='yellow')
-                self.file.save_progress ("Posture","Neutral-Posture", self.file_path)
+                self.events.record("Posture", "Neutral-Posture")
             else:
                 self.logger.notify(f"️ Fix your posture! {cd}% (Buf: {buffer})", color='red')
-                self.file.save_progress ("Posture","Poor-Posture", self.file_path)
+                self.events.record("Posture", "Poor-Posture")
 
         if self.debug:
             self.logger.notify(f"Deviation buffer: {buffer}", color='white')
@@ -169,3 +229,39 @@ class PostureWatcher:
 
         self._log_deviation(cd, buffer)
 
+
+class PostureSampler:
+    """
+    Calls PostureWatcher.run on its own thread every `interval` seconds, so the camera read and pose
+    detection never block the menu bar UI, which only reads watcher.latest_deviation.
+    """
+
+    def __init__(self, watcher: PostureWatcher, interval=5):
+        self.watcher = watcher
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+        self.last_duration = 0.0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='posture-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                self.watcher.run()
+            except Exception as e:
+                print(f"Error in posture sampler: {e}")
+            self.last_duration = time.perf_counter() - start
+            self.samples += 1
+            # Keep the sampling period steady regardless of how long the sample took
+            self._stop.wait(max(self.interval - self.last_duration, 0.0))
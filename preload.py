@@ -0,0 +1,185 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+# Modules behind each part of the app, and the frameworks they pull in. Nothing here is imported
+# when the menu bar app starts; each part imports its modules on first use, or the Preloader
+# imports them in the background once the menu is up.
+FRAMEWORKS = {
+    'posture': ('posture', 'beepy'),                                # mediapipe, alert sounds
+    'eye-strain': ('EmotionMonitor', 'gaze_engine', 'keras.models'),  # dlib, torch, TensorFlow/Keras
+    'reports': ('plotly.express',),                                 # plotly
+}
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds each module took to import through load(), by module name
+import_times = {}
+_lock = threading.Lock()
+
+
+def load(name):
+    """
+    Imports module `name` (once) and records how long the first import took.
+    Safe from any thread; a thread asking for a module being preloaded waits for it.
+    :returns: The module.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    with metrics.timer('module_import_seconds', 'First imports of lazily loaded modules'):
+        module = importlib.import_module(name)
+    with _lock:
+        import_times.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+class Preloader:
+    """
+    Imports the frameworks of the given parts of the app on a daemon thread, so the first use of a
+    monitor or chart does not wait for them. Parts are loaded in order; a part whose frameworks are
+    missing is skipped.
+    """
+
+    def __init__(self, parts=('posture', 'eye-strain', 'reports'), delay=0.0):
+        """
+        :param parts: Keys of FRAMEWORKS to preload, most likely needed first.
+        :param delay: Seconds to wait before starting, leaving the CPU to the UI.
+        """
+        self.parts = tuple(parts)
+        self.delay = delay
+        self.loaded = {}  # part -> seconds, or the ImportError
+        self._done = {part: threading.Event() for part in self.parts}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='preload', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        time.sleep(self.delay)
+        for part in self.parts:
+            start = time.perf_counter()
+            try:
+                for name in FRAMEWORKS[part]:
+                    load(name)
+                self.loaded[part] = time.perf_counter() - start
+            except ImportError as e:
+                self.loaded[part] = e
+                print(f"Not preloading {part}: {e}")
+            finally:
+                self._done[part].set()
+
+    def wait(self, part, timeout=None):
+        """
+        :returns: True once `part` has been preloaded (or skipped), False on timeout.
+        """
+        return self._done[part].wait(timeout)
+
+
+def _import_breakdown(python, modules):
+    # Import time (ms) spent in each top-level package pulled in by importing `modules`
+    import subprocess
+
+    code = '; '.join('import {}'.format(name) for name in modules) or 'pass'
+    result = subprocess.run([python, '-X', 'importtime', '-c', code], capture_output=True, text=True, cwd=_ROOT)
+    if result.returncode != 0:
+        return None
+    packages = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"; nesting is indented
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        self_us = fields[0].rsplit(':', 1)[-1].strip()
+        if not self_us.isdigit() or not fields[2].strip():
+            continue
+        top = fields[2].strip().split('.')[0]
+        packages[top] = packages.get(top, 0.0) + int(self_us) / 1000.0
+    return packages
+
+
+# Imports combine-app and builds the Application with its menu, as the app does before its first
+# render; the eager variant also imports what combine-app imported at module load before.
+_STARTUP = '''
+import importlib.util, sys, time
+start = time.perf_counter()
+{eager}
+spec = importlib.util.spec_from_file_location('combine_app', 'combine-app.py')
+app_module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app_module)
+imported = time.perf_counter() - start
+app = app_module.Application(preload=False)
+print(imported, time.perf_counter() - start)
+'''
+
+
+def _time_to_menu(python, eager):
+    import subprocess
+
+    modules = [name for part in FRAMEWORKS for name in FRAMEWORKS[part]] if eager else []
+    code = _STARTUP.format(eager='\n'.join('import {}'.format(name) for name in modules))
+    result = subprocess.run([python, '-c', code], capture_output=True, text=True, cwd=_ROOT)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'
+    imported, menu = (float(x) for x in result.stdout.split()[-2:])
+    return (imported, menu), None
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import statistics
+
+    # Startup benchmark: time from interpreter start of the app code to its menu being built, with
+    # the frameworks loaded lazily and (as before) eagerly, and what each part costs to import.
+    # Every measurement runs in a fresh interpreter.
+    parser = argparse.ArgumentParser(description="Menu bar app startup and import-time benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="startups measured per variant")
+    parser.add_argument('--budget-ms', type=float,
+                        help="exit with an error if the lazy time to menu (median) exceeds this")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    python = sys.executable
+
+    report = {'time_to_menu_ms': {}, 'imports_ms': {}}
+    for variant, eager in (('lazy', False), ('eager', True)):
+        runs, error = [], None
+        for _ in range(args.repeat):
+            times, error = _time_to_menu(python, eager)
+            if times is None:
+                break
+            runs.append(times)
+        if not runs:
+            print('{:6} time to menu: not measured ({})'.format(variant, error))
+            continue
+        imported = 1000 * statistics.median(r[0] for r in runs)
+        menu = 1000 * statistics.median(r[1] for r in runs)
+        report['time_to_menu_ms'][variant] = {'imports': imported, 'menu': menu}
+        print('{:6} time to menu {:8.1f} ms   (module imports {:8.1f} ms)'.format(variant, menu, imported))
+
+    for part, modules in FRAMEWORKS.items():
+        packages = _import_breakdown(python, modules)
+        if packages is None:
+            print('{:11} not installed'.format(part))
+            continue
+        report['imports_ms'][part] = packages
+        top = sorted(packages.items(), key=lambda item: -item[1])[:5]
+        print('{:11} {:8.1f} ms   {}'.format(part, sum(packages.values()),
+                                             '  '.join('{} {:.0f}'.format(name, ms) for name, ms in top)))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+    lazy = report['time_to_menu_ms'].get('lazy')
+    if args.budget_ms is not None and lazy is None:
+        sys.exit('Time to menu could not be measured')
+    if args.budget_ms is not None and lazy['menu'] > args.budget_ms:
+        sys.exit('Time to menu {:.1f} ms is over the {:.1f} ms budget'.format(lazy['menu'], args.budget_ms))
@@ -1,28 +1,18 @@
-import plotly.express as px
 import datetime
 
+from event_store import get_event_store, days_start
+from preload import load
+
 
 class Progress :
 
-    def show_pie_chart(self, file_path, context, title):
-        # Read data from the saved file
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        # Extract the detected emotions from the file
-        detected_emotions = []
-        for line in lines:
-            if context in line:
-                emotion = line.split(" : ")[-1].strip()
-                detected_emotions.append(emotion)
-
-        # Count occurrences of each emotion
-        emotions_count = {}
-        for emotion in detected_emotions:
-            if emotion in emotions_count:
-                emotions_count[emotion] += 1
-            else:
-                emotions_count[emotion] = 1
+    def __init__(self, events=None):
+        self.events = events or get_event_store()
+
+    def show_pie_chart(self, context, title, days=1):
+        # Count the last `days` days of events of this kind (e.g. "Posture" or "Detected-Emotion")
+        # by value; read from the daily rollups, so a month costs about as much as today
+        emotions_count = self.events.counts(context, days_start(days))
 
         # Create a pie chart using Plotly Express
         labels = list(emotions_count.keys())
@@ -31,8 +21,25 @@ class Progress :
         # Adding current date to the title
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
         title_with_date = f"{title} - {current_date}"
+        if days > 1:
+            title_with_date = f"{title} - last {days} days to {current_date}"
 
+        # plotly is imported on the first chart (or by the preloader), not with the app
+        px = load('plotly.express')
         fig = px.pie(names=labels, values=counts, title=title_with_date)
 
         # Show the pie chart
-        fig.show() 
\ No newline at end of file
+        fig.show()
+
+    def show_history(self, context, title, days=28, resolution='day'):
+        # One stacked bar per day (or hour) of the last `days` days, from the rollups
+        rows = self.events.rollup(context, resolution, days_start(days))
+
+        times = [datetime.datetime.fromtimestamp(bucket) for bucket, _, _ in rows]
+        labels = [value for _, value, _ in rows]
+        counts = [count for _, _, count in rows]
+
+        px = load('plotly.express')
+        fig = px.bar(x=times, y=counts, color=labels, title=f"{title} - last {days} days",
+                     labels={'x': resolution.capitalize(), 'y': 'Count', 'color': context})
+        fig.show()
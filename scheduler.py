@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+
+
+class StageScheduler:
+    """
+    Decides how often each monitoring stage runs.
+
+    Every stage declares a target rate in Hz (None = every frame). A stage whose state is stable
+    has its rate halved step by step down to its minimum, and snaps back to the target as soon
+    as the state changes. With a CPU budget (CPU-seconds per second, 1.0 = one core) the
+    rate-limited stages are scaled down together when the measured stage costs exceed it.
+    Every-frame stages are never throttled; they only count towards the budget.
+    """
+
+    def __init__(self, rates, min_rates=None, cpu_budget=None, window=5.0, cost_smoothing=0.1):
+        """
+        :param rates: Dict of stage name -> target rate in Hz, or None to run on every frame.
+        :param min_rates: Dict of stage name -> lowest rate the scheduler may use (default: target / 4).
+        :param cpu_budget: CPU-seconds per second available to the stages, or None for no limit.
+        :param window: Seconds over which achieved rates are measured.
+        :param cost_smoothing: Weight of the newest sample in the running cost average.
+        """
+        min_rates = min_rates or {}
+        self.cpu_budget = cpu_budget
+        self.window = window
+        self.cost_smoothing = cost_smoothing
+        self._lock = threading.Lock()
+        self._stages = {}
+        for name, rate in rates.items():
+            self._stages[name] = {'target': rate,
+                                  'min': min_rates.get(name, rate / 4.0 if rate else None),
+                                  'rate': rate,
+                                  'stability': 1.0,
+                                  'cost': 0.0,
+                                  'last_run': 0.0,
+                                  'runs': deque()}
+        self.budget_scale = 1.0
+
+    def due(self, name, now=None):
+        """
+        :returns: True if the stage should run on this frame.
+        """
+        stage = self._stages[name]
+        if stage['rate'] is None:
+            return True
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            return now - stage['last_run'] >= 1.0 / stage['rate']
+
+    def rate(self, name):
+        """
+        :returns: The stage's current rate in Hz, or None if it runs on every frame.
+        """
+        with self._lock:
+            return self._stages[name]['rate']
+
+    def record(self, name, duration, now=None):
+        """
+        Records that the stage ran and took `duration` seconds.
+        """
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            stage = self._stages[name]
+            stage['last_run'] = now
+            if stage['runs']:
+                stage['cost'] += self.cost_smoothing * (duration - stage['cost'])
+            else:
+                stage['cost'] = duration
+            stage['runs'].append(now)
+            while stage['runs'] and now - stage['runs'][0] > self.window:
+                stage['runs'].popleft()
+            self._update_rates(now)
+
+    def mark_stable(self, name, stable):
+        """
+        Lowers the stage rate while its output is stable, restores it when it changes.
+        """
+        with self._lock:
+            stage = self._stages[name]
+            if stage['target'] is None:
+                return
+            stage['stability'] = max(stage['stability'] * 0.5, stage['min'] / stage['target']) if stable else 1.0
+            self._update_rates(time.perf_counter())
+
+    def _achieved(self, stage, now):
+        runs = [t for t in stage['runs'] if now - t <= self.window]
+        return len(runs) / self.window
+
+    def _update_rates(self, now):
+        scale = 1.0
+        if self.cpu_budget is not None:
+            fixed = sum(s['cost'] * self._achieved(s, now) for s in self._stages.values() if s['target'] is None)
+            wanted = sum(s['cost'] * s['target'] * s['stability'] for s in self._stages.values() if s['target'])
+            if wanted > 0:
+                scale = min(1.0, max(self.cpu_budget - fixed, 0.0) / wanted)
+        self.budget_scale = scale
+
+        for stage in self._stages.values():
+            if stage['target'] is not None:
+                stage['rate'] = max(stage['min'], stage['target'] * stage['stability'] * scale)
+
+    def stats(self):
+        """
+        :returns: Dict of stage name -> target, current and achieved rate (Hz) and mean cost (ms).
+        """
+        now = time.perf_counter()
+        with self._lock:
+            return {name: {'target_hz': s['target'],
+                           'rate_hz': s['rate'],
+                           'achieved_hz': self._achieved(s, now),
+                           'cost_ms': 1000.0 * s['cost']}
+                    for name, s in self._stages.items()}
+
+    def format_stats(self):
+        parts = []
+        for name, s in self.stats().items():
+            target = 'frame' if s['target_hz'] is None else '{:.1f}'.format(s['rate_hz'])
+            parts.append('{}: {:.1f} Hz (target {}, {:.1f} ms)'.format(name, s['achieved_hz'], target, s['cost_ms']))
+        return 'Stage rates | ' + ', '.join(parts)
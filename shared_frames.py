@@ -0,0 +1,235 @@
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Header layout (int64 fields): write counter, closed flag, then per slot its sequence number and
+# frame index; per-slot float64 timestamps follow. Frame data starts at a 64-byte boundary.
+_COUNTER, _CLOSED, _FIXED = 0, 1, 2
+
+
+def _attach_shared_memory(name):
+    # Only the owner may unlink the block. Workers spawned by the owner share its resource tracker,
+    # so on older Pythons a plain attach is safe (unregistering there would drop the owner's entry).
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing:
+    """
+    Ring buffer of camera frames in multiprocessing.shared_memory: one writer, any number of
+    reader processes.
+
+    Each slot carries a sequence number used as a seqlock: the writer marks the slot as being
+    written (-1), copies the frame in and then publishes its sequence number. A reader copies
+    the newest slot and keeps the copy only if the sequence number did not change meanwhile, so
+    frames are never torn even though nothing is locked across processes.
+    """
+
+    def __init__(self, shm, slots, shape, dtype=np.uint8, owner=False):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+
+        header_fields = _FIXED + 2 * slots
+        self._header = np.ndarray((header_fields,), np.int64, shm.buf)
+        self._sequence = self._header[_FIXED:_FIXED + slots]
+        self._frame_index = self._header[_FIXED + slots:]
+        self._timestamp = np.ndarray((slots,), np.float64, shm.buf, offset=8 * header_fields)
+        self._data = np.ndarray((slots,) + self.shape, self.dtype, shm.buf,
+                                offset=self._data_offset(slots))
+
+    @staticmethod
+    def _data_offset(slots):
+        header = 8 * (_FIXED + 3 * slots)
+        return (header + 63) // 64 * 64
+
+    @classmethod
+    def create(cls, slots, shape, dtype=np.uint8):
+        size = cls._data_offset(slots) + slots * int(np.prod(shape)) * np.dtype(dtype).itemsize
+        ring = cls(shared_memory.SharedMemory(create=True, size=size), slots, shape, dtype, owner=True)
+        ring._header[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        :param spec: SharedFrameRing.spec of the ring created by the owner process.
+        """
+        name, slots, shape, dtype = spec
+        return cls(_attach_shared_memory(name), slots, shape, dtype)
+
+    @property
+    def spec(self):
+        # Picklable description passed to worker processes
+        return (self.shm.name, self.slots, self.shape, self.dtype.str)
+
+    @property
+    def counter(self):
+        return int(self._header[_COUNTER])
+
+    @property
+    def closed(self):
+        return bool(self._header[_CLOSED])
+
+    def write(self, frame, frame_index, timestamp):
+        n = self.counter + 1
+        slot = n % self.slots
+        self._sequence[slot] = -1
+        self._data[slot] = frame
+        self._frame_index[slot] = frame_index
+        self._timestamp[slot] = timestamp
+        self._sequence[slot] = n
+        self._header[_COUNTER] = n
+
+    def read(self, after=0, retries=3):
+        """
+        :param after: Only return a frame newer than this sequence number.
+        :returns: (sequence, frame copy, frame index, timestamp), or None if there is no newer frame.
+        """
+        for _ in range(retries):
+            n = self.counter
+            if n <= after:
+                return None
+            slot = n % self.slots
+            if self._sequence[slot] != n:
+                continue
+            frame = self._data[slot].copy()
+            frame_index, timestamp = int(self._frame_index[slot]), float(self._timestamp[slot])
+            if self._sequence[slot] == n:
+                return n, frame, frame_index, timestamp
+        return None
+
+    def close(self):
+        if self.owner:
+            self._header[_CLOSED] = 1
+        # Views into the buffer must go before the mapping can be closed
+        self._header = self._sequence = self._frame_index = self._timestamp = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingSubscription:
+    """
+    Reads a SharedFrameRing with the CameraHub subscription (and cv2.VideoCapture) interface,
+    so the monitors run unchanged inside a worker process.
+    """
+
+    def __init__(self, ring, name, rate=None, size=None, poll_interval=0.005):
+        self.ring = ring
+        self.name = name
+        self.rate = rate
+        self.size = size
+        self.poll_interval = poll_interval
+        self._read_sequence = 0
+        self._last_read = 0.0
+        self._closed = False
+        self.frame_index = 0
+        self.timestamp = None
+
+    def isOpened(self):
+        return not self._closed and not self.ring.closed
+
+    def read(self, timeout=2.0, fresh=False):
+        """
+        :param fresh: Wait for a frame written after this call.
+        :returns: (True, frame) or (False, None) on timeout or when the ring was closed.
+        """
+        if self.rate:
+            wait = self._last_read + 1.0 / self.rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        after = self.ring.counter if fresh else self._read_sequence
+        deadline = time.time() + timeout
+        while self.isOpened():
+            result = self.ring.read(after)
+            if result is not None:
+                self._read_sequence, frame, self.frame_index, self.timestamp = result
+                self._last_read = time.time()
+                if self.size is not None and frame.shape[1::-1] != tuple(self.size):
+                    frame = cv2.resize(frame, tuple(self.size), interpolation=cv2.INTER_AREA)
+                return True, frame
+            if time.time() > deadline:
+                break
+            time.sleep(self.poll_interval)
+        return False, None
+
+    def release(self):
+        self._closed = True
+
+
+class RingCamera:
+    """
+    Worker-side stand-in for a CameraHub: subscriptions read from the shared ring.
+    """
+
+    def __init__(self, spec):
+        self.ring = SharedFrameRing.attach(spec)
+
+    def subscribe(self, name, rate=None, size=None):
+        return RingSubscription(self.ring, name, rate, size)
+
+    def close(self):
+        self.ring.close()
+
+
+class RingFeeder:
+    """
+    Copies the frames of a CameraHub into a SharedFrameRing on a background thread of the owner
+    (UI) process. The ring is sized from the first frame, so start() waits for the camera.
+    """
+
+    def __init__(self, hub, slots=4):
+        self.hub = hub
+        self.slots = slots
+        self.ring = None
+        self._subscription = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def spec(self):
+        return self.ring.spec
+
+    def start(self, timeout=5.0):
+        if self._thread is not None:
+            return
+        self._subscription = self.hub.subscribe('processes')
+        ok, frame = self._subscription.read(timeout=timeout)
+        if not ok:
+            self._subscription.release()
+            raise RuntimeError("No frame from the camera")
+        self.ring = SharedFrameRing.create(self.slots, frame.shape, frame.dtype)
+        self.ring.write(frame, self._subscription.frame_index, self._subscription.timestamp)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ring-feeder', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ok, frame = self._subscription.read(timeout=0.5)
+            if ok:
+                if frame.shape != self.ring.shape:
+                    frame = cv2.resize(frame, self.ring.shape[1::-1])
+                self.ring.write(frame, self._subscription.frame_index, self._subscription.timestamp)
+            elif not self._subscription.isOpened():
+                break
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+        if self._subscription is not None:
+            self._subscription.release()
+            self._subscription = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None